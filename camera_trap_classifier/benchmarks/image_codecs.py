@@ -0,0 +1,88 @@
+""" Benchmark Image Codecs used to create TFRecord files
+
+Compares the throughput of the image codecs and checks that they produce
+images of identical size.
+
+Example Usage:
+--------------
+python -m camera_trap_classifier.benchmarks.image_codecs \
+-image_dir /my_images/ \
+-n_images 200 \
+-image_save_side_smallest 500 \
+-image_save_quality 90
+"""
+import io
+import time
+import textwrap
+import argparse
+
+import tensorflow as tf
+from PIL import Image
+
+from camera_trap_classifier.data.image_codec import ImageCodec
+from camera_trap_classifier.data.utils import list_pictures
+
+tf.enable_eager_execution()
+
+
+def benchmark_codec(codec, image_paths, smallest_side, image_save_quality):
+    """ Process all images with a codec
+        Returns: elapsed seconds, list of output sizes (width, height),
+                 list of output bytes
+    """
+    # read all images once to exclude disk reads from the measurement
+    file_bytes_list = [codec.read_image_from_disk(x) for x in image_paths]
+    jpegs = list()
+    start_time = time.time()
+    for file_bytes in file_bytes_list:
+        jpegs.append(codec.resize_and_convert_to_jpeg(
+            file_bytes, smallest_side, image_save_quality))
+    elapsed = time.time() - start_time
+    sizes = [Image.open(io.BytesIO(x)).size for x in jpegs]
+    n_bytes = [len(x) for x in jpegs]
+    return elapsed, sizes, n_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BENCHMARK IMAGE CODECS')
+    parser.add_argument("-image_dir", type=str, required=True,
+                        help="directory with images (incl. sub-dirs)")
+    parser.add_argument("-n_images", type=int, default=200,
+                        help="max number of images to process")
+    parser.add_argument("-codecs", nargs='+', type=str,
+                        default=['tensorflow', 'pillow'],
+                        help="codecs to compare, the first is the reference")
+    parser.add_argument("-image_save_side_smallest", type=int, default=500)
+    parser.add_argument("-image_save_quality", type=int, default=90)
+
+    args = vars(parser.parse_args())
+
+    image_paths = list_pictures(args['image_dir'])
+    image_paths.sort()
+    image_paths = image_paths[0:args['n_images']]
+    n_images = len(image_paths)
+    print("Benchmarking %s images" % n_images)
+
+    results = dict()
+    for codec_type in args['codecs']:
+        codec = ImageCodec.create(codec_type)
+        results[codec_type] = benchmark_codec(
+            codec, image_paths,
+            args['image_save_side_smallest'],
+            args['image_save_quality'])
+
+    ref_type = args['codecs'][0]
+    ref_elapsed, ref_sizes, ref_bytes = results[ref_type]
+    for codec_type, (elapsed, sizes, n_bytes) in results.items():
+        n_size_mismatch = sum(x != y for x, y in zip(sizes, ref_sizes))
+        msg = ("Codec: %s - %.1f images/s - speedup vs %s: %.2fx - \
+              images with different size: %s / %s - \
+              output bytes vs %s: %.3f" %
+              (codec_type, n_images / elapsed, ref_type,
+               ref_elapsed / elapsed, n_size_mismatch, n_images,
+               ref_type, sum(n_bytes) / sum(ref_bytes)))
+        print(textwrap.shorten(msg, width=200))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+""" Benchmark Raw (uint8) versus JPEG Images in TFRecord Files
+
+Writes the same images once as jpeg (aspect preserving resize) and once
+as raw uint8 pixels (resized to the model input size) and compares the
+size per record with the throughput and CPU time of decoding the records
+to model-sized images.
+
+Example Usage:
+--------------
+python -m camera_trap_classifier.benchmarks.raw_image_format \
+-image_dir /my_images/ \
+-output_dir /tmp/raw_benchmark/ \
+-n_images 500 \
+-image_raw_size 96 96
+"""
+import os
+import time
+import textwrap
+import argparse
+
+import tensorflow as tf
+
+from camera_trap_classifier.data.image_codec import ImageCodec
+from camera_trap_classifier.data.tfr_encoder_decoder import (
+    DefaultTFRecordEncoderDecoder)
+from camera_trap_classifier.data.utils import list_pictures
+
+tf.enable_eager_execution()
+
+
+def write_tfr_file(output_path, encoder_decoder, images):
+    """ Write one record per image to 'output_path' """
+    with tf.python_io.TFRecordWriter(output_path) as writer:
+        for i, image in enumerate(images):
+            record = {
+                'id': str(i), 'n_images': 1, 'n_labels': 1,
+                'image_paths': [str(i)], 'meta_data': '',
+                'labelstext': '', 'label/class': ['0'],
+                'label_num/class': [0], 'images': [image]}
+            writer.write(encoder_decoder.encode_record(record))
+
+
+def benchmark_read(tfr_path, encoder_decoder, height, width, n_repeats):
+    """ Decode all records to images of size height x width
+        Returns: elapsed seconds, cpu seconds, number of records
+    """
+    def resize(image, **kwargs):
+        return tf.image.resize_images(image, [height, width])
+
+    dataset = tf.data.TFRecordDataset(tfr_path)
+    dataset = dataset.repeat(n_repeats)
+    dataset = dataset.map(
+        lambda x: encoder_decoder.decode_record(
+            x, output_labels=['class'],
+            image_pre_processing_fun=resize,
+            image_pre_processing_args={}),
+        num_parallel_calls=1)
+    dataset = dataset.batch(64)
+    n_records = 0
+    start_time = time.time()
+    start_cpu = time.process_time()
+    for features, _ in dataset:
+        n_records += int(features['images'].shape[0])
+    elapsed = time.time() - start_time
+    elapsed_cpu = time.process_time() - start_cpu
+    return elapsed, elapsed_cpu, n_records
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BENCHMARK RAW IMAGE FORMAT')
+    parser.add_argument("-image_dir", type=str, required=True,
+                        help="directory with images to benchmark")
+    parser.add_argument("-output_dir", type=str, required=True,
+                        help="directory to write the TFRecord files to")
+    parser.add_argument("-n_images", type=int, default=500,
+                        help="number of images to use")
+    parser.add_argument("-image_raw_size", type=int, nargs=2,
+                        default=[96, 96], metavar=('HEIGHT', 'WIDTH'),
+                        help="model input size")
+    parser.add_argument("-image_save_side_smallest", type=int, default=500,
+                        help="smallest side of the jpeg images")
+    parser.add_argument("-image_save_quality", type=int, default=90,
+                        help="quality of the jpeg images")
+    parser.add_argument("-n_repeats", type=int, default=3,
+                        help="number of times to read all records")
+
+    args = vars(parser.parse_args())
+
+    if not os.path.exists(args['output_dir']):
+        os.makedirs(args['output_dir'])
+
+    height, width = args['image_raw_size']
+    image_paths = list_pictures(args['image_dir'])[0:args['n_images']]
+    codec = ImageCodec.create('tensorflow')
+    file_bytes_list = [codec.read_image_from_disk(x) for x in image_paths]
+
+    variants = {
+        'jpeg': (
+            DefaultTFRecordEncoderDecoder(),
+            [codec.resize_and_convert_to_jpeg(
+                x, args['image_save_side_smallest'],
+                args['image_save_quality']) for x in file_bytes_list]),
+        'raw': (
+            DefaultTFRecordEncoderDecoder(
+                image_format='raw', image_shape=(height, width, 3)),
+            [codec.resize_and_convert_to_raw(x, height, width)
+             for x in file_bytes_list])}
+
+    results = dict()
+    for image_format, (encoder_decoder, images) in variants.items():
+        output_path = os.path.join(
+            args['output_dir'], '%s.tfrecord' % image_format)
+        write_tfr_file(output_path, encoder_decoder, images)
+        n_bytes = os.path.getsize(output_path)
+        elapsed, elapsed_cpu, n_records = benchmark_read(
+            output_path, encoder_decoder, height, width, args['n_repeats'])
+        results[image_format] = (
+            n_bytes / len(images), elapsed, elapsed_cpu, n_records)
+
+    _, ref_elapsed, ref_cpu, _ = results['jpeg']
+    for image_format, (bytes_per_record, elapsed, elapsed_cpu,
+                       n_records) in results.items():
+        msg = ("Format: %s - %.1f KB per record - \
+              read: %.0f records/s - \
+              read cpu time: %.2fx of jpeg - \
+              read time: %.2fx of jpeg" %
+               (image_format, bytes_per_record / 1024, n_records / elapsed,
+                elapsed_cpu / ref_cpu, elapsed / ref_elapsed))
+        print(textwrap.shorten(msg, width=250))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+""" Benchmark Compressed TFRecord Files
+
+Re-writes existing (uncompressed) TFRecord files with GZIP and ZLIB
+compression and compares the file size, the read throughput and the
+CPU time spent reading each variant.
+
+Example Usage:
+--------------
+python -m camera_trap_classifier.benchmarks.tfrecord_compression \
+-tfr_files /my_data/tfr_files/train_001-of-010.tfrecord \
+-output_dir /tmp/compression_benchmark/
+"""
+import os
+import time
+import textwrap
+import argparse
+
+import tensorflow as tf
+
+from camera_trap_classifier.data.utils import (
+    get_tfr_options, detect_tfr_compression_type)
+
+
+def rewrite_tfr_file(tfr_path, output_path, compression_type):
+    """ Write all records of 'tfr_path' to 'output_path' with
+        'compression_type'
+        Returns: elapsed seconds
+    """
+    read_options = get_tfr_options(detect_tfr_compression_type(tfr_path))
+    start_time = time.time()
+    with tf.python_io.TFRecordWriter(
+            output_path,
+            options=get_tfr_options(compression_type)) as writer:
+        for record in tf.python_io.tf_record_iterator(
+                tfr_path, options=read_options):
+            writer.write(record)
+    return time.time() - start_time
+
+
+def benchmark_read(tfr_paths, compression_type, n_repeats):
+    """ Read all records of 'tfr_paths' with the tf.data API
+        Returns: elapsed seconds, cpu seconds, number of records
+    """
+    dataset = tf.data.TFRecordDataset(
+        tfr_paths, compression_type=compression_type)
+    dataset = dataset.repeat(n_repeats)
+    dataset = dataset.batch(256)
+    batch = dataset.make_one_shot_iterator().get_next()
+    n_records = 0
+    with tf.Session() as sess:
+        start_time = time.time()
+        start_cpu = time.process_time()
+        while True:
+            try:
+                n_records += sess.run(batch).shape[0]
+            except tf.errors.OutOfRangeError:
+                break
+        elapsed = time.time() - start_time
+        elapsed_cpu = time.process_time() - start_cpu
+    return elapsed, elapsed_cpu, n_records
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='BENCHMARK TFRECORD COMPRESSION')
+    parser.add_argument("-tfr_files", nargs='+', type=str, required=True,
+                        help="TFRecord files to benchmark")
+    parser.add_argument("-output_dir", type=str, required=True,
+                        help="directory to write the compressed files to")
+    parser.add_argument("-n_repeats", type=int, default=3,
+                        help="number of times to read all files")
+
+    args = vars(parser.parse_args())
+
+    if not os.path.exists(args['output_dir']):
+        os.makedirs(args['output_dir'])
+
+    results = dict()
+    for compression_type in ['', 'GZIP', 'ZLIB']:
+        output_paths = list()
+        write_seconds = 0
+        for tfr_path in args['tfr_files']:
+            output_path = os.path.join(
+                args['output_dir'], '%s_%s' % (
+                    compression_type or 'NONE', os.path.basename(tfr_path)))
+            write_seconds += rewrite_tfr_file(
+                tfr_path, output_path, compression_type)
+            output_paths.append(output_path)
+        n_bytes = sum(os.path.getsize(x) for x in output_paths)
+        elapsed, elapsed_cpu, n_records = benchmark_read(
+            output_paths, compression_type, args['n_repeats'])
+        results[compression_type or 'NONE'] = (
+            n_bytes, write_seconds, elapsed, elapsed_cpu, n_records)
+
+    ref_bytes, _, ref_elapsed, ref_cpu, _ = results['NONE']
+    for compression_type, (n_bytes, write_seconds, elapsed, elapsed_cpu,
+                           n_records) in results.items():
+        msg = ("Compression: %s - size: %.1f MB (%.3f of uncompressed) - \
+              write: %.1fs - read: %.0f records/s, %.1f MB/s on disk - \
+              read cpu time: %.2fx of uncompressed - \
+              read time: %.2fx of uncompressed" %
+               (compression_type, n_bytes / 1024 ** 2, n_bytes / ref_bytes,
+                write_seconds, n_records / elapsed,
+                args['n_repeats'] * n_bytes / 1024 ** 2 / elapsed,
+                elapsed_cpu / ref_cpu, elapsed / ref_elapsed))
+        print(textwrap.shorten(msg, width=250))
+
+
+if __name__ == '__main__':
+    main()
@@ -11,23 +11,34 @@ python create_dataset.py -inventory ./test_big/cat_dog_dir_test.json \
 -overwrite
 
 """
+import os
 import argparse
 import logging
 
 from camera_trap_classifier.config.logging import setup_logging
 from camera_trap_classifier.data.inventory import DatasetInventoryMaster
+from camera_trap_classifier.data.inventory_stream import (
+    DatasetInventoryStream)
+from camera_trap_classifier.data.inventory_snapshot import (
+    is_inventory_snapshot)
 from camera_trap_classifier.data.writer import DatasetWriter
 from camera_trap_classifier.data.tfr_encoder_decoder import (
     DefaultTFRecordEncoderDecoder)
-from camera_trap_classifier.data.image import (
-    read_image_from_disk_resize_and_convert_to_jpeg)
+from camera_trap_classifier.data.image_codec import ImageCodec
+from camera_trap_classifier.data.image_cache import ImageCache
+from camera_trap_classifier.data.dedup import ImageDeduplicator
+from camera_trap_classifier.data.distributed import (
+    check_worker_index, get_worker_label_mapping_path)
+from camera_trap_classifier.data.utils import read_json, export_dict_to_json
 
 
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(prog='CREATE DATASET')
     parser.add_argument("-inventory", type=str, required=True,
-                        help="path to inventory json file")
+                        help="path to inventory json file (or a binary \
+                              inventory snapshot created with \
+                              -export_snapshot)")
     parser.add_argument("-output_dir", type=str, required=True,
                         help="Directory to which TFRecord files are written")
     parser.add_argument(
@@ -45,12 +56,24 @@ def main():
                         help='split dataset by meta data field in inventory',
                         default=None,
                         required=False)
+    parser.add_argument("-split_n_processes", type=int, default=1,
+                        required=False,
+                        help="number of processes to hash the record ids \
+                              for random splits, speeds up splitting \
+                              inventories with millions of records \
+                              (default 1)")
     parser.add_argument("-balanced_sampling_min", default=False,
                         action='store_true', required=False,
                         help="sample labels balanced to the least frequent\
                               value")
     parser.add_argument("-balanced_sampling_label", default=None, type=str,
                         help='label used for balanced sampling')
+    parser.add_argument("-balanced_sampling_max_per_class", default=None,
+                        type=int, required=False,
+                        help="with balanced_sampling_min: sample at most \
+                              this number of records per label instead of \
+                              the number of records of the least frequent \
+                              label")
     parser.add_argument("-remove_label_name", nargs='+', type=str,
                         default=None,
                         help='remove records with label names (a list) and \
@@ -77,6 +100,44 @@ def main():
                         help="whether to remove records with more than one \
                               observation (multi-label) which is not currently\
                               supported in model training")
+    parser.add_argument("-inventory_backend", type=str, default='dict',
+                        choices=['dict', 'columnar'],
+                        required=False,
+                        help="how to hold the inventory in memory: \
+                              'columnar' stores the records in compact \
+                              arrays which needs a fraction of the memory \
+                              of 'dict' for large inventories \
+                              (default dict)")
+    parser.add_argument("-export_snapshot", type=str, default=None,
+                        required=False,
+                        help="path to save a binary snapshot of the \
+                              inventory (after filtering) with the label \
+                              mapping and the split assignments, which \
+                              can be passed as -inventory to later runs \
+                              and is loaded much faster than json")
+    parser.add_argument("-use_snapshot_splits", default=False,
+                        action='store_true', required=False,
+                        help="use the split assignments stored in the \
+                              snapshot passed as -inventory instead of \
+                              splitting the inventory again")
+    parser.add_argument("-streaming", default=False,
+                        action='store_true', required=False,
+                        help="stream the records from the inventory to the \
+                              TFRecord files without holding the inventory \
+                              in memory, files are written as soon as \
+                              enough records of a split have been read. \
+                              The inventory is read twice (once to collect \
+                              the labels) unless -label_mapping is \
+                              specified. Balanced sampling, de-duplication, \
+                              snapshots, incremental and distributed \
+                              exports and -max_mb_per_file are not \
+                              supported")
+    parser.add_argument("-label_mapping", type=str, default=None,
+                        required=False,
+                        help="path to a label_mapping.json (e.g. of an \
+                              existing dataset) to use for the numeric \
+                              labels, labels not in the mapping are added \
+                              after the existing ones")
     parser.add_argument("-image_root_path", type=str, default=None,
                         help='Root path of all images - will be appended to\
                               the image paths stored in the dataset inventory',
@@ -96,9 +157,64 @@ def main():
                         help="The image quality of the images saved to\
                               TFRecord files. Recommended is 75-90 for good\
                               quality-size trade-off.")
+    parser.add_argument("-image_format", type=str, default='jpeg',
+                        choices=['jpeg', 'raw'],
+                        required=False,
+                        help="Format to store the images: 'raw' stores \
+                              images resized to -image_raw_size as \
+                              uncompressed uint8 pixels which avoids jpeg \
+                              decoding during training (larger files, \
+                              intended for small-resolution models) \
+                              (default jpeg)")
+    parser.add_argument("-image_raw_size", type=int, nargs=2,
+                        default=None,
+                        metavar=('HEIGHT', 'WIDTH'),
+                        required=False,
+                        help="Height and width to resize images to if \
+                              -image_format raw, should be the input size \
+                              of the model (e.g. 96 96)")
+    parser.add_argument("-image_codec", type=str, default='tensorflow',
+                        choices=['tensorflow', 'pillow'],
+                        required=False,
+                        help="Library to read, resize and convert images: \
+                              'pillow' decodes large jpegs at reduced scale \
+                              which is considerably faster than \
+                              'tensorflow' (requires Pillow)")
+    parser.add_argument("-image_cache_dir", type=str, default=None,
+                        required=False,
+                        help="Directory to cache processed images in, \
+                              re-creating TFRecord files with identical \
+                              images and image settings re-uses the cached \
+                              images (default: no caching)")
+    parser.add_argument("-image_cache_max_size_gb", type=float, default=50,
+                        required=False,
+                        help="Max size of the image cache in GB, least \
+                              recently used images are removed if exceeded")
     parser.add_argument("-overwrite", default=False,
                         action='store_true', required=False,
                         help="whether to overwrite existing tfr files")
+    parser.add_argument("-incremental", default=False,
+                        action='store_true', required=False,
+                        help="only encode records which are missing or have \
+                              changed compared to the tfr files in \
+                              output_dir (according to their manifests) and \
+                              append them as new files, re-uses an existing \
+                              label_mapping.json in output_dir")
+    parser.add_argument("-num_workers", type=int,
+                        default=1,
+                        required=False,
+                        help="number of workers (e.g. nodes of a cluster \
+                              with a shared filesystem) creating the \
+                              dataset, each worker is run with identical \
+                              arguments and its -worker_index and writes \
+                              a disjoint subset of the files, run \
+                              merge_dataset_workers.py once all workers \
+                              have finished (default 1)")
+    parser.add_argument("-worker_index", type=int,
+                        default=0,
+                        required=False,
+                        help="index of this worker (0 to num_workers - 1) \
+                              (default 0)")
     parser.add_argument("-write_tfr_in_parallel", default=False,
                         action='store_true', required=False,
                         help="whether to write tfrecords in parallel if more \
@@ -110,8 +226,10 @@ def main():
                               (only if 'write_tfr_in_parallel' is false)")
     parser.add_argument("-process_images_in_parallel_size", type=int,
                         default=320, required=False,
-                        help="if processing images in parallel - how many per \
-                              process, this can influene memory requirements")
+                        help="if processing images in parallel - max number \
+                              of records queued to / returned from the \
+                              worker processes at any time, this can \
+                              influence memory requirements")
     parser.add_argument("-processes_images_in_parallel_n_processes", type=int,
                         default=4, required=False,
                         help="if processing images in parallel - how many \
@@ -123,6 +241,59 @@ def main():
                              Multiple files are generated if the size of\
                              the dataset exceeds this value. It is recommended\
                              to use large values (default 5000)")
+    parser.add_argument("-max_mb_per_file", type=float,
+                        default=None,
+                        required=False,
+                        help="The target size of a TFRecord file in MB. \
+                              Records are distributed such that all files \
+                              have a similar size (estimated from the image \
+                              dimensions). Can be combined with \
+                              max_records_per_file, which is not exceeded \
+                              (default None)")
+    parser.add_argument("-max_parallel_writers", type=int,
+                        default=None,
+                        required=False,
+                        help="if 'write_tfr_in_parallel' - max number of \
+                              TFRecord files written at the same time \
+                              (default number of cpus)")
+    parser.add_argument("-deduplicate_images", type=str,
+                        default=None,
+                        choices=['drop', 'reference'],
+                        required=False,
+                        help="find identical images (by hashing the image \
+                              files) - 'drop': remove duplicate images and \
+                              records without remaining images, \
+                              'reference': keep all records but process \
+                              each unique image only once. Identical images \
+                              in different splits are reported, not \
+                              supported with num_workers > 1 (default None \
+                              - no de-duplication)")
+    parser.add_argument("-deduplicate_n_threads", type=int,
+                        default=32,
+                        required=False,
+                        help="number of threads to hash the images \
+                              (default 32)")
+    parser.add_argument("-compression_type", type=str,
+                        default=None,
+                        choices=['GZIP', 'ZLIB'],
+                        required=False,
+                        help="compress the TFRecord files, reduces the \
+                              size of label and meta-data but not of the \
+                              (already compressed) images, the compression \
+                              is detected automatically when reading \
+                              (default None - no compression)")
+    parser.add_argument("-prefetch_n_threads", type=int,
+                        default=0,
+                        required=False,
+                        help="number of threads to read images from disk \
+                              ahead of their processing - speeds up reading \
+                              from slow (network) storage (default 0 - \
+                              disabled)")
+    parser.add_argument("-prefetch_max_mb", type=float,
+                        default=256,
+                        required=False,
+                        help="max size of prefetched images held in memory \
+                              per file writer in MB (default 256)")
 
     # Parse command line arguments
     args = vars(parser.parse_args())
@@ -139,10 +310,59 @@ def main():
     for k, v in args.items():
         logger.info("Arg: %s: %s" % (k, v))
 
+    out_label_mapping = args['output_dir'] + 'label_mapping.json'
+
+    check_worker_index(args['worker_index'], args['num_workers'])
+    is_distributed = args['num_workers'] > 1
+
+    # Re-use the label mapping of previous runs for incremental exports
+    if args['label_mapping'] is not None:
+        logger.info("Using label mapping %s" % args['label_mapping'])
+        labels_numeric_map = read_json(args['label_mapping'])
+    elif args['incremental'] and os.path.exists(out_label_mapping):
+        logger.info("Using existing label mapping %s" % out_label_mapping)
+        labels_numeric_map = read_json(out_label_mapping)
+    else:
+        labels_numeric_map = None
+
+    # Only options which act on single records are supported when streaming
+    if args['streaming']:
+        unsupported = [
+            x for x in ['balanced_sampling_min', 'deduplicate_images',
+                        'export_snapshot', 'use_snapshot_splits',
+                        'incremental', 'max_mb_per_file']
+            if args[x] not in (None, False)]
+        if is_distributed:
+            unsupported.append('num_workers')
+        if is_inventory_snapshot(args['inventory']):
+            unsupported.append('inventory (snapshot)')
+        if len(unsupported) > 0:
+            raise ValueError("Not supported with -streaming: %s" %
+                             unsupported)
+
+    # Each worker would hash all images, de-duplicate once and re-use the
+    # de-duplicated inventory snapshot in the workers instead
+    if is_distributed and args['deduplicate_images'] is not None:
+        raise ValueError("deduplicate_images is not supported with \
+                          num_workers > 1 - de-duplicate in a single run \
+                          with -export_snapshot and run the workers with \
+                          the snapshot as -inventory")
+
     # Create Dataset Inventory
     params = {'path': args['inventory']}
-    dinv = DatasetInventoryMaster()
-    dinv.create_from_source('json', params)
+    if args['streaming']:
+        logger.info("Streaming records from %s" % args['inventory'])
+        dinv = DatasetInventoryStream(labels_numeric_map=labels_numeric_map)
+        dinv.create_from_source('json', params)
+    elif is_inventory_snapshot(args['inventory']):
+        dinv = DatasetInventoryMaster(labels_numeric_map=labels_numeric_map,
+                                      backend=args['inventory_backend'])
+        logger.info("Loading inventory snapshot %s" % args['inventory'])
+        dinv.create_from_snapshot(args['inventory'])
+    else:
+        dinv = DatasetInventoryMaster(labels_numeric_map=labels_numeric_map,
+                                      backend=args['inventory_backend'])
+        dinv.create_from_source('json', params)
 
     # Remove multi-label subjects
     if args['remove_multi_label_records']:
@@ -168,16 +388,47 @@ def main():
             label_name_list=args['keep_label_name'],
             label_value_list=args['keep_label_value'])
 
-    # Log Statistics
-    dinv.log_stats()
+    # Find identical images
+    if args['deduplicate_images'] is not None:
+        deduplicator = ImageDeduplicator(
+            image_root_path=args['image_root_path'],
+            n_threads=args['deduplicate_n_threads'])
+        deduplicator.hash_inventory(dinv)
+        dinv.deduplicate_images(
+            deduplicator.image_hashes, mode=args['deduplicate_images'])
+
+    # Log Statistics (of streamed records once written)
+    if not args['streaming']:
+        dinv.log_stats()
+
+    # Assign the records to splits while they are streamed
+    if args['streaming']:
+        if args['split_by_meta'] is not None:
+            logger.debug("Splitting by metadata %s" % args['split_by_meta'])
+            dinv.split_by_meta_data_column(meta_colum=args['split_by_meta'])
+        else:
+            logger.debug("Splitting randomly")
+            dinv.split_by_random_splits(
+                split_names=args['split_names'],
+                split_percent=args['split_percent'])
+        splitted = dict()
+
+    # Re-use the splits of a snapshot
+    elif args['use_snapshot_splits']:
+        if dinv.split_assignments is None:
+            raise ValueError("use_snapshot_splits requires an inventory \
+                              snapshot with split assignments")
+        logger.debug("Splitting by the split assignments of the snapshot")
+        splitted = dinv.split_inventory_by_assignments(dinv.split_assignments)
 
     # Determine if Meta-Column has been specified
-    if args['split_by_meta'] is not None:
+    elif args['split_by_meta'] is not None:
         logger.debug("Splitting by metadata %s" % args['split_by_meta'])
         if args['balanced_sampling_min']:
             splitted = dinv.split_inventory_by_meta_data_column_and_balanced_sampling(
                 meta_colum=args['split_by_meta'],
-                split_label_min=args['balanced_sampling_label'])
+                split_label_min=args['balanced_sampling_label'],
+                max_per_class=args['balanced_sampling_max_per_class'])
             logger.debug("Balanced sampling using %s" % args['split_by_meta'])
         else:
             splitted = dinv.split_inventory_by_meta_data_column(
@@ -192,14 +443,17 @@ def main():
         splitted = dinv.split_inventory_by_random_splits_with_balanced_sample(
                 split_label_min=args['balanced_sampling_label'],
                 split_names=args['split_names'],
-                split_percent=args['split_percent'])
+                split_percent=args['split_percent'],
+                n_processes=args['split_n_processes'],
+                max_per_class=args['balanced_sampling_max_per_class'])
 
     # Split without balanced sampling
     else:
         logger.debug("Splitting randomly")
         splitted = dinv.split_inventory_by_random_splits(
                 split_names=args['split_names'],
-                split_percent=args['split_percent'])
+                split_percent=args['split_percent'],
+                n_processes=args['split_n_processes'])
 
     # Log all the splits to create
     for i, split_name in enumerate(splitted.keys()):
@@ -210,14 +464,98 @@ def main():
         logger.debug("Stats for Split %s" % split_name)
         split_data.log_stats(debug_only=True)
 
-    # Write Label Mappings
-    out_label_mapping = args['output_dir'] + 'label_mapping.json'
-    dinv.export_label_mapping(out_label_mapping)
+    # Save the inventory with the split assignments
+    if args['export_snapshot'] is not None and args['worker_index'] == 0:
+        dinv.export_to_snapshot(args['export_snapshot'])
+
+    # Report identical images in different splits
+    if args['deduplicate_images'] is not None:
+        cross_split_duplicates = \
+            deduplicator.find_cross_split_duplicates(splitted)
+        deduplicator.log_cross_split_duplicates(cross_split_duplicates)
+        if args['worker_index'] == 0:
+            export_dict_to_json(
+                cross_split_duplicates,
+                os.path.join(args['output_dir'],
+                             'duplicates_across_splits.json'))
+
+    # Write Label Mappings (merged after all workers have finished), the
+    # mapping of streamed records is complete once they are written
+    if is_distributed:
+        dinv.export_label_mapping(get_worker_label_mapping_path(
+            args['output_dir'], args['worker_index'], args['num_workers']))
+    elif not args['streaming']:
+        dinv.export_label_mapping(out_label_mapping)
+
+    # Cache for processed images
+    if args['image_cache_dir'] is not None:
+        image_cache = ImageCache(
+            args['image_cache_dir'],
+            max_size_bytes=int(args['image_cache_max_size_gb'] * 1024 ** 3))
+    else:
+        image_cache = None
+
+    # Codec to read and resize images
+    image_codec = ImageCodec.create(args['image_codec'])
+
+    if args['max_mb_per_file'] is not None:
+        max_bytes_per_file = int(args['max_mb_per_file'] * 1024 ** 2)
+    else:
+        max_bytes_per_file = None
+
+    # Define how images are stored
+    if args['image_format'] == 'raw':
+        if args['image_raw_size'] is None:
+            raise ValueError(
+                "-image_raw_size is required for -image_format raw")
+        height, width = args['image_raw_size']
+        image_pre_processing_fun = image_codec.read_resize_and_convert_to_raw
+        image_pre_processing_args = {"output_height": height,
+                                     "output_width": width}
+        image_shape = (height, width, 3)
+    else:
+        image_pre_processing_fun = image_codec.read_resize_and_convert_to_jpeg
+        image_pre_processing_args = {"smallest_side":
+                                     args['image_save_side_smallest'],
+                                     "image_save_quality":
+                                     args['image_save_quality']}
+        image_shape = None
 
     # Write TFrecord files
-    tfr_encoder_decoder = DefaultTFRecordEncoderDecoder()
+    tfr_encoder_decoder = DefaultTFRecordEncoderDecoder(
+        image_format=args['image_format'], image_shape=image_shape)
     tfr_writer = DatasetWriter(tfr_encoder_decoder.encode_record)
 
+    export_args = dict(
+        image_root_path=args['image_root_path'],
+        image_pre_processing_fun=image_pre_processing_fun,
+        image_pre_processing_args=image_pre_processing_args,
+        random_shuffle_before_save=True,
+        overwrite_existing_files=args['overwrite'],
+        max_records_per_file=args['max_records_per_file'],
+        write_tfr_in_parallel=args['write_tfr_in_parallel'],
+        process_images_in_parallel=args['process_images_in_parallel'],
+        process_images_in_parallel_size=args['process_images_in_parallel_size'],
+        processes_images_in_parallel_n_processes=args['processes_images_in_parallel_n_processes'],
+        incremental=args['incremental'],
+        image_cache=image_cache,
+        image_codec=image_codec,
+        max_bytes_per_file=max_bytes_per_file,
+        max_parallel_writers=args['max_parallel_writers'],
+        prefetch_n_threads=args['prefetch_n_threads'],
+        prefetch_max_bytes=int(args['prefetch_max_mb'] * 1024 ** 2),
+        compression_type=args['compression_type'] or '',
+        worker_index=args['worker_index'],
+        num_workers=args['num_workers'])
+
+    if args['streaming']:
+        n_records_per_split = dinv.export_to_tfrecord(
+            tfr_writer, args['output_dir'], **export_args)
+        for split_name, n_records in sorted(n_records_per_split.items()):
+            logger.info("Streamed %s records to %s" % (n_records, split_name))
+        dinv.log_stats()
+        dinv.export_label_mapping(out_label_mapping)
+
     counter = 0
     n_splits = len(splitted.keys())
     for split_name, split_data in splitted.items():
@@ -228,20 +566,7 @@ def main():
             tfr_writer,
             args['output_dir'],
             file_prefix=split_name,
-            image_root_path=args['image_root_path'],
-            image_pre_processing_fun=read_image_from_disk_resize_and_convert_to_jpeg,
-            image_pre_processing_args={"smallest_side":
-                                       args['image_save_side_smallest'],
-                                       "image_save_quality":
-                                       args['image_save_quality']},
-            random_shuffle_before_save=True,
-            overwrite_existing_files=args['overwrite'],
-            max_records_per_file=args['max_records_per_file'],
-            write_tfr_in_parallel=args['write_tfr_in_parallel'],
-            process_images_in_parallel=args['process_images_in_parallel'],
-            process_images_in_parallel_size=args['process_images_in_parallel_size'],
-            processes_images_in_parallel_n_processes=args['processes_images_in_parallel_n_processes']
-            )
+            **export_args)
     logger.info("Finished writing TFRecords")
 
 
@@ -10,6 +10,10 @@ Example Usage:
 --------------
 python create_dataset_inventory.py dir -path /my_images/ \
 -export_path /my_data/dataset_inventory.json
+
+python create_dataset_inventory.py \
+-export_snapshot /my_data/dataset_inventory.snapshot \
+dir -path /my_images/ -export_path /my_data/dataset_inventory.json
 """
 import os
 import argparse
@@ -25,7 +29,8 @@ def csv(args):
               'image_path_col_list': args['image_fields'],
               'capture_id_col': args['capture_id_field'],
               'attributes_col_list': args['label_fields'],
-              'meta_col_list': args['meta_data_fields']}
+              'meta_col_list': args['meta_data_fields'],
+              'n_processes': args['n_processes']}
     dinv = DatasetInventoryMaster()
     dinv.create_from_source('csv', params)
     return dinv
@@ -41,7 +46,8 @@ def json(args):
 
 def class_dir(args):
     """ Import From Class Dirs"""
-    params = {'path': args['path']}
+    params = {'path': args['path'],
+              'listing_cache_path': args['listing_cache']}
     dinv = DatasetInventoryMaster()
     dinv.create_from_source('image_dir', params)
     return dinv
@@ -65,6 +71,11 @@ def main():
         "-discard_missing", default=False,
         action='store_true', required=False,
         help="whether to discard records with any missing label entries")
+    parser.add_argument(
+        "-export_snapshot", type=str, required=False, default=None,
+        help="path to additionally save a binary snapshot of the inventory, \
+              which can be passed as -inventory to create_dataset and is \
+              loaded much faster than json")
 
     subparsers = parser.add_subparsers(help='sub-command help')
 
@@ -92,6 +103,11 @@ def main():
                             help='the name of the csv columns with paths to \
                                   meta data attributes (more than one poss.)',
                             required=False)
+    parser_csv.add_argument("-n_processes", type=int, default=1,
+                            help="number of processes to parse the csv \
+                                  file in chunks, speeds up the import of \
+                                  large csv files (default 1)",
+                            required=False)
     parser_csv.set_defaults(func=csv)
 
     # create parser for json input
@@ -113,6 +129,10 @@ def main():
         help="the full path to a json file which will contain\
              the dataset inventory \
              (e.g. /my_data/dataset_inventory.json)")
+    parser_class_dirs.add_argument(
+        "-listing_cache", type=str, required=False, default=None,
+        help="path to a json file to cache the directory listings, \
+             repeated runs only list directories which have changed")
     parser_class_dirs.set_defaults(func=class_dir)
 
     # create parser for panthera input
@@ -148,6 +168,9 @@ def main():
 
     dinv.export_to_json(json_path=args['export_path'])
 
+    if args['export_snapshot'] is not None:
+        dinv.export_to_snapshot(args['export_snapshot'])
+
 
 if __name__ == '__main__':
     main()
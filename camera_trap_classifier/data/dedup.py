@@ -0,0 +1,90 @@
+""" Find Duplicate Images in a Dataset Inventory
+
+Camera trap exports often contain identical images under different capture
+ids (re-uploads, copied memory cards, merged projects). Duplicates are
+identified by hashing the image bytes in parallel threads.
+"""
+import logging
+from hashlib import md5
+
+from camera_trap_classifier.data.utils import (
+    get_inventory_image_paths, map_images_in_threads)
+
+
+logger = logging.getLogger(__name__)
+
+
+def hash_image(path_to_image, chunk_size=1024 ** 2):
+    """ Hash the bytes of an image, returns None if it can not be read """
+    image_hash = md5()
+    try:
+        with open(path_to_image, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                image_hash.update(chunk)
+    except OSError:
+        return None
+    return image_hash.hexdigest()
+
+
+class ImageDeduplicator(object):
+    """ Hashes the images of a dataset inventory to find duplicates
+
+    Args:
+        image_root_path (str): path to prepend to the image paths
+        n_threads (int): number of threads to hash images (I/O bound)
+    """
+    def __init__(self, image_root_path=None, n_threads=32):
+        self.image_root_path = image_root_path
+        self.n_threads = n_threads
+        self.image_hashes = dict()
+
+    def hash_inventory(self, dataset_inventory):
+        """ Hash all images of a dataset inventory """
+        self.hash_images(get_inventory_image_paths(dataset_inventory))
+
+    def hash_images(self, image_paths):
+        """ Hash a list of images (unreadable images are skipped) """
+        logger.info("Hashing %s images with %s threads" %
+                    (len(image_paths), self.n_threads))
+        hashes = map_images_in_threads(
+            hash_image, image_paths, self.image_root_path,
+            self.n_threads, description='Hashed')
+        for image_path, image_hash in hashes:
+            if image_hash is not None:
+                self.image_hashes[image_path] = image_hash
+        n_unique = len(set(self.image_hashes.values()))
+        logger.info("Hashed %s images - %s unique images" %
+                    (len(self.image_hashes), n_unique))
+
+    def find_cross_split_duplicates(self, splits):
+        """ Find identical images in different splits
+            splits: dict with split name and DatasetInventory
+            Returns: {image hash: {split name: [record ids]}} for images
+                     in more than one split
+        """
+        hash_to_splits = dict()
+        for split_name, split_inventory in splits.items():
+            for record_id in split_inventory.get_all_record_ids():
+                record = split_inventory.get_record_id_data(record_id)
+                for image_path in record['images']:
+                    image_hash = self.image_hashes.get(image_path, None)
+                    if image_hash is None:
+                        continue
+                    record_ids = hash_to_splits.setdefault(
+                        image_hash, dict()).setdefault(split_name, list())
+                    if record_id not in record_ids:
+                        record_ids.append(record_id)
+        return {k: v for k, v in hash_to_splits.items() if len(v) > 1}
+
+    def log_cross_split_duplicates(self, cross_split_duplicates,
+                                   n_examples=10):
+        """ Log identical images found in different splits """
+        if len(cross_split_duplicates) == 0:
+            logger.info("No identical images found in different splits")
+            return
+        logger.warning(
+            "Found %s images in more than one split - these images leak \
+             between the splits" % len(cross_split_duplicates))
+        for image_hash, splits in \
+                list(cross_split_duplicates.items())[0:n_examples]:
+            logger.warning("Image %s is in: %s" % (image_hash, splits))
@@ -0,0 +1,214 @@
+""" Create a Dataset with Multiple Workers
+
+Each worker runs the same dataset creation (same inventory and arguments)
+on a shared filesystem and writes only the shards it owns. Shard ownership
+is derived from the (global) shard index, thus every worker independently
+arrives at the same, disjoint assignment:
+
+    shard i (0-based) is written by worker i % num_workers
+
+Every worker writes a worker manifest per split and its label mapping.
+Once all workers are done, merge_worker_outputs checks that the workers
+agree on the splits and label mappings, that all shards exist and
+consolidates the label mappings, manifests and writer stats.
+"""
+import os
+import json
+import logging
+from hashlib import md5
+
+from camera_trap_classifier.data.writer_stats import WriterStats
+from camera_trap_classifier.data.utils import (
+    export_dict_to_json, read_json, read_tfr_manifest,
+    read_label_histogram_from_manifests)
+
+
+logger = logging.getLogger(__name__)
+
+
+def check_worker_index(worker_index, num_workers):
+    """ Check worker_index and num_workers """
+    if num_workers < 1:
+        raise ValueError("num_workers must be at least 1")
+    if not 0 <= worker_index < num_workers:
+        raise ValueError("worker_index must be between 0 and %s" %
+                         (num_workers - 1))
+
+
+def is_shard_owner(shard_index, worker_index, num_workers):
+    """ Whether a worker writes the shard with (0-based) shard_index """
+    return (shard_index % num_workers) == worker_index
+
+
+def get_worker_suffix(worker_index, num_workers):
+    """ Suffix of worker specific files """
+    return 'worker%03d-of-%03d' % (worker_index, num_workers)
+
+
+def get_worker_label_mapping_path(output_dir, worker_index, num_workers):
+    """ Path of the label mapping exported by a worker """
+    return os.path.join(output_dir, 'label_mapping_%s.json' %
+                        get_worker_suffix(worker_index, num_workers))
+
+
+def get_worker_manifest_path(output_dir, file_prefix, worker_index,
+                             num_workers):
+    """ Path of the manifest of a worker for a split """
+    return os.path.join(output_dir, '%s_manifest_%s.json' % (
+        file_prefix, get_worker_suffix(worker_index, num_workers)))
+
+
+def hash_record_ids(record_ids):
+    """ Hash the (sorted) record ids of a split to check that all
+        workers process the same records
+    """
+    return md5('\n'.join(record_ids).encode('utf-8')).hexdigest()
+
+
+def export_worker_manifest(output_dir, file_prefix, worker_index,
+                           num_workers, record_ids, shard_paths,
+                           owned_shard_paths):
+    """ Export the shards of a split owned by a worker """
+    worker_manifest = {
+        'file_prefix': file_prefix,
+        'worker_index': worker_index,
+        'num_workers': num_workers,
+        'n_records': len(record_ids),
+        'record_ids_hash': hash_record_ids(record_ids),
+        'shards': [os.path.basename(x) for x in shard_paths],
+        'owned_shards': [os.path.basename(x) for x in owned_shard_paths]}
+    export_dict_to_json(
+        worker_manifest,
+        get_worker_manifest_path(
+            output_dir, file_prefix, worker_index, num_workers))
+
+
+def _merge_label_mappings(output_dir, num_workers):
+    """ Check that all workers used the same label mapping and
+        export it as 'label_mapping.json'
+    """
+    label_mapping = None
+    for worker_index in range(0, num_workers):
+        path = get_worker_label_mapping_path(
+            output_dir, worker_index, num_workers)
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                "Label mapping of worker %s not found: %s - has the worker \
+                 finished?" % (worker_index, path))
+        worker_label_mapping = read_json(path)
+        if label_mapping is None:
+            label_mapping = worker_label_mapping
+        elif worker_label_mapping != label_mapping:
+            raise ValueError(
+                "Worker %s has a different label mapping than worker 0 - \
+                 were all workers run with the same inventory and \
+                 arguments?" % worker_index)
+    export_dict_to_json(
+        label_mapping, os.path.join(output_dir, 'label_mapping.json'))
+    return label_mapping
+
+
+def _merge_split(output_dir, file_prefix, num_workers):
+    """ Check and merge the worker manifests of a split
+        Returns: summary of the split
+    """
+    worker_manifests = list()
+    for worker_index in range(0, num_workers):
+        path = get_worker_manifest_path(
+            output_dir, file_prefix, worker_index, num_workers)
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                "Manifest of worker %s for %s not found: %s - has the \
+                 worker finished?" % (worker_index, file_prefix, path))
+        worker_manifests.append(read_json(path))
+
+    reference = worker_manifests[0]
+    for worker_manifest in worker_manifests[1:]:
+        if worker_manifest['record_ids_hash'] != \
+                reference['record_ids_hash'] or \
+                worker_manifest['shards'] != reference['shards']:
+            raise ValueError(
+                "Worker %s has different records or shards for %s than \
+                 worker 0 - were all workers run with the same inventory \
+                 and arguments?" %
+                (worker_manifest['worker_index'], file_prefix))
+
+    owned_shards = [x for m in worker_manifests for x in m['owned_shards']]
+    if sorted(owned_shards) != sorted(reference['shards']):
+        missing = set(reference['shards']) - set(owned_shards)
+        raise ValueError("Shards of %s not written by any worker: %s" %
+                         (file_prefix, sorted(missing)))
+
+    shard_paths = [os.path.join(output_dir, x) for x in reference['shards']]
+    invalid = [x for x in shard_paths if read_tfr_manifest(x) is None]
+    if len(invalid) > 0:
+        raise ValueError("Shards of %s missing or without valid manifest: \
+                          %s" % (file_prefix, invalid))
+
+    n_records_written = sum(
+        read_tfr_manifest(x)['n_records'] for x in shard_paths)
+
+    return {
+        'n_records': reference['n_records'],
+        'n_records_written': n_records_written,
+        'shards': reference['shards'],
+        'label_histogram': read_label_histogram_from_manifests(shard_paths)}
+
+
+def _merge_writer_stats(output_dir, file_prefix, num_workers):
+    """ Merge the writer stats of all workers of a split into
+        '<file_prefix>_writer_stats.json'
+    """
+    stats = WriterStats()
+    merged = {'n_records': 0, 'n_records_written': 0, 'seconds': 0}
+    for worker_index in range(0, num_workers):
+        path = os.path.join(output_dir, '%s_writer_stats_%s.json' % (
+            file_prefix, get_worker_suffix(worker_index, num_workers)))
+        if not os.path.exists(path):
+            continue
+        worker_stats = read_json(path)
+        stats.merge(worker_stats)
+        merged['n_records'] += worker_stats['n_records']
+        merged['n_records_written'] += worker_stats['n_records_written']
+        merged['seconds'] = max(merged['seconds'], worker_stats['seconds'])
+        merged['settings'] = worker_stats['settings']
+    merged.update(stats.to_dict())
+    export_dict_to_json(merged, os.path.join(
+        output_dir, '%s_writer_stats.json' % file_prefix))
+
+
+def find_worker_splits(output_dir, num_workers):
+    """ Find the splits (file prefixes) with worker manifests """
+    suffix = '_manifest_%s.json' % get_worker_suffix(0, num_workers)
+    return sorted(x[:-len(suffix)] for x in os.listdir(output_dir)
+                  if x.endswith(suffix))
+
+
+def merge_worker_outputs(output_dir, num_workers):
+    """ Check and consolidate the outputs of all workers, exports
+        'label_mapping.json', '<split>_writer_stats.json' and
+        'dataset_manifest.json' with the shards and label histograms
+        of all splits
+    """
+    label_mapping = _merge_label_mappings(output_dir, num_workers)
+    splits = dict()
+    for file_prefix in find_worker_splits(output_dir, num_workers):
+        splits[file_prefix] = _merge_split(
+            output_dir, file_prefix, num_workers)
+        _merge_writer_stats(output_dir, file_prefix, num_workers)
+        logger.info("Merged %s: %s shards with %s records" %
+                    (file_prefix, len(splits[file_prefix]['shards']),
+                     splits[file_prefix]['n_records_written']))
+    if len(splits) == 0:
+        raise ValueError("No worker manifests found in %s" % output_dir)
+    dataset_manifest = {
+        'num_workers': num_workers,
+        'label_mapping': label_mapping,
+        'splits': splits}
+    export_dict_to_json(
+        dataset_manifest, os.path.join(output_dir, 'dataset_manifest.json'))
+    logger.info("Merged the outputs of %s workers:\n%s" %
+                (num_workers, json.dumps(
+                    {k: v['n_records_written'] for k, v in splits.items()},
+                    indent=2)))
+    return dataset_manifest
@@ -0,0 +1,168 @@
+""" Fast Listing of Directory Trees
+
+DirectoryWalker walks directory trees like os.walk (top-down) using
+os.scandir, but lists the subdirectories concurrently in a pool of
+threads, which is much faster on network file systems where every
+directory listing has a high latency. The results are returned in a
+deterministic order (directories and files sorted by name) while the
+remaining directories are still being listed.
+
+Optionally the listings are cached in a json file together with the
+modification time of each directory, a repeated walk then only lists
+the directories which have changed (all directories are still stat'ed).
+"""
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+class DirectoryWalker(object):
+    """ Walk directory trees with 'n_threads' threads, cache the
+        listings in 'cache_path' (json) if specified
+    """
+    # listings of directories modified less than this number of seconds
+    # before the walk are not cached, changes within the resolution of
+    # the modification time could be missed otherwise
+    racy_seconds = 2
+
+    def __init__(self, n_threads=8, cache_path=None):
+        self.n_threads = max(n_threads, 1)
+        self.cache_path = cache_path
+        self._cache = self._read_cache()
+        self._visited = set()
+        self._lock = threading.Lock()
+        # number of directories listed (not taken from the cache)
+        self.n_listed = 0
+
+    def _read_cache(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return dict()
+        try:
+            with open(self.cache_path, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            logger.warning("Ignoring invalid listing cache %s" %
+                           self.cache_path)
+            return dict()
+
+    def _save_cache(self, top):
+        """ Save the cache, drops directories below 'top' which were
+            not visited (e.g. removed directories)
+        """
+        top = os.path.join(os.path.abspath(top), '')
+        cache = {k: v for k, v in self._cache.items()
+                 if k in self._visited or not k.startswith(top)}
+        temp_path = self.cache_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(cache, f)
+        os.replace(temp_path, self.cache_path)
+
+    def _list_directory(self, path, walk_start):
+        """ List a directory (or take the listing from the cache)
+            Returns: {'dirs': [names], 'links': [names of symlinked dirs],
+                      'files': [names]} or None if the directory can't be
+                     read
+        """
+        key = os.path.abspath(path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            self._visited.add(key)
+            listing = self._cache.get(key, None)
+        if listing is not None and listing['mtime'] == mtime:
+            return listing
+
+        dirs, links, files = list(), list(), list()
+        try:
+            for entry in os.scandir(path):
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    files.append(entry.name)
+                    continue
+                dirs.append(entry.name)
+                try:
+                    if entry.is_symlink():
+                        links.append(entry.name)
+                except OSError:
+                    pass
+        except OSError:
+            return None
+        listing = {'mtime': mtime, 'dirs': sorted(dirs),
+                   'links': sorted(links), 'files': sorted(files)}
+
+        with self._lock:
+            self.n_listed += 1
+            if mtime < (walk_start - self.racy_seconds) * 1e9:
+                self._cache[key] = listing
+            else:
+                self._cache.pop(key, None)
+        return listing
+
+    def walk(self, top, max_depth=None, followlinks=False):
+        """ Walk a directory tree like os.walk (top-down)
+            Yields: (dirpath, dirnames, filenames) with sorted names, all
+                    directories are listed ahead, thus removing entries
+                    from dirnames has no effect
+            max_depth: do not walk directories deeper than this below top
+            followlinks: walk into symlinks to directories
+        """
+        walk_start = time.time()
+        stopped = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=self.n_threads)
+
+        def _scan(path, depth):
+            """ List a directory and submit its subdirectories """
+            if stopped.is_set():
+                return None, list()
+            listing = self._list_directory(path, walk_start)
+            if listing is None or (max_depth is not None and
+                                   depth >= max_depth):
+                return listing, list()
+            links = set(listing['links'])
+            children = [
+                (os.path.join(path, name),
+                 executor.submit(_scan, os.path.join(path, name), depth + 1))
+                for name in listing['dirs']
+                if followlinks or name not in links]
+            return listing, children
+
+        completed = False
+        try:
+            stack = [(top, executor.submit(_scan, top, 0))]
+            while len(stack) > 0:
+                path, future = stack.pop()
+                listing, children = future.result()
+                if listing is None:
+                    continue
+                yield path, list(listing['dirs']), list(listing['files'])
+                stack.extend(reversed(children))
+            completed = True
+        finally:
+            stopped.set()
+            executor.shutdown(wait=True)
+        if completed and self.cache_path is not None:
+            self._save_cache(top)
+
+    def iter_files(self, top, ext=None, max_depth=None, followlinks=False):
+        """ Paths of all files in a directory tree (see walk)
+            ext: only files ending with one of these extensions, e.g.
+                 ('.jpg', '.png') (case insensitive)
+        """
+        if ext is not None:
+            ext = tuple(x.lower() for x in ext)
+        for dirpath, _, filenames in self.walk(
+                top, max_depth=max_depth, followlinks=followlinks):
+            for filename in filenames:
+                if ext is None or filename.lower().endswith(ext):
+                    yield os.path.join(dirpath, filename)
@@ -13,30 +13,25 @@ CR_DISTORTION_RANGE = 0.05
 def read_image_from_disk_and_convert_to_jpeg(
         path_to_image,
         image_save_quality=75):
-    """ TF-Functions to read and convert jpeg
+    """ TF-Functions to read and convert jpeg (see image_codec.TFImageCodec)
         Requires tf.enable_eager_execution()
     """
-    with tf.gfile.GFile(path_to_image, 'rb') as f:
-        file_bytes = f.read()
-    image = tf.image.decode_image(file_bytes)
-    jpeg = tf.image.encode_jpeg(image, quality=image_save_quality).numpy()
-    return jpeg
+    from camera_trap_classifier.data.image_codec import TFImageCodec
+    return TFImageCodec().read_and_convert_to_jpeg(
+        path_to_image, image_save_quality=image_save_quality)
 
 
 def read_image_from_disk_resize_and_convert_to_jpeg(
         path_to_image,
         smallest_side,
         image_save_quality=75):
-    """ TF-Functions to read and convert jpeg
+    """ TF-Functions to read, resize and convert jpeg
+        (see image_codec.TFImageCodec)
         Requires tf.enable_eager_execution()
     """
-    with tf.gfile.GFile(path_to_image, 'rb') as f:
-        file_bytes = f.read()
-    image = tf.image.decode_image(file_bytes)
-    image = _aspect_preserving_resize(image, smallest_side)
-    image = tf.cast(image, dtype=tf.uint8)
-    jpeg = tf.image.encode_jpeg(image, quality=image_save_quality).numpy()
-    return jpeg
+    from camera_trap_classifier.data.image_codec import TFImageCodec
+    return TFImageCodec().read_resize_and_convert_to_jpeg(
+        path_to_image, smallest_side, image_save_quality=image_save_quality)
 
 
 def resize_image(image, target_size):
@@ -373,6 +368,8 @@ def decode_image_bytes_1D(image_bytes_list,
                           output_height=None,
                           output_width=None,
                           image_choice_for_sets='random',
+                          image_format='jpeg',
+                          image_shape=None,
                           **kwargs):
     """ Decode a 1D Tensor of 1-N raw image bytes
     Args:
@@ -381,10 +378,18 @@ def decode_image_bytes_1D(image_bytes_list,
         (only used if image_choice_for_sets is not random)
     output_width: height in pixels of decoded images
         (only used if image_choice_for_sets is not random)
+    image_format: 'jpeg' or 'raw' (uint8 pixels)
+    image_shape: 1-D tensor with the shape of raw images (height, width,
+        channels), only used for raw images
     """
 
     if image_choice_for_sets == 'random':
-        image = choose_random_image(image_bytes_list)
+        image = choose_random_image(image_bytes_list, image_format,
+                                    image_shape)
+    elif image_format != 'jpeg':
+        raise NotImplementedError(
+            "Image choice for set: %s not implemented for image format %s" %
+            (image_choice_for_sets, image_format))
     elif image_choice_for_sets == 'grayscale_stacking':
         image = grayscale_stacking_and_blurring(
                     image_bytes_list,
@@ -622,7 +627,8 @@ def _random_crop(image_list, crop_height, crop_width):
             ) for image in image_list]
 
 
-def choose_random_image(image_bytes_list):
+def choose_random_image(image_bytes_list, image_format='jpeg',
+                        image_shape=None):
     """ Choose a random image """
     n_images = tf.shape(image_bytes_list)
 
@@ -631,7 +637,11 @@ def choose_random_image(image_bytes_list):
                              dtype=tf.int32)
 
     # decode image to tensor
-    image = tf.image.decode_jpeg(image_bytes_list[rand])
+    if image_format == 'raw':
+        image = tf.reshape(
+            tf.decode_raw(image_bytes_list[rand], tf.uint8), image_shape)
+    else:
+        image = tf.image.decode_jpeg(image_bytes_list[rand])
 
     return image
 
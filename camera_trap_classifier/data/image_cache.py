@@ -0,0 +1,114 @@
+""" On-Disk Cache for Processed Images """
+import os
+import json
+import logging
+from hashlib import md5
+from multiprocessing import Value
+
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache(object):
+    """ Content-addressed on-disk cache of processed image bytes
+
+        Entries are keyed by the source path, size and modification time of
+        an image and the settings used to process it. Once the cache exceeds
+        'max_size_bytes' the least recently used entries are evicted.
+        The cache size is shared with (forked) worker processes.
+
+    Args:
+        cache_dir (str): directory to store the cached images
+        max_size_bytes (int): max size of all cached images
+    """
+    # fraction of max_size_bytes to keep after an eviction
+    evict_to_fraction = 0.9
+
+    def __init__(self, cache_dir, max_size_bytes=50 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self._size = Value('q', self._calc_cache_size())
+        logger.info("Using image cache %s with %s MB" %
+                    (self.cache_dir, self._size.value // (1024 ** 2)))
+
+    def get_key(self, path_to_image, settings):
+        """ Create the cache key of an image processed with 'settings' """
+        stat = os.stat(path_to_image)
+        to_hash = json.dumps(
+            [os.path.abspath(path_to_image), stat.st_size, stat.st_mtime_ns,
+             settings], sort_keys=True, default=str)
+        return md5(to_hash.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """ Get cached image bytes, returns None if not cached """
+        entry_path = self._get_entry_path(key)
+        try:
+            with open(entry_path, 'rb') as f:
+                image_bytes = f.read()
+            # mark entry as recently used
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+        return image_bytes
+
+    def put(self, key, image_bytes):
+        """ Store image bytes in the cache """
+        entry_path = self._get_entry_path(key)
+        entry_dir = os.path.dirname(entry_path)
+        if not os.path.exists(entry_dir):
+            os.makedirs(entry_dir, exist_ok=True)
+        # write to a temporary file first to never expose partial entries
+        entry_temp = '%s_%s_temp' % (entry_path, os.getpid())
+        with open(entry_temp, 'wb') as f:
+            f.write(image_bytes)
+        os.replace(entry_temp, entry_path)
+
+        with self._size.get_lock():
+            self._size.value += len(image_bytes)
+            if self._size.value > self.max_size_bytes:
+                self._size.value = self._evict()
+
+    def _get_entry_path(self, key):
+        """ Path of a cache entry """
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _list_entries(self):
+        """ List (mtime, size, path) of all cache entries """
+        entries = list()
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.endswith('_temp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _calc_cache_size(self):
+        """ Calculate the total size of all cache entries """
+        return sum(x[1] for x in self._list_entries())
+
+    def _evict(self):
+        """ Remove least recently used entries, returns the new size """
+        entries = self._list_entries()
+        entries.sort()
+        size = sum(x[1] for x in entries)
+        target_size = int(self.max_size_bytes * self.evict_to_fraction)
+        n_removed = 0
+        for _, entry_size, entry_path in entries:
+            if size <= target_size:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+            n_removed += 1
+        logger.debug("Evicted %s images from image cache" % n_removed)
+        return size
@@ -0,0 +1,279 @@
+""" Image Codecs to Read, Resize and Convert Images to Jpeg
+
+The codec is used when creating TFRecord files from the original images.
+Available codecs:
+- tensorflow: fully decodes each image with TensorFlow (default)
+- pillow: decodes jpegs at reduced scale (1/2, 1/4, 1/8) if the image
+          is still larger than the target size (requires Pillow)
+
+The decode, resize and encode stages of each image are timed separately
+if a WriterStats object is passed as 'stats'.
+"""
+import io
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+import tensorflow as tf
+
+from camera_trap_classifier.data.image import _aspect_preserving_resize
+from camera_trap_classifier.data.preflight import (
+    read_image_header, InvalidImageError)
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+
+def smallest_size_at_least(height, width, smallest_side):
+    """ Computes new shape with the smallest side equal to `smallest_side`
+        while preserving the aspect ratio - identical to
+        image._smallest_size_at_least (float32 arithmetic)
+    """
+    height = np.float32(height)
+    width = np.float32(width)
+    smallest_side = np.float32(smallest_side)
+    if height > width:
+        scale = smallest_side / width
+    else:
+        scale = smallest_side / height
+    new_height = int(np.rint(height * scale))
+    new_width = int(np.rint(width * scale))
+    return new_height, new_width
+
+
+def read_image_size(path_to_image):
+    """ Read the dimensions of an image from its header without decoding
+        it (see preflight.read_image_header, other formats require Pillow)
+        Returns: (height, width) or None if unknown
+    """
+    try:
+        header = read_image_header(path_to_image)
+        return header['height'], header['width']
+    except (OSError, InvalidImageError):
+        pass
+    if Image is not None:
+        try:
+            with Image.open(path_to_image) as image:
+                width, height = image.size
+                return height, width
+        except (OSError, ValueError):
+            pass
+    return None
+
+
+@contextmanager
+def _time_stage(stats, stage):
+    """ Measure the time of a stage if stats (WriterStats) is not None """
+    if stats is None:
+        yield {'bytes': 0}
+    else:
+        with stats.time(stage) as measurement:
+            yield measurement
+
+
+class ImageCodec(object):
+    """ Read images from disk, optionally resize and convert them to jpeg """
+    subclasses = {}
+
+    @classmethod
+    def register_subclass(cls, codec_type):
+        def decorator(subclass):
+            cls.subclasses[codec_type] = subclass
+            return subclass
+
+        return decorator
+
+    @classmethod
+    def create(cls, codec_type, params=None):
+        if codec_type not in cls.subclasses:
+            raise ValueError('Bad codec type {}'.format(codec_type))
+
+        return cls.subclasses[codec_type](**(params or dict()))
+
+    def read_image_from_disk(self, path_to_image, stats=None):
+        """ Read raw bytes of an image """
+        with _time_stage(stats, 'read') as measurement:
+            with open(path_to_image, 'rb') as f:
+                file_bytes = f.read()
+            measurement['bytes'] = len(file_bytes)
+        return file_bytes
+
+    def read_and_convert_to_jpeg(self, path_to_image, image_save_quality=75,
+                                 file_bytes=None, stats=None):
+        """ Read and convert an image to jpeg
+            file_bytes: raw bytes of the image if already read
+        """
+        if file_bytes is None:
+            file_bytes = self.read_image_from_disk(path_to_image, stats)
+        return self.convert_to_jpeg(file_bytes, image_save_quality, stats)
+
+    def read_resize_and_convert_to_jpeg(
+            self, path_to_image, smallest_side, image_save_quality=75,
+            file_bytes=None, stats=None):
+        """ Read, resize (aspect preserving) and convert an image to jpeg
+            file_bytes: raw bytes of the image if already read
+        """
+        if file_bytes is None:
+            file_bytes = self.read_image_from_disk(path_to_image, stats)
+        return self.resize_and_convert_to_jpeg(
+            file_bytes, smallest_side, image_save_quality, stats)
+
+    def read_resize_and_convert_to_raw(
+            self, path_to_image, output_height, output_width,
+            file_bytes=None, stats=None):
+        """ Read and resize an image to a fixed size, returns the raw
+            uint8 pixels (height x width x 3)
+            file_bytes: raw bytes of the image if already read
+        """
+        if file_bytes is None:
+            file_bytes = self.read_image_from_disk(path_to_image, stats)
+        return self.resize_and_convert_to_raw(
+            file_bytes, output_height, output_width, stats)
+
+    def convert_to_jpeg(self, file_bytes, image_save_quality=75, stats=None):
+        """ Convert encoded image bytes to jpeg """
+        raise NotImplementedError
+
+    def resize_and_convert_to_jpeg(
+            self, file_bytes, smallest_side, image_save_quality=75,
+            stats=None):
+        """ Resize encoded image bytes such that the smaller side has
+            'smallest_side' pixels and convert to jpeg
+        """
+        raise NotImplementedError
+
+    def resize_and_convert_to_raw(self, file_bytes, output_height,
+                                  output_width, stats=None):
+        """ Resize encoded image bytes to a fixed size and return the
+            raw uint8 pixels (height x width x 3)
+        """
+        raise NotImplementedError
+
+
+@ImageCodec.register_subclass('tensorflow')
+class TFImageCodec(ImageCodec):
+    """ Decode, resize and encode images with TensorFlow
+        Requires tf.enable_eager_execution()
+    """
+
+    def read_image_from_disk(self, path_to_image, stats=None):
+        with _time_stage(stats, 'read') as measurement:
+            with tf.gfile.GFile(path_to_image, 'rb') as f:
+                file_bytes = f.read()
+            measurement['bytes'] = len(file_bytes)
+        return file_bytes
+
+    def _encode_jpeg(self, image, image_save_quality, stats):
+        with _time_stage(stats, 'encode') as measurement:
+            jpeg = tf.image.encode_jpeg(
+                image, quality=image_save_quality).numpy()
+            measurement['bytes'] = len(jpeg)
+        return jpeg
+
+    def convert_to_jpeg(self, file_bytes, image_save_quality=75, stats=None):
+        with _time_stage(stats, 'decode'):
+            image = tf.image.decode_image(file_bytes)
+        return self._encode_jpeg(image, image_save_quality, stats)
+
+    def resize_and_convert_to_jpeg(
+            self, file_bytes, smallest_side, image_save_quality=75,
+            stats=None):
+        with _time_stage(stats, 'decode'):
+            image = tf.image.decode_image(file_bytes)
+        with _time_stage(stats, 'resize'):
+            image = _aspect_preserving_resize(image, smallest_side)
+            image = tf.cast(image, dtype=tf.uint8)
+        return self._encode_jpeg(image, image_save_quality, stats)
+
+    def resize_and_convert_to_raw(self, file_bytes, output_height,
+                                  output_width, stats=None):
+        with _time_stage(stats, 'decode'):
+            image = tf.image.decode_image(file_bytes, channels=3)
+        with _time_stage(stats, 'resize'):
+            image = tf.image.resize_images(
+                image, [output_height, output_width])
+            image = tf.cast(image, dtype=tf.uint8)
+        with _time_stage(stats, 'encode') as measurement:
+            image_raw = image.numpy().tobytes()
+            measurement['bytes'] = len(image_raw)
+        return image_raw
+
+
+@ImageCodec.register_subclass('pillow')
+class PillowImageCodec(ImageCodec):
+    """ Decode, resize and encode images with Pillow
+
+        Jpegs are decoded in draft mode: libjpeg scales the image by
+        1/2, 1/4 or 1/8 while decoding (in the DCT domain) as long as
+        the result is not smaller than the target size. This skips most of
+        the decoding work for large camera trap images. The image is then
+        resized to the exact target size.
+    """
+
+    def __init__(self):
+        if Image is None:
+            raise ImportError(
+                "The pillow image codec requires Pillow (pip install Pillow)")
+
+    def _open(self, file_bytes):
+        """ Open encoded image bytes (the pixels are decoded lazily) """
+        return Image.open(io.BytesIO(file_bytes))
+
+    def _load(self, image, mode=None):
+        """ Decode an opened image, converted to 'mode' (default: RGB
+            unless the image is grayscale)
+        """
+        if mode is None:
+            mode = image.mode if image.mode in ('L', 'RGB') else 'RGB'
+        if image.mode != mode:
+            return image.convert(mode)
+        image.load()
+        return image
+
+    def _to_jpeg(self, image, image_save_quality, stats):
+        """ Encode image to jpeg """
+        with _time_stage(stats, 'encode') as measurement:
+            output = io.BytesIO()
+            image.save(output, format='JPEG', quality=image_save_quality)
+            jpeg = output.getvalue()
+            measurement['bytes'] = len(jpeg)
+        return jpeg
+
+    def convert_to_jpeg(self, file_bytes, image_save_quality=75, stats=None):
+        with _time_stage(stats, 'decode'):
+            image = self._load(self._open(file_bytes))
+        return self._to_jpeg(image, image_save_quality, stats)
+
+    def resize_and_convert_to_jpeg(
+            self, file_bytes, smallest_side, image_save_quality=75,
+            stats=None):
+        with _time_stage(stats, 'decode'):
+            image = self._open(file_bytes)
+            width, height = image.size
+            new_height, new_width = smallest_size_at_least(
+                height, width, smallest_side)
+            # reduced scale decoding - only has an effect for jpegs
+            image.draft(image.mode, (new_width, new_height))
+            image = self._load(image)
+        with _time_stage(stats, 'resize'):
+            image = image.resize((new_width, new_height), Image.BILINEAR)
+        return self._to_jpeg(image, image_save_quality, stats)
+
+    def resize_and_convert_to_raw(self, file_bytes, output_height,
+                                  output_width, stats=None):
+        with _time_stage(stats, 'decode'):
+            image = self._open(file_bytes)
+            image.draft('RGB', (output_width, output_height))
+            image = self._load(image, 'RGB')
+        with _time_stage(stats, 'resize'):
+            image = image.resize((output_width, output_height),
+                                 Image.BILINEAR)
+        with _time_stage(stats, 'encode') as measurement:
+            image_raw = image.tobytes()
+            measurement['bytes'] = len(image_raw)
+        return image_raw
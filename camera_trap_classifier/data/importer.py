@@ -1,10 +1,13 @@
 """ Class To Import and Read Datasets """
 import os
-import json
+import io
 import csv
 import logging
+from multiprocessing import Pool
 
 from camera_trap_classifier.data.utils import clean_input_path
+from camera_trap_classifier.data.inventory_io import iter_records_from_file
+from camera_trap_classifier.data.file_walker import DirectoryWalker
 
 
 logger = logging.getLogger(__name__)
@@ -59,6 +62,16 @@ class DatasetImporter(object):
         """ Import data """
         raise NotImplementedError
 
+    def iter_records(self):
+        """ Iterate over the valid (record id, record) pairs, importers
+            which can read records incrementally yield them while the
+            source is being read, others import the full source first
+        """
+        data_dict = self.import_from_source()
+        # records are removed from the dict while being yielded
+        for record_id in list(data_dict.keys()):
+            yield record_id, data_dict.pop(record_id)
+
     def _is_labels_ok(self, labels_list):
         """ Check and Clean Labels Dict
 
@@ -141,43 +154,48 @@ class DatasetImporter(object):
         """ Check Each Record and Clean if possible """
 
         valid_data_dict = dict()
-        required_record_entrys = ('labels', 'images')
 
         for record_id, record_values in data_dict.items():
-            # Remove if any record entry is not a dictionary
-            if not isinstance(record_values, dict):
-                logger.debug("Record %s has invalid data and is removed" %
-                             record_id)
-                continue
-            # check existence of required entrys
-            if not all([x in record_values for x in required_record_entrys]):
-                logger.debug("Record %s has not all required record entrys' \
-                             and is removed" % record_id)
-                continue
+            if self._is_record_ok(record_id, record_values):
+                valid_data_dict[record_id] = record_values
 
-            # check labels
-            if not self._is_labels_ok(record_values['labels']):
-                logger.debug("Record %s has invalid labels entry\
-                             and is removed" % record_id)
-                continue
+        return valid_data_dict
 
-            # check images
-            if not self._is_images_ok(record_values['images']):
-                logger.debug("Record %s has invalid images entry \
-                             and is removed" % record_id)
-                continue
+    def _is_record_ok(self, record_id, record_values):
+        """ Check a Record """
+        required_record_entrys = ('labels', 'images')
 
-            # check meta_data entry
-            if 'meta_data' in record_values:
-                if not self._is_ok_metadata(record_values['meta_data']):
-                    logger.debug("Record %s has invalid meta_data entry \
-                                 and is removed" % record_id)
-                    continue
+        # Remove if any record entry is not a dictionary
+        if not isinstance(record_values, dict):
+            logger.debug("Record %s has invalid data and is removed" %
+                         record_id)
+            return False
+        # check existence of required entrys
+        if not all([x in record_values for x in required_record_entrys]):
+            logger.debug("Record %s has not all required record entrys' \
+                         and is removed" % record_id)
+            return False
+
+        # check labels
+        if not self._is_labels_ok(record_values['labels']):
+            logger.debug("Record %s has invalid labels entry\
+                         and is removed" % record_id)
+            return False
 
-            # add valid entries
-            valid_data_dict[record_id] = record_values
+        # check images
+        if not self._is_images_ok(record_values['images']):
+            logger.debug("Record %s has invalid images entry \
+                         and is removed" % record_id)
+            return False
 
-        return valid_data_dict
+        # check meta_data entry
+        if 'meta_data' in record_values:
+            if not self._is_ok_metadata(record_values['meta_data']):
+                logger.debug("Record %s has invalid meta_data entry \
+                             and is removed" % record_id)
+                return False
+
+        return True
 
 
 @DatasetImporter.register_subclass('csv')
@@ -190,18 +208,26 @@ class FromCSV(DatasetImporter):
         image_path_col_list (list): image columns of csv
         attributes_col_list (list): label columns of csv
         meta_col_list (list): additional attributes of csv for import
+        n_processes (int): number of processes to parse the csv, the file
+            is split into chunks of 'chunk_size_mb' (aligned to rows)
+            which are parsed in parallel
+        chunk_size_mb (float): size of the chunks in MB
     """
 
     def __init__(self, path,
                  capture_id_col,
                  image_path_col_list,
                  attributes_col_list,
-                 meta_col_list=None):
+                 meta_col_list=None,
+                 n_processes=1,
+                 chunk_size_mb=64):
         self.path = path
         self.capture_id_col = capture_id_col
         self.image_path_col_list = image_path_col_list
         self.attributes_col_list = attributes_col_list
         self.meta_col_list = meta_col_list
+        self.n_processes = n_processes
+        self.chunk_size = int(chunk_size_mb * 1024 ** 2)
 
         # check input
         if isinstance(self.image_path_col_list, str):
@@ -247,63 +273,100 @@ class FromCSV(DatasetImporter):
             "Path: %s does not exist" % path_to_csv
         data_dict = dict()
         try:
-            with open(path_to_csv, 'r') as f:
-                csv_reader = csv.reader(f, delimiter=',')
-                # Get and check header
-                header = next(csv_reader)
-                assert all([x in header for x in self.cols_in_csv]), \
-                    "CSV must have a header containing following \
-                     entries: %s, found following: %s" \
-                     % (self.cols_in_csv, header)
-                # map columns to position
-                col_mapper = {x: header.index(x) for x in
-                              self.cols_in_csv}
-                for i, row in enumerate(csv_reader):
-                    # extract fields from csv
-                    attrs = {attr: row[ind] for attr, ind in
-                             col_mapper.items()}
-
-                    # build a new record
-                    new_record = {}
-
-                    # get labels
-                    labels = {k: self._convert_missing(str(v))
-                              for k, v in attrs.items() if k in
-                              set(self.attributes_col_list)}
-
-                    new_record['labels'] = [labels]
-
-                    # get images
-                    images = [attrs[im] for im in self.image_path_col_list]
-                    images = [x for x in images if x is not '']
-
-                    new_record['images'] = images
-
-                    # get meta data
-                    if len(self.meta_col_list) > 0:
-                        meta = {k: str(v) for k, v in attrs.items() if k in
-                                set(self.meta_col_list)}
-
-                        new_record['meta_data'] = meta
-
-                    capture_id = attrs[self.capture_id_col]
-
-                    # consolidate records
-                    if capture_id in data_dict:
-                        consolidated_record = self._consolidate_records(
-                            first=data_dict[capture_id],
-                            second=new_record
-                        )
-
-                        data_dict[capture_id] = consolidated_record
-                    else:
-                        data_dict[capture_id] = new_record
+            offsets = _find_csv_chunk_offsets(path_to_csv, self.chunk_size)
+            # Get and check header
+            with open(path_to_csv, 'rb') as f:
+                header = next(csv.reader(
+                    _decode_csv_bytes(f.read(offsets[0])), delimiter=','))
+            assert all([x in header for x in self.cols_in_csv]), \
+                "CSV must have a header containing following \
+                 entries: %s, found following: %s" \
+                 % (self.cols_in_csv, header)
+            # map columns to position
+            col_mapper = {x: header.index(x) for x in
+                          self.cols_in_csv}
+            chunks = [(self, path_to_csv, start, end, col_mapper)
+                      for start, end in zip(offsets[:-1], offsets[1:])]
+            if self.n_processes > 1 and len(chunks) > 1:
+                logger.info("Reading csv in %s chunks with %s processes" %
+                            (len(chunks), self.n_processes))
+                pool = Pool(processes=self.n_processes)
+                try:
+                    for chunk_dict in pool.imap(_read_csv_chunk, chunks):
+                        self._merge_records(data_dict, chunk_dict)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                for chunk in chunks:
+                    self._merge_records(data_dict, _read_csv_chunk(chunk))
 
         except Exception as e:
             logger.error('Failed to read csv:\n' + str(e))
 
         return data_dict
 
+    def _read_csv_rows(self, csv_reader, col_mapper):
+        """ Create records from csv rows, rows with identical capture
+            ids are consolidated
+        """
+        data_dict = dict()
+        attributes_cols = set(self.attributes_col_list)
+        meta_cols = set(self.meta_col_list)
+        for i, row in enumerate(csv_reader):
+            # extract fields from csv
+            attrs = {attr: row[ind] for attr, ind in
+                     col_mapper.items()}
+
+            # build a new record
+            new_record = {}
+
+            # get labels
+            labels = {k: self._convert_missing(str(v))
+                      for k, v in attrs.items() if k in
+                      attributes_cols}
+
+            new_record['labels'] = [labels]
+
+            # get images
+            images = [attrs[im] for im in self.image_path_col_list]
+            images = [x for x in images if x != '']
+
+            new_record['images'] = images
+
+            # get meta data
+            if len(self.meta_col_list) > 0:
+                meta = {k: str(v) for k, v in attrs.items() if k in
+                        meta_cols}
+
+                new_record['meta_data'] = meta
+
+            capture_id = attrs[self.capture_id_col]
+
+            self._add_record(data_dict, capture_id, new_record)
+
+        return data_dict
+
+    def _add_record(self, data_dict, capture_id, new_record):
+        """ Add a record to data_dict, consolidate it with an existing
+            record with the same capture id
+        """
+        # consolidate records
+        if capture_id in data_dict:
+            consolidated_record = self._consolidate_records(
+                first=data_dict[capture_id],
+                second=new_record
+            )
+
+            data_dict[capture_id] = consolidated_record
+        else:
+            data_dict[capture_id] = new_record
+
+    def _merge_records(self, data_dict, new_records):
+        """ Add the records of a chunk to data_dict """
+        for capture_id, new_record in new_records.items():
+            self._add_record(data_dict, capture_id, new_record)
+
     def _consolidate_records(self, first, second):
         """ Consolidate records with identical capture event id """
         images = first['images']
@@ -315,54 +378,128 @@ class FromCSV(DatasetImporter):
             return {'images': images, 'labels': labels}
 
 
+def _decode_csv_bytes(data):
+    """ Decode bytes of a csv file like open(path, 'r') """
+    return io.TextIOWrapper(io.BytesIO(data))
+
+
+def _find_csv_chunk_offsets(path, chunk_size):
+    """ Split a csv file into chunks of about chunk_size bytes which end
+        at the end of a row (a line break outside of quotes, quote
+        characters are expected to only enclose fields or to be doubled
+        within quoted fields)
+        Returns: offsets - the first is the end of the header row, the
+                 last the size of the file
+    """
+    offsets = list()
+    # number of quote characters so far is odd (within a quoted field)
+    in_quotes = False
+    position = 0
+    with open(path, 'rb') as f:
+        # the header row is a chunk of size 0
+        block = b''
+        while True:
+            while True:
+                line = f.readline()
+                position += len(line)
+                in_quotes ^= line.count(b'"') % 2 == 1
+                if not in_quotes or line == b'':
+                    break
+            offsets.append(position)
+            if line == b'':
+                break
+            block = f.read(chunk_size)
+            if block == b'':
+                break
+            position += len(block)
+            in_quotes ^= block.count(b'"') % 2 == 1
+    if offsets[-1] != position:
+        offsets.append(position)
+    return offsets
+
+
+def _read_csv_chunk(chunk):
+    """ Read the records of the rows in a chunk of a csv file """
+    importer, path, start, end, col_mapper = chunk
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    csv_reader = csv.reader(_decode_csv_bytes(data), delimiter=',')
+    return importer._read_csv_rows(csv_reader, col_mapper)
+
+
 @DatasetImporter.register_subclass('json')
 class FromJson(DatasetImporter):
-    """ Read Data From Json """
+    """ Read Data From Json (one object with all records) or Json Lines
+        (one record per line, file ending .jsonl) - the file is read
+        incrementally
+    """
 
     def __init__(self, path):
         self.path = path
 
     def import_from_source(self):
         """ Read Json File """
-        data_dict = self._read_json(self.path)
-        data_dict_clean = super()._remove_invalid_entries(data_dict)
-        return data_dict_clean
+        return dict(self.iter_records())
 
-    def _read_json(self, path_to_json):
-        """ Read File """
-        assert os.path.exists(path_to_json), \
-            "Path: %s does not exist" % path_to_json
+    def iter_records(self):
+        """ Iterate over the valid (record id, record) pairs while the
+            file is being read
+        """
+        assert os.path.exists(self.path), \
+            "Path: %s does not exist" % self.path
 
+        n_records = 0
+        n_valid = 0
         try:
-            with open(path_to_json, 'r') as f:
-                data_dict = json.load(f)
-        except Exception as e:
+            for record_id, record_values in iter_records_from_file(
+                    self.path):
+                n_records += 1
+                if self._is_record_ok(record_id, record_values):
+                    n_valid += 1
+                    yield record_id, record_values
+        except ValueError as e:
             logger.error('Failed to read Json:\n' + str(e))
+            raise
 
-        n_records = len(data_dict.keys())
-        logger.info("Read %s records from %s" % (n_records, path_to_json))
-
-        return data_dict
+        logger.info("Read %s records from %s (%s valid)" %
+                    (n_records, self.path, n_valid))
 
 
 @DatasetImporter.register_subclass('image_dir')
 class FromImageDirs(DatasetImporter):
-    """ Read Data From Json """
+    """ Read Data From Class Directories
 
-    def __init__(self, path):
+    Args:
+        path (str): path to a directory with one directory per class
+        n_threads (int): number of threads listing the class directories
+        listing_cache_path (str): json file to cache the directory
+            listings, only changed directories are listed again
+    """
+
+    def __init__(self, path, n_threads=8, listing_cache_path=None):
         self.path = path
+        self.n_threads = n_threads
+        self.listing_cache_path = listing_cache_path
 
     def import_from_source(self):
         """ Create inventory from path which contains class-specific
             directories
         """
+        return dict(self.iter_records())
+
+    def iter_records(self):
+        """ Iterate over the valid (record id, record) pairs while the
+            class directories are being listed
+        """
         root_path = clean_input_path(self.path)
         assert os.path.exists(root_path), \
             "Path: %s does not exist" % root_path
 
-        data_dict = self._create_dict_from_image_folders(root_path)
-        data_dict_clean = super()._remove_invalid_entries(data_dict)
-        return data_dict_clean
+        for record_id, record_values in \
+                self._iter_records_from_image_folders(root_path):
+            if self._is_record_ok(record_id, record_values):
+                yield record_id, record_values
 
     def _check_image_path(self, root_path):
         """ Check Root Path for Class Dirs """
@@ -381,15 +518,22 @@ class FromImageDirs(DatasetImporter):
 
         return class_dir_list
 
-    def _create_dict_from_image_folders(self, root_path):
-        """ create dictionary from image paths """
+    def _iter_records_from_image_folders(self, root_path):
+        """ Create records from image paths """
 
-        class_dir_list = self._check_image_path(root_path)
+        class_dir_list = set(self._check_image_path(root_path))
 
-        # Process each image and create data dictionary
-        all_images_data = dict()
-        for class_dir in class_dir_list:
-            for image_name in os.listdir(root_path + class_dir):
+        # List the class directories concurrently
+        walker = DirectoryWalker(n_threads=self.n_threads,
+                                 cache_path=self.listing_cache_path)
+        n_images = 0
+        for dir_path, _, file_names in walker.walk(
+                root_path, max_depth=1, followlinks=True):
+            class_dir = dir_path[len(root_path):]
+            if dir_path == root_path or class_dir not in class_dir_list:
+                continue
+            # Process each image and create a record
+            for image_name in file_names:
                 splitted_file_name = image_name.split(".")
                 if len(splitted_file_name) > 2:
                     logger.info("File %s has more than one . \
@@ -401,8 +545,7 @@ class FromImageDirs(DatasetImporter):
                     'images': [root_path + class_dir +
                                os.path.sep + image_name],
                     'labels': [{'class': class_dir}]}
-                all_images_data[unique_image_id] = image_data
-
-        logger.info("Found %s images" % len(all_images_data.keys()))
+                n_images += 1
+                yield unique_image_id, image_data
 
-        return all_images_data
+        logger.info("Found %s images" % n_images)
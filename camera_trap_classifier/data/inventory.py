@@ -2,13 +2,19 @@
 import random
 import json
 import logging
-import copy
+from collections.abc import Mapping
 
 
 from camera_trap_classifier.data.utils import (
     randomly_split_dataset, map_label_list_to_numeric_dict,
     export_dict_to_json, _balanced_sampling)
 from camera_trap_classifier.data.importer import DatasetImporter
+from camera_trap_classifier.data.inventory_store import (
+    ColumnarInventoryStore, InventoryView, get_record_images)
+from camera_trap_classifier.data.label_index import LabelIndex
+from camera_trap_classifier.data.inventory_io import write_records_to_file
+from camera_trap_classifier.data.inventory_snapshot import (
+    save_snapshot, load_snapshot)
 
 
 logger = logging.getLogger(__name__)
@@ -17,6 +23,14 @@ logger = logging.getLogger(__name__)
 class DatasetInventory(object):
     """ Defines a Datset Inventory - Contains labels, links and data about each
         Record
+
+        data_inventory is a dict or a ColumnarInventoryStore, records of
+        the latter are copies, thus modified records have to be assigned
+        to data_inventory again
+
+        Label statistics are taken from an inverted label index which is
+        built on first use and updated when records are removed - it is
+        reset when data_inventory is replaced.
     """
 
     missing_label_value = '-1'
@@ -34,9 +48,31 @@ class DatasetInventory(object):
         """ Count and Return number of records """
         return len(self.data_inventory.keys())
 
+    @property
+    def data_inventory(self):
+        return self._data_inventory
+
+    @data_inventory.setter
+    def data_inventory(self, data_inventory):
+        self._data_inventory = data_inventory
+        self._label_index = None
+
+    @property
+    def label_index(self):
+        """ Inverted index of the labels (built on first use) """
+        if self._label_index is None:
+            self._label_index = LabelIndex.from_inventory(self.data_inventory)
+        return self._label_index
+
     def remove_record(self, id_to_remove):
         """ Remove specific record """
-        self.data_inventory.pop(id_to_remove, None)
+        record = self.data_inventory.pop(id_to_remove, None)
+        if record is not None and self._label_index is not None:
+            self._label_index.remove_record(id_to_remove, record)
+
+    def _create_empty_inventory(self):
+        """ Empty inventory of the same type as data_inventory """
+        return type(self.data_inventory)()
 
     def _get_all_labels(self):
         """ Extract all labels
@@ -44,14 +80,10 @@ class DatasetInventory(object):
                       'count': ('1', '2')}
         """
         all_labels = dict()
-        for k, v in self.data_inventory.items():
-            for label_entry in v['labels']:
-                # For each record get and count label types and labels
-                for label_name, label_value in label_entry.items():
-                    if label_name not in all_labels:
-                        all_labels[label_name] = set()
-                    if not label_value == type(self).missing_label_value:
-                        all_labels[label_name].add(label_value)
+        for label_name, label_counts in self._calc_label_stats().items():
+            all_labels[label_name] = {
+                x for x in label_counts.keys()
+                if not x == type(self).missing_label_value}
         return all_labels
 
     def _calc_label_stats(self):
@@ -59,18 +91,7 @@ class DatasetInventory(object):
             Returns: {'species': {'Zebra': 3, 'Elephant': 6},
                       'counts': {'1': 5, '2': 10}}
         """
-        # Calculate and log statistics about labels
-        label_stats = dict()
-        for _id, data in self.data_inventory.items():
-            # For each record get and count label types and labels
-            for label_entry in data['labels']:
-                for label_name, label_val in label_entry.items():
-                    if label_name not in label_stats:
-                        label_stats[label_name] = dict()
-                    if label_val not in label_stats[label_name]:
-                        label_stats[label_name][label_val] = 0
-                    label_stats[label_name][label_val] += 1
-        return label_stats
+        return self.label_index.get_label_counts()
 
     def log_stats(self, debug_only=False):
         """ Logs Statistics about Data Inventory """
@@ -100,11 +121,12 @@ class DatasetInventory(object):
                          round(100 * (count_list[idx]/total_counts), 4)))
 
     def export_to_json(self, json_path):
-        """ Export Inventory to Json File """
+        """ Export Inventory to Json (or Json Lines) File """
 
         if self.data_inventory is not None:
-            with open(json_path, 'w') as fp:
-                json.dump(self.data_inventory, fp)
+            # written record by record, as json lines if json_path
+            # ends with .jsonl
+            write_records_to_file(self.data_inventory.items(), json_path)
 
             logger.info("Data Inventory saved to %s" % json_path)
         else:
@@ -115,12 +137,8 @@ class DatasetInventory(object):
                            **kwargs):
         """ Export Dataset to TFRecod """
 
-        # create tfrecord dictionary
-        tfrecord_dict = dict()
-        for _id, record_values in self.data_inventory.items():
-            tfr_record = self._convert_record_to_tfr_format(
-                _id, record_values)
-            tfrecord_dict[_id] = tfr_record
+        # records are converted to the tfr format while being written
+        tfrecord_dict = _TFRecordView(self)
 
         # Write to disk
         tfr_writer.encode_to_tfr(tfrecord_dict, tfr_path, **kwargs)
@@ -177,6 +195,43 @@ class DatasetInventory(object):
 
         return tfr_data
 
+    def _map_labels_to_numeric(self):
+        """ Map all labels to numerics """
+
+        if self.labels_numeric_map is None:
+            self.labels = self._get_all_labels()
+            labels_numeric_map = dict()
+
+            for label_name, label_set in self.labels.items():
+                mapped = map_label_list_to_numeric_dict(list(label_set))
+                labels_numeric_map[label_name] = mapped
+
+            self.labels_numeric_map = labels_numeric_map
+        else:
+            self._extend_labels_numeric_map()
+
+        # create numeric to text labels as well
+        self.label_mapping_from_num = \
+            {k: {kk: vv for vv, kk in v.items()}
+             for k, v in self.labels_numeric_map.items()}
+
+    def _extend_labels_numeric_map(self):
+        """ Add labels which are not in the (pre-defined) numeric label map
+            by assigning new numeric values after the existing ones, thus
+            existing mappings remain unchanged
+        """
+        for label_name, label_set in self._get_all_labels().items():
+            mapping = self.labels_numeric_map.get(label_name, dict())
+            new_labels = sorted(label_set - mapping.keys())
+            if len(new_labels) == 0:
+                continue
+            next_value = max(mapping.values(), default=-1) + 1
+            for i, label in enumerate(new_labels):
+                mapping[label] = next_value + i
+            self.labels_numeric_map[label_name] = mapping
+            logger.info("Adding %s new labels to the mapping of %s" %
+                        (len(new_labels), label_name))
+
     def export_label_mapping(self, path):
         """ Export Label Mapping to Json file """
         assert self.labels_numeric_map is not None, \
@@ -185,50 +240,114 @@ class DatasetInventory(object):
         export_dict_to_json(self.labels_numeric_map, path)
 
 
+class _TFRecordView(Mapping):
+    """ Records of a DatasetInventory converted to the tfr format when
+        accessed - each access converts the record again, DatasetWriter
+        converts each record once per shard
+    """
+    def __init__(self, inventory):
+        self._inventory = inventory
+
+    def __len__(self):
+        return len(self._inventory.data_inventory)
+
+    def __iter__(self):
+        return iter(self._inventory.data_inventory)
+
+    def __getitem__(self, record_id):
+        return self._inventory._convert_record_to_tfr_format(
+            record_id, self._inventory.data_inventory[record_id])
+
+    def get_image_paths(self, record_id):
+        """ Image paths of a record without converting the record """
+        return get_record_images(self._inventory.data_inventory, record_id)
+
+
 class DatasetInventorySplit(DatasetInventory):
     """ Datset Dictionary Split - Does not allow further
         manipulations
+
+        data_inventory of splits created by DatasetInventoryMaster is an
+        InventoryView of the records of the master
     """
-    def __init__(self, data_inventory, labels, labels_numeric_map):
+    def __init__(self, data_inventory, labels, labels_numeric_map,
+                 label_index=None):
         self.data_inventory = data_inventory
         self.labels = labels
         self.labels_numeric_map = labels_numeric_map
+        # label index of data_inventory (e.g. built while splitting)
+        self._label_index = label_index
 
 
 class DatasetInventoryMaster(DatasetInventory):
     """ Creates Datset Dictionary from a source and allows to
         manipulate labels and create splits
-    """
-    def __init__(self, labels_numeric_map=None):
-        self.data_inventory = None
-        self.labels = None
-        self.labels_numeric_map = labels_numeric_map
-
-    def _map_labels_to_numeric(self):
-        """ Map all labels to numerics """
 
-        if self.labels_numeric_map is None:
-            self.labels = self._get_all_labels()
-            labels_numeric_map = dict()
+        backend: 'dict' to store records as dicts or 'columnar' to store
+            them in a ColumnarInventoryStore (much less memory for large
+            inventories, slower access of single records)
 
-            for label_name, label_set in self.labels.items():
-                mapped = map_label_list_to_numeric_dict(list(label_set))
-                labels_numeric_map[label_name] = mapped
+        Label filters use the inverted label index.
 
-            self.labels_numeric_map = labels_numeric_map
+        Splits are views of the records of the master, thus the master
+        should not be changed after splitting.
+    """
+    backends = ('dict', 'columnar')
 
-        # create numeric to text labels as well
-        self.label_mapping_from_num = \
-            {k: {kk: vv for vv, kk in v.items()}
-             for k, v in self.labels_numeric_map.items()}
+    def __init__(self, labels_numeric_map=None, backend='dict'):
+        if backend not in self.backends:
+            raise ValueError("backend %s not in %s" % (backend, self.backends))
+        self.data_inventory = None
+        self.labels = None
+        self.labels_numeric_map = labels_numeric_map
+        self.backend = backend
+        # {record_id: split name} of the last split / loaded snapshot
+        self.split_assignments = None
 
     def create_from_source(self, type, params):
         """ Create Dataset Inventory from a specific Source """
         importer = DatasetImporter().create(type, params)
-        self.data_inventory = importer.import_from_source()
+        if self.backend == 'columnar':
+            # store records while they are being read
+            data_inventory = ColumnarInventoryStore()
+            for record_id, record in importer.iter_records():
+                data_inventory[record_id] = record
+            self.data_inventory = data_inventory
+            logger.info("Stored %s records in columns of %s MB" % (
+                len(self.data_inventory),
+                self.data_inventory.get_memory_bytes() // 1024 ** 2))
+        else:
+            self.data_inventory = importer.import_from_source()
         # self.label_handler = LabelHandler(self.data_inventory)
         # self.label_handler.remove_not_all_label_attributes()
 
+    def create_from_snapshot(self, path):
+        """ Create Dataset Inventory from a binary snapshot, restores the
+            numeric label mapping (unless pre-defined) and the split
+            assignments (if the snapshot has them)
+        """
+        store, labels_numeric_map, split_assignments = load_snapshot(path)
+        if self.backend == 'dict':
+            self.data_inventory = dict(store.items())
+        else:
+            self.data_inventory = store
+        if self.labels_numeric_map is None:
+            self.labels_numeric_map = labels_numeric_map
+        self.split_assignments = split_assignments
+
+    def export_to_snapshot(self, path):
+        """ Export Inventory, numeric label mapping and split assignments
+            (if the inventory was split) to a binary snapshot
+        """
+        if isinstance(self.data_inventory, ColumnarInventoryStore):
+            store = self.data_inventory
+        else:
+            store = ColumnarInventoryStore()
+            for record_id, record in self.data_inventory.items():
+                store[record_id] = record
+        save_snapshot(path, store, self.labels_numeric_map,
+                      self.split_assignments)
+
     def remove_multi_label_records(self):
         """ Remove records with multiple labels / observations """
         to_remove = list()
@@ -245,7 +364,7 @@ class DatasetInventoryMaster(DatasetInventory):
         if not p_keep <= 1:
             raise ValueError("p has to be between 0 and 1")
 
-        new_data_inv = dict()
+        new_data_inv = self._create_empty_inventory()
         all_ids = list(self.data_inventory.keys())
         n_total = len(all_ids)
         n_choices = int(n_total * p_keep)
@@ -273,15 +392,8 @@ class DatasetInventoryMaster(DatasetInventory):
         """ Remove all records with 'label_value' for 'label_name'
             Example: label_name: 'species' label_value: 'Zebra'
         """
-        ids_to_remove = list()
-
-        for record_id, record_value in self.data_inventory.items():
-            labels_list = record_value['labels']
-            for label in labels_list:
-                for l_name, l_val_list in label.items():
-                    if (label_name == l_name):
-                        if label_value in l_val_list:
-                            ids_to_remove.append(record_id)
+        ids_to_remove = list(
+            self.label_index.get_record_ids(label_name, label_value))
 
         logger.info("Removing %s records from label %s with value %s" %
                     (len(ids_to_remove), label_name, label_value))
@@ -311,25 +423,85 @@ class DatasetInventoryMaster(DatasetInventory):
     def _keep_only_record_with_label(self, label_name, label_value):
         """ Keep only records with the label_value of the label_name
         """
-        ids_to_keep = set()
+        return set(self.label_index.get_record_ids(label_name, label_value))
+
+    def remove_images(self, image_paths):
+        """ Remove images from all records (e.g. invalid images) and
+            remove records without any remaining images
+        """
+        image_paths = set(image_paths)
+        ids_to_remove = list()
+        n_images_removed = 0
         for record_id, record_value in self.data_inventory.items():
-            labels_list = record_value['labels']
-            for label in labels_list:
-                for l_name, l_val in label.items():
-                    if (label_name == l_name):
-                        if label_value == l_val:
-                            ids_to_keep.add(record_id)
-        return ids_to_keep
+            images = [x for x in record_value['images']
+                      if x not in image_paths]
+            n_removed = len(record_value['images']) - len(images)
+            if n_removed > 0:
+                n_images_removed += n_removed
+                record_value['images'] = images
+                self.data_inventory[record_id] = record_value
+            if len(images) == 0:
+                ids_to_remove.append(record_id)
+
+        logger.info("Removed %s images - removing %s records without images" %
+                    (n_images_removed, len(ids_to_remove)))
+
+        for id_to_remove in ids_to_remove:
+            self.remove_record(id_to_remove)
+
+    def deduplicate_images(self, image_hashes, mode='drop'):
+        """ Handle identical images (according to 'image_hashes':
+            {image path: hash}), the first occurrence in the order of the
+            record ids is kept
+            mode:
+                'drop': remove duplicate images from records and remove
+                        records without any remaining images
+                'reference': replace the paths of duplicate images with
+                        the path of the first occurrence, such that each
+                        unique image is only processed once
+            Returns: number of duplicate images
+        """
+        assert mode in ('drop', 'reference'), \
+            "mode must be 'drop' or 'reference'"
+        first_paths = dict()
+        ids_to_remove = list()
+        n_duplicates = 0
+        for record_id in sorted(self.data_inventory.keys()):
+            record_value = self.data_inventory[record_id]
+            images = list()
+            for image_path in record_value['images']:
+                image_hash = image_hashes.get(image_path, None)
+                if image_hash is None:
+                    images.append(image_path)
+                    continue
+                if image_hash not in first_paths:
+                    first_paths[image_hash] = image_path
+                    images.append(image_path)
+                    continue
+                n_duplicates += 1
+                if mode == 'reference':
+                    images.append(first_paths[image_hash])
+            if images != record_value['images']:
+                record_value['images'] = images
+                self.data_inventory[record_id] = record_value
+            if len(images) == 0:
+                ids_to_remove.append(record_id)
+
+        logger.info("Found %s duplicate images (mode: %s) - removing %s \
+                     records without images" %
+                    (n_duplicates, mode, len(ids_to_remove)))
+
+        for id_to_remove in ids_to_remove:
+            self.remove_record(id_to_remove)
+
+        return n_duplicates
 
     def _remove_records_with_any_missing_label(self):
         """ Remove any records with the default missing value of -1 """
         ids_to_remove = set()
-        for record_id, record_value in self.data_inventory.items():
-            labels_list = record_value['labels']
-            for label in labels_list:
-                for l_vals in label.values():
-                    if l_vals == type(self).missing_label_value:
-                        ids_to_remove.add(record_id)
+        for label_name in self.label_index.get_label_names():
+            ids_to_remove.update(self.label_index.get_record_ids(
+                label_name, type(self).missing_label_value))
 
         logger.info("Removing %s records with missing labels" %
                     len(ids_to_remove))
@@ -341,10 +513,16 @@ class DatasetInventoryMaster(DatasetInventory):
             self,
             split_label_min,
             split_names,
-            split_percent):
+            split_percent,
+            n_processes=1,
+            max_per_class=None):
         """ Split inventory randomly into different sets
             according to
                 split_label_min: e.g 'species'
+            the record ids are hashed in 'n_processes' processes,
+            max_per_class: sample at most this number of records per label
+                (int or dict label: int) instead of the number of records
+                of the least frequent label
             Returns dict: {'id1': 'test', 'id2': 'train'}
         """
 
@@ -366,7 +544,9 @@ class DatasetInventoryMaster(DatasetInventory):
             split_names,
             split_percent,
             balanced_sampling_min=True,
-            balanced_sampling_id_to_label=ids_to_split_label)
+            balanced_sampling_id_to_label=ids_to_split_label,
+            n_processes=n_processes,
+            balanced_sampling_max_per_class=max_per_class)
 
         logger.debug("Found %s records with split assignments" %
                       len(split_assignments.keys()))
@@ -376,8 +556,10 @@ class DatasetInventoryMaster(DatasetInventory):
     def split_inventory_by_random_splits(
             self,
             split_names,
-            split_percent):
-        """ Split inventory randomly into different sets
+            split_percent,
+            n_processes=1):
+        """ Split inventory randomly into different sets,
+            the record ids are hashed in 'n_processes' processes
             Returns dict: {'id1': 'test', 'id2': 'train'}
         """
 
@@ -388,7 +570,8 @@ class DatasetInventoryMaster(DatasetInventory):
             split_names,
             split_percent,
             balanced_sampling_min=False,
-            balanced_sampling_id_to_label=None)
+            balanced_sampling_id_to_label=None,
+            n_processes=n_processes)
 
         return self._convert_splits_to_dataset_inventorys(split_assignments)
 
@@ -411,10 +594,12 @@ class DatasetInventoryMaster(DatasetInventory):
     def split_inventory_by_meta_data_column_and_balanced_sampling(
             self,
             meta_colum,
-            split_label_min
+            split_label_min,
+            max_per_class=None
             ):
         """ Split inventory into different sets based on
             meta_data_column after balanced sampling
+            (see split_inventory_by_random_splits_with_balanced_sample)
         """
 
         id_to_label = dict()
@@ -426,7 +611,8 @@ class DatasetInventoryMaster(DatasetInventory):
                 label = record_data['labels'][0][split_label_min]
                 id_to_label[record_id] = label
 
-        remaining_ids = set(_balanced_sampling(id_to_label))
+        remaining_ids = _balanced_sampling(
+            id_to_label, max_per_class=max_per_class)
 
         split_assignments = dict()
 
@@ -437,9 +623,20 @@ class DatasetInventoryMaster(DatasetInventory):
 
         return self._convert_splits_to_dataset_inventorys(split_assignments)
 
+    def split_inventory_by_assignments(self, split_assignments):
+        """ Split inventory according to split assignments
+            {record_id: split name}, e.g. of a snapshot, records without
+            assignment are dropped
+        """
+        split_assignments = {k: v for k, v in split_assignments.items()
+                             if k in self.data_inventory}
+        return self._convert_splits_to_dataset_inventorys(split_assignments)
+
     def _convert_splits_to_dataset_inventorys(self, split_assignments):
         """ Convert split assignments to new splitted dataset inventories """
 
+        self.split_assignments = split_assignments
+
         # label overview
         all_labels = self._get_all_labels()
         self._map_labels_to_numeric()
@@ -454,15 +651,18 @@ class DatasetInventoryMaster(DatasetInventory):
         splitted_inventories = dict()
 
         for split, record_list in split_to_record.items():
-            split_dict = dict()
+            split_label_index = LabelIndex()
             for record_id in record_list:
-                split_dict[record_id] = self.data_inventory[record_id]
+                split_label_index.add_record(
+                    record_id, self.data_inventory[record_id])
+            split_view = InventoryView(self.data_inventory, record_list)
             logger.debug("Creating dataset split %s with %s records" %
-                          (split, len(split_dict.keys())))
+                          (split, len(split_view)))
             splitted_inventories[split] = DatasetInventorySplit(
-                                            split_dict,
+                                            split_view,
                                             all_labels,
-                                            self.labels_numeric_map)
+                                            self.labels_numeric_map,
+                                            split_label_index)
 
         return splitted_inventories
 
@@ -473,19 +673,78 @@ class DatasetInventoryMaster(DatasetInventory):
                 {'species': {'Zebra': 'species', 'Elephant': 'species',
                              'blank': 'blank'},
                  'counts': {'1': '1-5'}}
+
+            Only records with affected labels are changed. Changed records
+            are replaced by new records (copy-on-write), thus records
+            obtained before remain unchanged.
+
+            Returns: statistics of the changes
+                {'species': {'Zebra': {'new_value': 'species',
+                                       'n_records': 10, 'n_labels': 12}}}
         """
-        new_inventory = copy.deepcopy(self.data_inventory)
-        # Loop over records
-        for record_id, record_value in self.data_inventory.items():
-            # loop over list of label entries [{species:}, {species:}]
-            for i, labels in enumerate(record_value['labels']):
-                # Loop over label names
-                for label_name, label_value_list in labels.items():
-                    if label_name in label_map_dict:
-                        # loop over label name entries
-                        for j, label_value in enumerate(label_value_list):
-                            if label_value in label_map_dict[label_name]:
-                                new_label = label_map_dict[label_name][label_value]
-                                new_inventory[record_id]['labels'][i][label_name][j][new_label]
-
-        self.data_inventory = new_inventory
+        # only values which change
+        value_maps = dict()
+        for label_name, value_map in label_map_dict.items():
+            value_map = {k: v for k, v in value_map.items() if k != v}
+            if len(value_map) > 0:
+                value_maps[label_name] = value_map
+
+        # affected records per unique label value
+        stats = dict()
+        record_ids_to_change = set()
+        label_record_ids = dict()
+        for label_name, value_map in value_maps.items():
+            for old_value, new_value in value_map.items():
+                record_ids = self.label_index.get_record_ids(
+                    label_name, old_value)
+                if len(record_ids) == 0:
+                    continue
+                record_ids_to_change.update(record_ids)
+                label_record_ids.setdefault(label_name, set()).update(
+                    record_ids)
+                stats.setdefault(label_name, dict())[old_value] = {
+                    'new_value': new_value,
+                    'n_records': len(record_ids),
+                    'n_labels': 0}
+
+        if isinstance(self.data_inventory, ColumnarInventoryStore):
+            for label_name, value_map in value_maps.items():
+                counts = self.data_inventory.remap_label_values(
+                    label_name, value_map,
+                    label_record_ids.get(label_name, list()))
+                for old_value, n_labels in counts.items():
+                    stats[label_name][old_value]['n_labels'] = n_labels
+        else:
+            for record_id in record_ids_to_change:
+                self._remap_record_labels(record_id, value_maps, stats)
+
+        for label_name, value_map in value_maps.items():
+            self.label_index.remap_values(label_name, value_map)
+
+        for label_name, label_stats in stats.items():
+            for old_value, change in label_stats.items():
+                logger.info(
+                    "Remapped label %s: %s -> %s (%s labels of %s records)" %
+                    (label_name, old_value, change['new_value'],
+                     change['n_labels'], change['n_records']))
+        logger.info("Remapped labels of %s records" %
+                    len(record_ids_to_change))
+
+        return stats
+
+    def _remap_record_labels(self, record_id, value_maps, stats):
+        """ Replace a record by a copy with remapped labels """
+        record = self.data_inventory[record_id]
+        new_labels = list()
+        for label in record['labels']:
+            new_label = dict(label)
+            for label_name, label_value in label.items():
+                value_map = value_maps.get(label_name, None)
+                if value_map is None or label_value not in value_map:
+                    continue
+                new_label[label_name] = value_map[label_value]
+                stats[label_name][label_value]['n_labels'] += 1
+            new_labels.append(new_label)
+        new_record = dict(record)
+        new_record['labels'] = new_labels
+        self.data_inventory[record_id] = new_record
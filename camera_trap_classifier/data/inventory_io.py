@@ -0,0 +1,163 @@
+""" Stream Dataset Inventory Records from and to Files
+
+Two formats are supported:
+- json: one object with all records {"id1": {record}, "id2": {record}}
+- json lines (.jsonl): one record per line {"id": "id1", **record}
+
+Both are read incrementally, such that only one record at a time (and
+a buffer of the file) is held in memory and records can be processed
+while the file is still being read.
+"""
+import os
+import re
+import json
+
+
+JSON_LINES_EXTENSIONS = ('.jsonl', '.ndjson')
+
+# key of the record id in json lines records
+JSON_LINES_ID = 'id'
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+def is_json_lines_path(path):
+    """ Whether a path has the file extension of a json lines file """
+    return os.path.splitext(path)[1].lower() in JSON_LINES_EXTENSIONS
+
+
+class _JsonStreamReader(object):
+    """ Decodes consecutive JSON values from a file object using a buffer
+        of the file
+    """
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _read(self):
+        """ Read the next chunk, returns False at the end of the file """
+        chunk = self.f.read(self.chunk_size)
+        if chunk == '':
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self._read():
+                return
+
+    def next_char(self):
+        """ The next non-whitespace character """
+        self._skip_whitespace()
+        if self.pos >= len(self.buffer):
+            raise ValueError("Unexpected end of the json file")
+        char = self.buffer[self.pos]
+        self.pos += 1
+        return char
+
+    def peek(self):
+        """ The next non-whitespace character (without consuming it) """
+        self._skip_whitespace()
+        return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, expected):
+        """ Consume the next non-whitespace character """
+        char = self.next_char()
+        if char != expected:
+            raise ValueError("Invalid json: expected '%s' but found '%s'" %
+                             (expected, char))
+
+    def decode(self):
+        """ Decode the next value """
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # the value continues in the next chunk
+                if not self._read():
+                    raise
+                continue
+            # numbers could continue in the next chunk
+            if end == len(self.buffer) and not self.eof and self._read():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_object(path, chunk_size=1024 ** 2):
+    """ Iterate over the (key, value) pairs of a file with one json
+        object without decoding the whole file at once
+    """
+    with open(path, 'r') as f:
+        reader = _JsonStreamReader(f, chunk_size)
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            key = reader.decode()
+            reader.expect(':')
+            value = reader.decode()
+            yield key, value
+            char = reader.next_char()
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(
+                    "Invalid json: expected ',' or '}' but found '%s'" %
+                    char)
+
+
+def iter_json_lines(path):
+    """ Iterate over the (record id, record) pairs of a json lines file """
+    with open(path, 'r') as f:
+        for i, line in enumerate(f):
+            if line.strip() == '':
+                continue
+            try:
+                record = json.loads(line)
+                record_id = record.pop(JSON_LINES_ID)
+            except (ValueError, KeyError, AttributeError) as e:
+                raise ValueError("Invalid record in line %s of %s: %s" %
+                                 (i + 1, path, e))
+            yield record_id, record
+
+
+def iter_records_from_file(path):
+    """ Iterate over the (record id, record) pairs of a json or json
+        lines file (according to the file extension)
+    """
+    if is_json_lines_path(path):
+        return iter_json_lines(path)
+    return iter_json_object(path)
+
+
+def write_records_to_file(records, path):
+    """ Write (record id, record) pairs to a json or json lines file
+        (according to the file extension), the json file is identical
+        to json.dump of a dict of all records
+    """
+    json_lines = is_json_lines_path(path)
+    with open(path, 'w') as f:
+        if not json_lines:
+            f.write('{')
+        for i, (record_id, record) in enumerate(records):
+            if json_lines:
+                f.write(json.dumps({JSON_LINES_ID: record_id, **record}))
+                f.write('\n')
+            else:
+                if i > 0:
+                    f.write(', ')
+                f.write(json.dumps(str(record_id)))
+                f.write(': ')
+                f.write(json.dumps(record))
+        if not json_lines:
+            f.write('}')
@@ -0,0 +1,192 @@
+""" Binary Snapshot of a Dataset Inventory
+
+Saves the columns of a ColumnarInventoryStore together with the numeric
+label mapping and (optionally) split assignments to a binary file which
+is reloaded much faster than a json inventory since no records have to
+be parsed. The file is memory-mapped when loading and each column is
+copied with a single memory copy.
+
+Layout:
+    prefix: magic (8 bytes), version (uint32), header size (uint64),
+            crc32 checksum of all bytes after the prefix (uint32)
+    header: utf-8 json with the category tables, the numeric label
+            mapping, the split names and the location of each column
+    data:   the columns (little-endian), each aligned to 8 bytes
+"""
+import sys
+import json
+import mmap
+import zlib
+import struct
+import logging
+from array import array
+
+from camera_trap_classifier.data.inventory_store import ColumnarInventoryStore
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'CTCINVS\x00'
+SNAPSHOT_VERSION = 1
+
+_PREFIX = struct.Struct('<8sIQI')
+_ALIGNMENT = 8
+_RECORD_ID_SEPARATOR = '\x00'
+
+
+class InvalidSnapshotError(Exception):
+    """ File is not a (valid) inventory snapshot """
+    pass
+
+
+def is_inventory_snapshot(path):
+    """ Whether a file is an inventory snapshot (checks the magic bytes) """
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+    except OSError:
+        return False
+
+
+def _to_little_endian(column):
+    if isinstance(column, array) and sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column
+
+
+def save_snapshot(path, store, labels_numeric_map=None,
+                  split_assignments=None):
+    """ Save a ColumnarInventoryStore, the numeric label mapping and
+        split assignments {record id: split name} to a snapshot file
+    """
+    record_ids, tables, arrays = store.get_columns()
+
+    if any(_RECORD_ID_SEPARATOR in str(x) for x in record_ids):
+        raise ValueError("record ids must not contain null characters")
+    arrays['record_ids'] = _RECORD_ID_SEPARATOR.join(
+        str(x) for x in record_ids).encode('utf-8', 'surrogatepass')
+
+    split_names = list()
+    if split_assignments is not None:
+        split_names = sorted(set(split_assignments.values()))
+        split_codes = {x: i for i, x in enumerate(split_names)}
+        arrays['splits'] = array('i', [
+            split_codes[split_assignments[x]] if x in split_assignments
+            else -1 for x in record_ids])
+
+    columns = list()
+    offset = 0
+    for name, column in arrays.items():
+        if isinstance(column, array):
+            typecode, itemsize = column.typecode, column.itemsize
+        else:
+            typecode, itemsize = 'bytes', 1
+        n_bytes = len(column) * itemsize
+        columns.append({'name': name, 'typecode': typecode,
+                        'itemsize': itemsize, 'offset': offset,
+                        'n_bytes': n_bytes})
+        offset += n_bytes + (-n_bytes % _ALIGNMENT)
+
+    header = json.dumps({
+        'n_records': len(record_ids),
+        'tables': tables,
+        'labels_numeric_map': labels_numeric_map,
+        'split_names': split_names,
+        'columns': columns}).encode('utf-8')
+    header += b' ' * (-(_PREFIX.size + len(header)) % _ALIGNMENT)
+
+    checksum = zlib.crc32(header)
+    for name, column in arrays.items():
+        column = memoryview(_to_little_endian(column)).cast('B')
+        checksum = zlib.crc32(column, checksum)
+        checksum = zlib.crc32(b'\x00' * (-len(column) % _ALIGNMENT),
+                              checksum)
+
+    with open(path, 'wb') as f:
+        f.write(_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header),
+                             checksum))
+        f.write(header)
+        for name, column in arrays.items():
+            column = memoryview(_to_little_endian(column)).cast('B')
+            f.write(column)
+            f.write(b'\x00' * (-len(column) % _ALIGNMENT))
+
+    logger.info("Saved snapshot with %s records to %s" %
+                (len(record_ids), path))
+
+
+def load_snapshot(path):
+    """ Load a snapshot file
+        Returns: ColumnarInventoryStore, numeric label mapping (or None),
+                 split assignments {record id: split name} (or None)
+    """
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            data = memoryview(mm)
+            try:
+                return _load_snapshot_from_buffer(data, path)
+            finally:
+                data.release()
+
+
+def _load_snapshot_from_buffer(data, path):
+    if len(data) < _PREFIX.size:
+        raise InvalidSnapshotError("%s is not an inventory snapshot" % path)
+    magic, version, header_size, checksum = _PREFIX.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise InvalidSnapshotError("%s is not an inventory snapshot" % path)
+    if version != SNAPSHOT_VERSION:
+        raise InvalidSnapshotError(
+            "Snapshot %s has version %s - supported version: %s" %
+            (path, version, SNAPSHOT_VERSION))
+    if zlib.crc32(data[_PREFIX.size:]) != checksum:
+        raise InvalidSnapshotError(
+            "Checksum of snapshot %s does not match - the file is corrupt" %
+            path)
+
+    header_end = _PREFIX.size + header_size
+    header = json.loads(bytes(data[_PREFIX.size:header_end]).decode('utf-8'))
+
+    arrays = dict()
+    for column in header['columns']:
+        start = header_end + column['offset']
+        column_bytes = data[start:start + column['n_bytes']]
+        if column['typecode'] == 'bytes':
+            arrays[column['name']] = bytearray(column_bytes)
+            continue
+        values = array(column['typecode'])
+        if values.itemsize != column['itemsize']:
+            raise InvalidSnapshotError(
+                "Snapshot %s was created on an incompatible platform" % path)
+        values.frombytes(column_bytes)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        arrays[column['name']] = values
+
+    record_ids = arrays.pop('record_ids').decode('utf-8', 'surrogatepass')
+    record_ids = record_ids.split(_RECORD_ID_SEPARATOR) \
+        if header['n_records'] > 0 else list()
+
+    split_codes = arrays.pop('splits', None)
+    if split_codes is not None:
+        split_names = header['split_names']
+        split_assignments = {
+            record_id: split_names[code]
+            for record_id, code in zip(record_ids, split_codes)
+            if code >= 0}
+    else:
+        split_assignments = None
+
+    tables = header['tables']
+    for name in ('record_keys', 'observation_keys', 'meta_keys'):
+        tables[name] = [tuple(x) for x in tables[name]]
+    tables['other_values'] = {
+        int(k): v for k, v in tables['other_values'].items()}
+
+    store = ColumnarInventoryStore.from_columns(record_ids, tables, arrays)
+
+    logger.info("Loaded snapshot with %s records from %s" %
+                (len(store), path))
+
+    return store, header['labels_numeric_map'], split_assignments
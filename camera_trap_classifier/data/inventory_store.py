@@ -0,0 +1,387 @@
+""" Columnar Storage of Dataset Inventory Records
+
+A dict of records (dicts with lists of dicts of strings) needs several
+hundred bytes of Python objects per record. ColumnarInventoryStore keeps
+the same records in flat arrays instead:
+
+- label values and meta-data values are interned in category tables per
+  label name / meta-data key and stored as integer codes
+- the observations (label entries) and the image paths of a record are
+  stored CSR-style as offsets into flat columns
+- image paths are stored utf-8 encoded in one bytes buffer
+
+The store behaves like a dict of records: records are converted to
+ordinary dicts when accessed and converted back when assigned. Changing
+a returned record therefore does not change the store - the modified
+record has to be assigned again.
+"""
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, MutableMapping
+
+
+class _CategoryTable(object):
+    """ Interns values and maps them to integer codes """
+    def __init__(self):
+        self.values = list()
+        self.codes = dict()
+
+    def encode(self, value):
+        """ Code of a value, adds the value if required """
+        code = self.codes.get(value, None)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+class ColumnarInventoryStore(MutableMapping):
+    """ Memory efficient dict-like store of dataset inventory records
+        {record_id: {'labels': [{label_name: label_value}],
+                     'images': [image paths],
+                     'meta_data': {key: value}}}
+
+        Removed records are only marked as removed, the columns are
+        compacted once more than 'compact_ratio' of the rows are removed.
+    """
+    compact_ratio = 0.5
+
+    _missing = -1
+
+    def __init__(self):
+        self._row_of_id = dict()
+        self._n_rows = 0
+        # record keys (e.g. ('labels', 'meta_data', 'images')) per row
+        self._record_keys = _CategoryTable()
+        self._record_keys_codes = array('i')
+        # image paths: row r has the paths
+        # _image_offsets[r] to _image_offsets[r + 1]
+        self._image_offsets = array('q', [0])
+        self._image_path_ends = array('q')
+        self._image_blob = bytearray()
+        # observations: row r has the observations
+        # _observation_offsets[r] to _observation_offsets[r + 1]
+        self._observation_offsets = array('q', [0])
+        self._observation_keys = _CategoryTable()
+        self._observation_keys_codes = array('i')
+        self._label_values = dict()
+        self._label_columns = dict()
+        # meta-data with string keys and hashable values, one column
+        # per key, other meta-data is stored as is
+        self._meta_keys = _CategoryTable()
+        self._meta_keys_codes = array('i')
+        self._meta_values = dict()
+        self._meta_columns = dict()
+        self._other_values = dict()
+
+    @classmethod
+    def from_records(cls, records):
+        """ Create a store from a dict of records, records are removed
+            from the dict while being added to limit the peak memory
+        """
+        store = cls()
+        for record_id in list(records.keys()):
+            store[record_id] = records.pop(record_id)
+        return store
+
+    def __len__(self):
+        return len(self._row_of_id)
+
+    def __iter__(self):
+        return iter(self._row_of_id)
+
+    def __contains__(self, record_id):
+        return record_id in self._row_of_id
+
+    def __getitem__(self, record_id):
+        row = self._row_of_id[record_id]
+        record = dict()
+        for key in self._record_keys.values[self._record_keys_codes[row]]:
+            if key == 'labels':
+                record[key] = self._get_labels(row)
+            elif key == 'images':
+                record[key] = self._get_images(row)
+            elif key == 'meta_data' and self._meta_keys_codes[row] >= 0:
+                record[key] = self._get_meta_data(row)
+            else:
+                record[key] = self._other_values[row][key]
+        return record
+
+    def __setitem__(self, record_id, record):
+        if record_id in self._row_of_id:
+            self._other_values.pop(self._row_of_id[record_id], None)
+        row = self._n_rows
+        other_values = dict()
+        self._add_labels(record.get('labels', list()))
+        self._add_images(record.get('images', list()))
+        self._add_meta_data(record.get('meta_data', None))
+        for key, value in record.items():
+            if key in ('labels', 'images'):
+                continue
+            if key == 'meta_data' and self._meta_keys_codes[row] >= 0:
+                continue
+            other_values[key] = value
+        if len(other_values) > 0:
+            self._other_values[row] = other_values
+        self._record_keys_codes.append(
+            self._record_keys.encode(tuple(record.keys())))
+        self._n_rows += 1
+        self._row_of_id[record_id] = row
+        self._maybe_compact()
+
+    def __delitem__(self, record_id):
+        row = self._row_of_id.pop(record_id)
+        self._other_values.pop(row, None)
+        self._maybe_compact()
+
+    def _add_labels(self, labels):
+        for observation in labels:
+            keys = tuple(observation.keys())
+            self._observation_keys_codes.append(
+                self._observation_keys.encode(keys))
+            n_observations = len(self._observation_keys_codes)
+            for label_name in keys:
+                if label_name not in self._label_columns:
+                    self._label_values[label_name] = _CategoryTable()
+                    self._label_columns[label_name] = array(
+                        'i', [self._missing]) * (n_observations - 1)
+            for label_name, column in self._label_columns.items():
+                if label_name in observation:
+                    column.append(self._label_values[label_name].encode(
+                        observation[label_name]))
+                else:
+                    column.append(self._missing)
+        self._observation_offsets.append(len(self._observation_keys_codes))
+
+    def _add_images(self, images):
+        for image_path in images:
+            self._image_blob += image_path.encode('utf-8', 'surrogatepass')
+            self._image_path_ends.append(len(self._image_blob))
+        self._image_offsets.append(len(self._image_path_ends))
+
+    def _is_columnar_meta_data(self, meta_data):
+        if not isinstance(meta_data, dict):
+            return False
+        for value in meta_data.values():
+            try:
+                hash(value)
+            except TypeError:
+                return False
+        return True
+
+    def _add_meta_data(self, meta_data):
+        if not self._is_columnar_meta_data(meta_data):
+            # stored with the other values
+            meta_data = dict()
+            self._meta_keys_codes.append(self._missing)
+        else:
+            self._meta_keys_codes.append(
+                self._meta_keys.encode(tuple(meta_data.keys())))
+        n_rows = len(self._meta_keys_codes)
+        for key in meta_data.keys():
+            if key not in self._meta_columns:
+                self._meta_values[key] = _CategoryTable()
+                self._meta_columns[key] = array(
+                    'i', [self._missing]) * (n_rows - 1)
+        for key, column in self._meta_columns.items():
+            if key in meta_data:
+                column.append(self._meta_values[key].encode(meta_data[key]))
+            else:
+                column.append(self._missing)
+
+    def _get_labels(self, row):
+        labels = list()
+        for i in range(self._observation_offsets[row],
+                       self._observation_offsets[row + 1]):
+            keys = self._observation_keys.values[
+                self._observation_keys_codes[i]]
+            labels.append({
+                k: self._label_values[k].values[self._label_columns[k][i]]
+                for k in keys})
+        return labels
+
+    def _get_images(self, row):
+        images = list()
+        for i in range(self._image_offsets[row], self._image_offsets[row + 1]):
+            start = self._image_path_ends[i - 1] if i > 0 else 0
+            images.append(
+                self._image_blob[start:self._image_path_ends[i]].decode(
+                    'utf-8', 'surrogatepass'))
+        return images
+
+    def get_images(self, record_id):
+        """ Image paths of a record (without decoding the other columns) """
+        return self._get_images(self._row_of_id[record_id])
+
+    def _get_meta_data(self, row):
+        keys = self._meta_keys.values[self._meta_keys_codes[row]]
+        return {k: self._meta_values[k].values[self._meta_columns[k][row]]
+                for k in keys}
+
+    def remap_label_values(self, label_name, value_map, record_ids=None):
+        """ Replace values of 'label_name' according to value_map
+            {old value: new value} by re-coding the affected labels
+            record_ids: ids of the records with any of the old values
+                        (e.g. from a label index), such that only these
+                        records are visited instead of all records
+            Returns: {old value: number of replaced labels}
+        """
+        if label_name not in self._label_columns:
+            return dict()
+        table = self._label_values[label_name]
+        code_map = dict()
+        for old_value, new_value in value_map.items():
+            code = table.codes.get(old_value, None)
+            if code is not None and old_value != new_value:
+                code_map[code] = table.encode(new_value)
+        if len(code_map) == 0:
+            return dict()
+        if record_ids is None:
+            rows = self._row_of_id.values()
+        else:
+            rows = [self._row_of_id[x] for x in record_ids]
+        column = self._label_columns[label_name]
+        counts = dict()
+        for row in rows:
+            for i in range(self._observation_offsets[row],
+                           self._observation_offsets[row + 1]):
+                new_code = code_map.get(column[i], None)
+                if new_code is not None:
+                    counts[column[i]] = counts.get(column[i], 0) + 1
+                    column[i] = new_code
+        return {table.values[k]: v for k, v in counts.items()}
+
+    def _maybe_compact(self):
+        """ Compact the columns if many records were removed """
+        n_removed = self._n_rows - len(self._row_of_id)
+        if n_removed > 1000 and n_removed > self.compact_ratio * self._n_rows:
+            self.compact()
+
+    def compact(self):
+        """ Rebuild the columns without removed (or replaced) records """
+        compacted = type(self)()
+        for record_id in self:
+            compacted[record_id] = self[record_id]
+        self.__dict__.update(compacted.__dict__)
+
+    def get_columns(self):
+        """ Category tables and columns of the store (e.g. to save them),
+            the rows are compacted first
+            Returns: record ids (in the order of the store), dict of
+                     tables (lists), dict of arrays / bytes
+        """
+        if self._n_rows > len(self._row_of_id):
+            self.compact()
+        tables = {
+            'record_keys': self._record_keys.values,
+            'observation_keys': self._observation_keys.values,
+            'meta_keys': self._meta_keys.values,
+            'label_values': {k: v.values
+                             for k, v in self._label_values.items()},
+            'meta_values': {k: v.values
+                            for k, v in self._meta_values.items()},
+            'other_values': self._other_values}
+        arrays = {
+            'rows': array('q', self._row_of_id.values()),
+            'record_keys_codes': self._record_keys_codes,
+            'image_offsets': self._image_offsets,
+            'image_path_ends': self._image_path_ends,
+            'image_blob': self._image_blob,
+            'observation_offsets': self._observation_offsets,
+            'observation_keys_codes': self._observation_keys_codes,
+            'meta_keys_codes': self._meta_keys_codes,
+            **{'label/' + k: v for k, v in self._label_columns.items()},
+            **{'meta/' + k: v for k, v in self._meta_columns.items()}}
+        return list(self._row_of_id.keys()), tables, arrays
+
+    @classmethod
+    def from_columns(cls, record_ids, tables, arrays):
+        """ Create a store from the output of get_columns """
+        store = cls()
+
+        def _table(values):
+            table = _CategoryTable()
+            table.values = values
+            table.codes = {v: i for i, v in enumerate(values)}
+            return table
+
+        store._record_keys = _table(tables['record_keys'])
+        store._observation_keys = _table(tables['observation_keys'])
+        store._meta_keys = _table(tables['meta_keys'])
+        store._label_values = {k: _table(v)
+                               for k, v in tables['label_values'].items()}
+        store._meta_values = {k: _table(v)
+                              for k, v in tables['meta_values'].items()}
+        store._other_values = tables['other_values']
+        store._row_of_id = dict(zip(record_ids, arrays['rows']))
+        store._n_rows = len(arrays['record_keys_codes'])
+        store._record_keys_codes = arrays['record_keys_codes']
+        store._image_offsets = arrays['image_offsets']
+        store._image_path_ends = arrays['image_path_ends']
+        store._image_blob = arrays['image_blob']
+        store._observation_offsets = arrays['observation_offsets']
+        store._observation_keys_codes = arrays['observation_keys_codes']
+        store._meta_keys_codes = arrays['meta_keys_codes']
+        store._label_columns = {k[len('label/'):]: v
+                                for k, v in arrays.items()
+                                if k.startswith('label/')}
+        store._meta_columns = {k[len('meta/'):]: v
+                               for k, v in arrays.items()
+                               if k.startswith('meta/')}
+        return store
+
+    def get_memory_bytes(self):
+        """ Approximate size of the columns in bytes """
+        arrays = [self._record_keys_codes, self._image_offsets,
+                  self._image_path_ends, self._observation_offsets,
+                  self._observation_keys_codes, self._meta_keys_codes,
+                  *self._label_columns.values(),
+                  *self._meta_columns.values()]
+        return len(self._image_blob) + \
+            sum(x.itemsize * len(x) for x in arrays)
+
+
+class InventoryView(Mapping):
+    """ Read-only view of the records 'record_ids' of an inventory
+        (a dict or a ColumnarInventoryStore), only the sorted record ids
+        are stored, records are taken from the inventory when accessed
+    """
+    def __init__(self, data_inventory, record_ids):
+        self._data_inventory = data_inventory
+        self._record_ids = sorted(record_ids)
+
+    def __len__(self):
+        return len(self._record_ids)
+
+    def __iter__(self):
+        return iter(self._record_ids)
+
+    def __contains__(self, record_id):
+        i = bisect_left(self._record_ids, record_id)
+        return i < len(self._record_ids) and self._record_ids[i] == record_id
+
+    def __getitem__(self, record_id):
+        if record_id not in self:
+            raise KeyError(record_id)
+        return self._data_inventory[record_id]
+
+    def get_images(self, record_id):
+        """ Image paths of a record """
+        if record_id not in self:
+            raise KeyError(record_id)
+        return get_record_images(self._data_inventory, record_id)
+
+
+def get_record_images(data_inventory, record_id):
+    """ Image paths of a record of an inventory (a dict, a
+        ColumnarInventoryStore or an InventoryView) without converting the
+        whole record if the inventory supports it
+    """
+    get_images = getattr(data_inventory, 'get_images', None)
+    if get_images is not None:
+        return get_images(record_id)
+    return data_inventory[record_id]['images']
@@ -0,0 +1,210 @@
+""" Stream a Dataset from a Source to TFRecord Files
+
+DatasetInventoryMaster holds all records of a source in memory to filter,
+split and export them. DatasetInventoryStream instead passes the records
+one by one from the importer (DatasetImporter.iter_records) through the
+label filters and the split assignment to one StreamingShardWriter per
+split, which writes a file as soon as enough records of its split have
+arrived. Thus only the records of the files being filled are held in
+memory.
+
+Only operations which depend on a single record are supported: the label
+filters, random splits (by the hash of the record id, identical to
+DatasetInventoryMaster) and splits by a meta-data field. The numeric label
+mapping assigns numbers to the sorted label values of all records, thus
+the source is read twice unless a label mapping is passed: once to collect
+the labels and once to write the records.
+"""
+import logging
+
+from camera_trap_classifier.data.inventory import DatasetInventory
+from camera_trap_classifier.data.importer import DatasetImporter
+from camera_trap_classifier.data.writer import StreamingShardWriter
+from camera_trap_classifier.data.utils import (
+    id_to_zero_one, _assign_zero_one_to_split)
+
+
+logger = logging.getLogger(__name__)
+
+
+class DatasetInventoryStream(DatasetInventory):
+    """ Streams the records of a source to TFRecord files without
+        creating an inventory of all records
+
+        labels_numeric_map: pre-defined numeric label mapping, labels not
+            in the mapping get new numeric values after the existing ones
+            (in the order they are encountered) and the source is read
+            only once
+
+        Record ids must be unique in the source, records are not
+        de-duplicated.
+    """
+    def __init__(self, labels_numeric_map=None):
+        self.data_inventory = None
+        self.labels = None
+        self.labels_numeric_map = labels_numeric_map
+        self.importer = None
+        self.record_filters = list()
+        self.split_fun = None
+        self._label_counts = dict()
+        # whether the labels of all records have been read
+        self._labels_complete = False
+
+    def create_from_source(self, type, params):
+        """ Define the source to stream the records from """
+        self.importer = DatasetImporter().create(type, params)
+
+    def _calc_label_stats(self):
+        """ Label stats of the records streamed so far (after filters)
+            Returns: {'species': {'Zebra': 3, 'Elephant': 6},
+                      'counts': {'1': 5, '2': 10}}
+        """
+        return {k: dict(v) for k, v in self._label_counts.items()}
+
+    def _count_labels(self, record):
+        for label in record['labels']:
+            for label_name, label_value in label.items():
+                label_counts = self._label_counts.setdefault(
+                    label_name, dict())
+                label_counts[label_value] = \
+                    label_counts.get(label_value, 0) + 1
+
+    def remove_multi_label_records(self):
+        """ Remove records with multiple labels / observations """
+        self.record_filters.append(lambda record: len(record['labels']) <= 1)
+
+    def remove_records_with_label(self, label_name_list, label_value_list):
+        """ Remove all records with labels in label_name and corresponding
+            label values
+            Example: label_name : [species, species]
+                     label_value: ['zebra', 'elephant']
+        """
+        assert all([isinstance(label_name_list, list),
+                    isinstance(label_value_list, list)]), \
+            "label_name_list and label_value_list must be lists"
+
+        to_remove = set(zip(label_name_list, label_value_list))
+        self.record_filters.append(
+            lambda record: not self._has_any_label(record, to_remove))
+
+    def keep_only_records_with_label(self, label_name_list, label_value_list):
+        """ Keep only records with (at least one) of the specified
+            label_name and corresponding label values
+        """
+        assert all([isinstance(label_name_list, list),
+                    isinstance(label_value_list, list)]), \
+            "label_name_list and label_value_list must be lists"
+
+        to_keep = set(zip(label_name_list, label_value_list))
+        self.record_filters.append(
+            lambda record: self._has_any_label(record, to_keep))
+
+    def _has_any_label(self, record, labels):
+        """ Whether a record has any of the (label_name, label_value) pairs
+            in 'labels'
+        """
+        return any(x in labels for label in record['labels']
+                   for x in label.items())
+
+    def split_by_random_splits(self, split_names, split_percent):
+        """ Split records randomly into different sets according to the
+            hash of the record id (see randomly_split_dataset)
+        """
+        assert isinstance(split_names, list), "split_names must be a list"
+        assert isinstance(split_percent, list), "split_percent must be a list"
+        assert sum(split_percent) == 1, "split_percent must sum to 1"
+        assert len(split_names) == len(split_percent), \
+            "Split names must be of same length as split_percent"
+
+        self.split_fun = lambda record_id, record: _assign_zero_one_to_split(
+            id_to_zero_one(record_id), split_percent, split_names)
+
+    def split_by_meta_data_column(self, meta_colum):
+        """ Split records into different sets based on meta_data_column """
+        self.split_fun = lambda record_id, record: \
+            record['meta_data'][meta_colum]
+
+    def iter_records(self):
+        """ Iterate over the records of the source which pass all filters
+            Yields: (record id, record, split name)
+        """
+        if self.importer is None:
+            raise ValueError("No source defined - call create_from_source")
+        if self.split_fun is None:
+            raise ValueError("No split defined - call split_by_random_splits \
+                              or split_by_meta_data_column")
+
+        for record_id, record in self.importer.iter_records():
+            if not all(f(record) for f in self.record_filters):
+                continue
+            split_name = self.split_fun(record_id, record)
+            if split_name is None:
+                continue
+            yield record_id, record, split_name
+
+    def read_labels(self):
+        """ Read the source to collect the labels and create the numeric
+            label mapping
+        """
+        logger.info("Reading all records to collect the labels")
+        self._label_counts = dict()
+        split_counts = dict()
+        for _, record, split_name in self.iter_records():
+            self._count_labels(record)
+            split_counts[split_name] = split_counts.get(split_name, 0) + 1
+        for split_name, n_records in sorted(split_counts.items()):
+            logger.info("Found %s records for split %s" %
+                        (n_records, split_name))
+        self._map_labels_to_numeric()
+        self._labels_complete = True
+
+    def _add_new_labels(self, record):
+        """ Add labels of a record missing in the numeric label mapping """
+        for label in record['labels']:
+            for label_name, label_value in label.items():
+                if label_value == type(self).missing_label_value:
+                    continue
+                mapping = self.labels_numeric_map.setdefault(
+                    label_name, dict())
+                if label_value not in mapping:
+                    mapping[label_value] = max(
+                        mapping.values(), default=-1) + 1
+                    logger.info("Adding label %s to the mapping of %s" %
+                                (label_value, label_name))
+
+    def export_to_tfrecord(self, tfr_writer, tfr_path,
+                           max_records_per_file=5000, **kwargs):
+        """ Stream the records to TFRecord files, one set of files
+            '<split name>_<i>-of-<n>.tfrecord' per split (see
+            StreamingShardWriter), kwargs are passed to
+            DatasetWriter.encode_to_tfr
+            Returns: {split name: number of records}
+        """
+        kwargs.pop('file_prefix', None)
+        if self.labels_numeric_map is None:
+            self.read_labels()
+        # labels are collected while writing if the source is read once
+        read_once = not self._labels_complete
+
+        shard_writers = dict()
+        try:
+            for record_id, record, split_name in self.iter_records():
+                if read_once:
+                    self._count_labels(record)
+                    self._add_new_labels(record)
+                if split_name not in shard_writers:
+                    logger.info("Starting to stream split %s" % split_name)
+                    shard_writers[split_name] = StreamingShardWriter(
+                        tfr_writer, tfr_path, split_name,
+                        max_records_per_file=max_records_per_file, **kwargs)
+                shard_writers[split_name].add(
+                    record_id,
+                    self._convert_record_to_tfr_format(record_id, record))
+            for shard_writer in shard_writers.values():
+                shard_writer.close()
+        except BaseException:
+            for shard_writer in shard_writers.values():
+                shard_writer.abort()
+            raise
+
+        return {k: v.n_records for k, v in shard_writers.items()}
@@ -0,0 +1,95 @@
+""" Inverted Index of the Labels of a Dataset Inventory
+
+Maps each (label name, label value) pair to the ids of the records with
+that label, such that filtering records by labels costs time proportional
+to the number of matching records instead of the size of the inventory.
+The number of labels per (label name, label value) pair is counted as
+well, such that label statistics do not require a scan of all records.
+"""
+from collections import Counter
+
+
+class LabelIndex(object):
+    """ Inverted index from (label_name, label_value) to record ids """
+    def __init__(self):
+        self._index = dict()
+        # number of labels (observations) per (label_name, label_value)
+        self._label_counts = dict()
+
+    @classmethod
+    def from_inventory(cls, data_inventory):
+        """ Index all records of a data inventory """
+        label_index = cls()
+        for record_id, record in data_inventory.items():
+            label_index.add_record(record_id, record)
+        return label_index
+
+    def _iter_labels(self, record):
+        for label in record['labels']:
+            for label_name, label_value in label.items():
+                yield label_name, label_value
+
+    def add_record(self, record_id, record):
+        """ Add the labels of a record """
+        for key in self._iter_labels(record):
+            record_ids = self._index.get(key, None)
+            if record_ids is None:
+                record_ids = set()
+                self._index[key] = record_ids
+            record_ids.add(record_id)
+            self._label_counts[key] = self._label_counts.get(key, 0) + 1
+
+    def remove_record(self, record_id, record):
+        """ Remove the labels of a record """
+        # a record may have the same label multiple times
+        for key, n_removed in Counter(self._iter_labels(record)).items():
+            record_ids = self._index.get(key, None)
+            if record_ids is not None:
+                record_ids.discard(record_id)
+                if len(record_ids) == 0:
+                    del self._index[key]
+            n_labels = self._label_counts.get(key, 0) - n_removed
+            if n_labels > 0:
+                self._label_counts[key] = n_labels
+            else:
+                self._label_counts.pop(key, None)
+
+    def remap_values(self, label_name, value_map):
+        """ Move the records of label values to other values according
+            to value_map {old value: new value} (applied simultaneously)
+        """
+        moved = [(value_map[old_value],
+                  self._index.pop((label_name, old_value), set()),
+                  self._label_counts.pop((label_name, old_value), 0))
+                 for old_value in value_map.keys()
+                 if old_value != value_map[old_value]]
+        for new_value, record_ids, n_labels in moved:
+            if len(record_ids) == 0:
+                continue
+            key = (label_name, new_value)
+            if key in self._index:
+                self._index[key].update(record_ids)
+            else:
+                self._index[key] = record_ids
+            self._label_counts[key] = \
+                self._label_counts.get(key, 0) + n_labels
+
+    def get_record_ids(self, label_name, label_value):
+        """ Ids of records with 'label_value' for 'label_name'
+            (do not modify the returned set)
+        """
+        return self._index.get((label_name, label_value), set())
+
+    def get_label_names(self):
+        """ All label names """
+        return {k[0] for k in self._index.keys()}
+
+    def get_label_counts(self):
+        """ Number of labels per label value of each label name
+            Returns: {'species': {'Zebra': 3, 'Elephant': 6}}
+        """
+        label_counts = dict()
+        for (label_name, label_value), n_labels in self._label_counts.items():
+            label_counts.setdefault(label_name, dict())[label_value] = \
+                n_labels
+        return label_counts
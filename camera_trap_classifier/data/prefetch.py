@@ -0,0 +1,87 @@
+""" Prefetch Images with I/O Threads
+
+Reads the images of upcoming records in a thread pool while the current
+records are being processed, such that (network) storage latency and the
+CPU-bound image processing overlap.
+"""
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+logger = logging.getLogger(__name__)
+
+
+class ImagePrefetcher(object):
+    """ Reads images ahead of their consumption in parallel threads
+
+        At most 'max_bytes' of fetched but not yet consumed data is
+        buffered. Results are returned in the order of the input.
+
+    Args:
+        fetch_fun (func): function to read an image given its path
+        n_threads (int): number of I/O threads
+        max_bytes (int): max size of buffered images
+        sizeof (func): size of the result of fetch_fun in bytes
+    """
+    # max number of records queued per thread (independent of the size)
+    max_records_per_thread = 8
+
+    def __init__(self, fetch_fun, n_threads=8, max_bytes=256 * 1024 ** 2,
+                 sizeof=len):
+        self.fetch_fun = fetch_fun
+        self.n_threads = n_threads
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._buffered_bytes = 0
+        self._lock = threading.Lock()
+
+    def _fetch(self, path):
+        """ Fetch an image and account for its size, exceptions are
+            returned to be handled by the consumer
+        """
+        try:
+            result = self.fetch_fun(path)
+        except Exception as e:
+            return e, 0
+        size = self.sizeof(result)
+        with self._lock:
+            self._buffered_bytes += size
+        return result, size
+
+    def imap(self, tasks):
+        """ Prefetch images of tasks (key, [image paths])
+            Returns: generator of (key, [image or exception])
+        """
+        tasks = iter(tasks)
+        pending = deque()
+        max_pending = self.n_threads * self.max_records_per_thread
+        pool = ThreadPoolExecutor(max_workers=self.n_threads)
+        try:
+            while True:
+                # submit reads as long as the buffer is not full
+                while len(pending) < max_pending and \
+                        self._buffered_bytes < self.max_bytes:
+                    try:
+                        key, paths = next(tasks)
+                    except StopIteration:
+                        break
+                    futures = [pool.submit(self._fetch, x) for x in paths]
+                    pending.append((key, futures))
+
+                if len(pending) == 0:
+                    break
+
+                key, futures = pending.popleft()
+                results = [x.result() for x in futures]
+                with self._lock:
+                    self._buffered_bytes -= sum(x[1] for x in results)
+                yield key, [x[0] for x in results]
+        finally:
+            for _, futures in pending:
+                for future in futures:
+                    future.cancel()
+            pool.shutdown(wait=True)
+            with self._lock:
+                self._buffered_bytes = 0
@@ -0,0 +1,173 @@
+""" Pre-Flight Validation of the Images of a Dataset Inventory
+
+Checks all images of an inventory before creating TFRecord files:
+each file is stat-ed and its header is parsed (without decoding the image)
+to get the format and the dimensions. Images which are missing, empty,
+truncated or have an unknown / corrupt header are quarantined.
+"""
+import os
+import struct
+import logging
+
+from camera_trap_classifier.data.utils import (
+    export_dict_to_json, get_inventory_image_paths, map_images_in_threads)
+
+
+logger = logging.getLogger(__name__)
+
+
+# JPEG Start-Of-Frame markers which contain the image dimensions
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                     0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# JPEG markers without a length field
+_JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5,
+                            0xD6, 0xD7, 0xD8}
+_JPEG_EOI = b'\xff\xd9'
+# bytes at the end of a jpeg file that are searched for the EOI marker
+_JPEG_TAIL_SIZE = 64
+
+
+class InvalidImageError(Exception):
+    """ Image can not be used """
+    pass
+
+
+def _read_jpeg_dimensions(f):
+    """ Parse jpeg segments until a Start-Of-Frame marker is found
+        Returns: (width, height)
+    """
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        # skip fill bytes between segments
+        while byte == b'\xff':
+            byte = f.read(1)
+        if len(byte) == 0:
+            raise InvalidImageError("truncated jpeg header")
+        marker = byte[0]
+        if marker in _JPEG_STANDALONE_MARKERS:
+            continue
+        if marker == 0xD9 or marker == 0xDA:
+            raise InvalidImageError("jpeg without frame header")
+        segment_length_bytes = f.read(2)
+        if len(segment_length_bytes) < 2:
+            raise InvalidImageError("truncated jpeg header")
+        segment_length = struct.unpack('>H', segment_length_bytes)[0]
+        if segment_length < 2:
+            raise InvalidImageError("corrupt jpeg segment")
+        if marker in _JPEG_SOF_MARKERS:
+            frame_header = f.read(5)
+            if len(frame_header) < 5:
+                raise InvalidImageError("truncated jpeg header")
+            height, width = struct.unpack('>HH', frame_header[1:5])
+            return width, height
+        f.seek(segment_length - 2, os.SEEK_CUR)
+
+
+def _check_jpeg_end(f, file_size):
+    """ Check that a jpeg contains the End-Of-Image marker at the end """
+    f.seek(max(0, file_size - _JPEG_TAIL_SIZE))
+    if _JPEG_EOI not in f.read():
+        raise InvalidImageError("truncated jpeg (no end of image marker)")
+
+
+def read_image_header(path_to_image):
+    """ Get format and dimensions of an image by parsing its header
+        Returns: {'format': 'jpeg', 'width': 800, 'height': 600}
+        Raises: InvalidImageError, OSError
+    """
+    file_size = os.path.getsize(path_to_image)
+    if file_size == 0:
+        raise InvalidImageError("empty file")
+    with open(path_to_image, 'rb') as f:
+        head = f.read(26)
+        if head.startswith(b'\xff\xd8'):
+            image_format = 'jpeg'
+            width, height = _read_jpeg_dimensions(f)
+            _check_jpeg_end(f, file_size)
+        elif head.startswith(b'\x89PNG\r\n\x1a\n'):
+            image_format = 'png'
+            if len(head) < 24 or head[12:16] != b'IHDR':
+                raise InvalidImageError("corrupt png header")
+            width, height = struct.unpack('>II', head[16:24])
+        elif head[:6] in (b'GIF87a', b'GIF89a'):
+            image_format = 'gif'
+            if len(head) < 10:
+                raise InvalidImageError("truncated gif header")
+            width, height = struct.unpack('<HH', head[6:10])
+        elif head.startswith(b'BM'):
+            image_format = 'bmp'
+            if len(head) < 26:
+                raise InvalidImageError("truncated bmp header")
+            width, height = struct.unpack('<ii', head[18:26])
+            height = abs(height)
+        else:
+            raise InvalidImageError("unknown image format")
+    if width <= 0 or height <= 0:
+        raise InvalidImageError("invalid image dimensions")
+    return {'format': image_format, 'width': width, 'height': height}
+
+
+def inspect_image(path_to_image):
+    """ Get file size, format and dimensions of an image
+        Returns: (image info, None) or (None, reason) if invalid
+    """
+    try:
+        image_info = read_image_header(path_to_image)
+        image_info['file_size'] = os.path.getsize(path_to_image)
+    except InvalidImageError as e:
+        return None, str(e)
+    except OSError as e:
+        return None, e.strerror or str(e)
+    return image_info, None
+
+
+class ImageValidator(object):
+    """ Validates all images of a dataset inventory in parallel threads
+
+    Args:
+        image_root_path (str): path to prepend to the image paths
+        n_threads (int): number of threads to check images (I/O bound)
+    """
+    def __init__(self, image_root_path=None, n_threads=32):
+        self.image_root_path = image_root_path
+        self.n_threads = n_threads
+        self.image_info = dict()
+        self.quarantine = dict()
+
+    def validate_inventory(self, dataset_inventory):
+        """ Validate all images of a dataset inventory """
+        self.validate_images(get_inventory_image_paths(dataset_inventory))
+
+    def validate_images(self, image_paths):
+        """ Validate a list of images """
+        logger.info("Validating %s images with %s threads" %
+                    (len(image_paths), self.n_threads))
+        results = map_images_in_threads(
+            inspect_image, image_paths, self.image_root_path,
+            self.n_threads, description='Validated')
+        for image_path, (image_info, reason) in results:
+            if image_info is None:
+                logger.debug("Quarantined image %s - %s" %
+                             (image_path, reason))
+                self.quarantine[image_path] = reason
+            else:
+                self.image_info[image_path] = image_info
+        logger.info("Validated %s images - %s quarantined" %
+                    (len(image_paths), len(self.quarantine)))
+
+    def log_quarantine_stats(self):
+        """ Log the number of quarantined images per reason """
+        reason_counts = dict()
+        for reason in self.quarantine.values():
+            reason_counts[reason] = reason_counts.get(reason, 0) + 1
+        for reason, count in sorted(reason_counts.items()):
+            logger.info("Quarantined images - %s: %s" % (reason, count))
+
+    def export_image_info(self, path):
+        """ Export format, dimensions and file size of valid images """
+        export_dict_to_json(self.image_info, path)
+
+    def export_quarantine(self, path):
+        """ Export invalid images and the reason """
+        export_dict_to_json(self.quarantine, path)
@@ -4,6 +4,8 @@
 import tensorflow as tf
 import logging
 
+from camera_trap_classifier.data.utils import detect_tfr_compression_type
+
 
 logger = logging.getLogger(__name__)
 
@@ -17,7 +19,9 @@ class DatasetReader(object):
                      label_to_numeric_mapping=None,
                      buffer_size=10192, num_parallel_calls=4,
                      drop_batch_remainder=True, **kwargs):
-        """ Create Iterator from TFRecord """
+        """ Create Iterator from TFRecord
+            The compression of each file is detected automatically
+        """
 
         assert type(output_labels) is list, "label_list must be of " + \
             " type list is of type %s" % type(output_labels)
@@ -28,8 +32,12 @@ class DatasetReader(object):
         class_to_index_mappings = self._create_lookup_table(
             output_labels, label_to_numeric_mapping)
 
+        compression_types = [detect_tfr_compression_type(x)
+                             for x in tfr_files]
+
         # Create a tf.Dataset
-        dataset = tf.data.Dataset.from_tensor_slices(tfr_files)
+        dataset = tf.data.Dataset.from_tensor_slices(
+            (tfr_files, compression_types))
 
         # Shuffle input files for training
         if is_train:
@@ -37,7 +45,8 @@ class DatasetReader(object):
 
         dataset = dataset.apply(
             tf.data.experimental.parallel_interleave(
-                lambda filename: tf.data.TFRecordDataset(filename),
+                lambda filename, compression_type: tf.data.TFRecordDataset(
+                    filename, compression_type=compression_type),
                 sloppy=is_train,
                 cycle_length=24))
 
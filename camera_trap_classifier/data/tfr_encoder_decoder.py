@@ -25,7 +25,25 @@ class TFRecordEncoderDecoder(object):
 
 
 class DefaultTFRecordEncoderDecoder(TFRecordEncoderDecoder):
-    """ Default TFREncoder / Decoder """
+    """ Default TFREncoder / Decoder
+
+    Args:
+        image_format (str): 'jpeg' for jpeg encoded images or 'raw' for
+            pre-resized uint8 pixels which are decoded without any
+            jpeg decompression
+        image_shape (tuple): (height, width, channels) of raw images,
+            only required to encode raw images
+    """
+    image_formats = ('jpeg', 'raw')
+    raw_shape_features = ('image_height', 'image_width', 'image_channels')
+
+    def __init__(self, image_format='jpeg', image_shape=None):
+        super(DefaultTFRecordEncoderDecoder, self).__init__()
+        if image_format not in self.image_formats:
+            raise ValueError("image_format %s not in %s" %
+                             (image_format, self.image_formats))
+        self.image_format = image_format
+        self.image_shape = image_shape
 
     def _convert_to_tfr_data_format(self, record):
         """ Convert a record to a tfr format """
@@ -54,15 +72,35 @@ class DefaultTFRecordEncoderDecoder(TFRecordEncoderDecoder):
             **label_num_features
         }
 
+        if self.image_format == 'raw':
+            self._check_raw_images(record['images'], id)
+            for name, size in zip(self.raw_shape_features, self.image_shape):
+                tfr_data[name] = wrap_int64(size)
+
         return tfr_data
 
+    def _check_raw_images(self, images, id):
+        """ Check that raw images have the size of image_shape """
+        if self.image_shape is None:
+            raise ValueError("image_shape is required to encode raw images")
+        n_bytes = 1
+        for size in self.image_shape:
+            n_bytes *= size
+        for image in images:
+            if len(image) != n_bytes:
+                raise ValueError(
+                    "Raw image of record %s has %s bytes, expected %s \
+                     (image_shape: %s)" %
+                    (id, len(image), n_bytes, self.image_shape))
+
     def encode_record(self, record_data):
         """ Encode Record to Serialized String """
 
         tfr_data_dict = self._convert_to_tfr_data_format(record_data)
 
         feature_attributes = set(['id', 'n_images', 'n_labels',
-                                  'meta_data', 'labelstext'])
+                                  'meta_data', 'labelstext',
+                                  *self.raw_shape_features])
 
         feature_list_attributes = tfr_data_dict.keys() - feature_attributes
 
@@ -112,6 +150,11 @@ class DefaultTFRecordEncoderDecoder(TFRecordEncoderDecoder):
                 'labelstext': tf.FixedLenFeature([], tf.string)
                 }
 
+        # shape of raw images
+        if self.image_format == 'raw':
+            for name in self.raw_shape_features:
+                context_features[name] = tf.FixedLenFeature([], tf.int64)
+
         # Extract labels (string and numeric)
         label_names = ['label/' + l for l in output_labels]
         label_features = {k: tf.FixedLenSequenceFeature([], tf.string)
@@ -146,6 +189,13 @@ class DefaultTFRecordEncoderDecoder(TFRecordEncoderDecoder):
                 context_features=context_features,
                 sequence_features=sequence_features)
 
+        if self.image_format == 'raw':
+            image_shape = tf.cast(
+                tf.stack([context.pop(x) for x in self.raw_shape_features]),
+                tf.int32)
+        else:
+            image_shape = None
+
         # determine label prefix for either numeric or string labels
         if numeric_labels:
             label_prefix = 'label_num/'
@@ -182,6 +232,8 @@ class DefaultTFRecordEncoderDecoder(TFRecordEncoderDecoder):
         # decode 1-D tensor of raw images
         image = decode_image_bytes_1D(
                     sequence['images'],
+                    image_format=self.image_format,
+                    image_shape=image_shape,
                     **image_pre_processing_args)
 
         # Pre-Process image
@@ -4,16 +4,22 @@ import os
 import json
 from shutil import copyfile
 import re
-from collections import Counter, OrderedDict
+from collections import OrderedDict
 from hashlib import md5
+from itertools import accumulate
+from bisect import bisect_left
+import math
 import random
 import time
 from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
 import tensorflow as tf
 import numpy as np
 
+from camera_trap_classifier.data.file_walker import DirectoryWalker
+
 
 logger = logging.getLogger(__name__)
 
@@ -71,34 +77,54 @@ def order_dict_by_values(d, reversed=True):
     return ordered
 
 
-def _balanced_sampling(id_to_label, random_seed=123):
-    """ Balanced sampling for label
+def _balanced_sampling(id_to_label, random_seed=123, max_per_class=None):
+    """ Balanced sampling for label, keeps a random sample of ids per
+        label of at most the number of ids of the least frequent label
         Args: id_to_label (dict), key: id, value: label
+              max_per_class: keep at most this number of ids per label
+                instead (int, or dict with label: max number for specific
+                labels, other labels are not sampled)
+        Returns: set of ids
     """
-
-    labels_all = [v for v in id_to_label.values()]
-    label_stats = order_dict_by_values(Counter(labels_all), reversed=False)
-    min_label = list(label_stats.keys())[0]
-    min_value = label_stats[min_label]
-
-    # assign each id to one unique class
-    class_assignment = {x: list() for x in label_stats.keys()}
-    remaining_record_ids = set()
-
-    # Randomly Shuffle Ids
     all_ids = list(id_to_label.keys())
+    n_ids = len(all_ids)
+    if n_ids == 0:
+        return set()
+
+    # code labels as integers
+    label_codes = dict()
+    codes = np.fromiter(
+        (label_codes.setdefault(x, len(label_codes))
+         for x in id_to_label.values()), dtype=np.int64, count=n_ids)
+    counts = np.bincount(codes)
+
+    if max_per_class is None:
+        max_counts = np.full_like(counts, counts.min())
+    elif isinstance(max_per_class, dict):
+        max_counts = counts.copy()
+        for label, max_count in max_per_class.items():
+            if label in label_codes:
+                max_counts[label_codes[label]] = min(
+                    max_count, counts[label_codes[label]])
+    else:
+        max_counts = np.minimum(counts, max_per_class)
+
+    # Randomly Shuffle Ids (same permutation as shuffling the ids)
+    shuffled = list(range(0, n_ids))
     random.seed(random_seed)
-    random.shuffle(all_ids)
+    random.shuffle(shuffled)
+    shuffled = np.array(shuffled, dtype=np.int64)
 
-    for record_id in all_ids:
-        label = id_to_label[record_id]
-        # Add record to class assignment if label occurrence
-        # is below min_value of least frequent class
-        if len(class_assignment[label]) < min_value:
-            class_assignment[label].append(record_id)
-            remaining_record_ids.add(record_id)
+    # keep the first max_count shuffled ids of each label: group the
+    # shuffled ids by label (stable) and rank them within their label
+    shuffled_codes = codes[shuffled]
+    by_label = np.argsort(shuffled_codes, kind='stable')
+    by_label_codes = shuffled_codes[by_label]
+    label_starts = np.cumsum(counts) - counts
+    rank = np.arange(n_ids) - label_starts[by_label_codes]
+    keep = shuffled[by_label[rank < max_counts[by_label_codes]]]
 
-    return remaining_record_ids
+    return {all_ids[i] for i in keep.tolist()}
 
 
 def _assign_zero_one_to_split(zero_one_value, split_percents, split_names):
@@ -112,14 +138,30 @@ def _assign_zero_one_to_split(zero_one_value, split_percents, split_names):
             return sn
 
 
+def _assign_zero_one_to_split_indices(zero_one_values, split_percents):
+    """ Assign values between 0 and 1 to the index of a split according
+        to a percentage distribution (identical to _assign_zero_one_to_split)
+    """
+    split_props_cum = [sum(split_percents[0:(i+1)]) for i in
+                       range(0, len(split_percents))]
+    # first split with zero_one_value <= cumulative proportion
+    return np.searchsorted(
+        np.array(split_props_cum, dtype=np.float64),
+        zero_one_values, side='left')
+
+
 def randomly_split_dataset(
         split_ids,
         split_names,
         split_percent,
         balanced_sampling_min=False,
-        balanced_sampling_id_to_label=None):
+        balanced_sampling_id_to_label=None,
+        n_processes=1,
+        balanced_sampling_max_per_class=None):
     """ Randomly split 'split_ids' into 'split_names' by preserving
         'split_percent' and optional balanced_sampling to min. label
+        (or to balanced_sampling_max_per_class, see _balanced_sampling),
+        the ids are hashed in 'n_processes' processes
         Returns dict: {'id1': 'test', 'id2': 'train'}
     """
 
@@ -140,33 +182,26 @@ def randomly_split_dataset(
     # assign each record id a split value between 0 and 1
     # derived from a hash function to ensure consistency
     # based on the capture_id
-    split_vals = {x: id_to_zero_one(x) for x in split_ids}
+    split_vals = ids_to_zero_one(split_ids, n_processes=n_processes)
 
     # assign each id into different splits based on split value
-    split_assignments = list()
-
-    split_props_cum = [sum(split_percent[0:(i+1)]) for i in
-                       range(0, len(split_percent))]
-
-    for record_id in split_ids:
-        split_val = split_vals[record_id]
-        for sn, sp in zip(split_names, split_props_cum):
-            if split_val <= sp:
-                split_assignments.append(sn)
-                break
+    split_indices = _assign_zero_one_to_split_indices(
+        split_vals, split_percent)
 
     # Balanced sampling to the minority class
     if balanced_sampling_min:
-        remaining_record_ids = _balanced_sampling(balanced_sampling_id_to_label)
+        remaining_record_ids = _balanced_sampling(
+            balanced_sampling_id_to_label,
+            max_per_class=balanced_sampling_max_per_class)
     else:
-        remaining_record_ids = split_ids
+        remaining_record_ids = None
 
     # create final dictionary with split assignment per record id
     final_split_assignments = dict()
 
-    for record_id, sp in zip(split_ids, split_assignments):
-        if record_id in remaining_record_ids:
-            final_split_assignments[record_id] = sp
+    for record_id, split_index in zip(split_ids, split_indices.tolist()):
+        if remaining_record_ids is None or record_id in remaining_record_ids:
+            final_split_assignments[record_id] = split_names[split_index]
 
     return final_split_assignments
 
@@ -180,6 +215,39 @@ def slice_generator(sequence_length, n_blocks):
             for b in range(1, n_blocks+1))
 
 
+def slice_generator_by_weights(weights, n_blocks):
+    """ Creates a generator to get start/end indexes for dividing a
+        sequence of weights into n blocks with approximately equal total
+        weight, each block contains at least one element (n_blocks is
+        reduced to the number of elements, an empty sequence gives one
+        empty block)
+    """
+    sequence_length = len(weights)
+    if n_blocks < 1:
+        return
+    n_blocks = max(min(n_blocks, sequence_length), 1)
+    cumulative_weights = list(accumulate(weights))
+    total_weight = cumulative_weights[-1] if sequence_length > 0 else 0
+    start = 0
+    for b in range(1, n_blocks):
+        end = bisect_left(cumulative_weights,
+                          b * total_weight / n_blocks) + 1
+        end = min(max(end, start + 1), sequence_length - (n_blocks - b))
+        yield (start, end)
+        start = end
+    yield (start, sequence_length)
+
+
+def limit_slice_length(slices, max_length):
+    """ Split slices (start, end) longer than max_length into slices of
+        (almost) equal length
+    """
+    for start, end in slices:
+        n_parts = max(math.ceil((end - start) / max_length), 1)
+        for part_start, part_end in slice_generator(end - start, n_parts):
+            yield start + part_start, start + part_end
+
+
 def estimate_remaining_time(start_time, n_total, n_current):
     """ Estimate remaining time """
     time_elapsed = time.time() - start_time
@@ -296,6 +364,46 @@ def clean_input_path(path):
         return path
 
 
+def get_full_image_path(image_path, image_root_path=None):
+    """ Prepend image_root_path to an image path - leading separators of
+        the image path are removed such that it is always relative to
+        image_root_path
+    """
+    if image_root_path is not None:
+        return os.path.join(image_root_path, image_path.lstrip(os.sep))
+    return image_path
+
+
+def get_inventory_image_paths(dataset_inventory):
+    """ Sorted unique image paths of all records of a dataset inventory """
+    image_paths = set()
+    for record_id in dataset_inventory.get_all_record_ids():
+        record = dataset_inventory.get_record_id_data(record_id)
+        image_paths.update(record['images'])
+    return sorted(image_paths)
+
+
+def map_images_in_threads(fun, image_paths, image_root_path=None,
+                          n_threads=32, description='Processed'):
+    """ Apply fun to the full path of each image in parallel threads
+        (for I/O bound functions), progress is logged with 'description'
+        Yields: (image path, result) in the order of image_paths
+    """
+    n_images = len(image_paths)
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        full_paths = [get_full_image_path(x, image_root_path)
+                      for x in image_paths]
+        results = pool.map(fun, full_paths)
+        for i, (image_path, result) in enumerate(zip(image_paths, results)):
+            yield image_path, result
+            if (i % 10000) == 0 and i > 0:
+                est_t = estimate_remaining_time(start_time, n_images, i)
+                logger.info(
+                    "%s %s / %s images (estimated time remaining: %s)" %
+                    (description, i, n_images, est_t))
+
+
 def rename_files_cats_dogs(path):
     files = os.listdir(path)
     for file in files:
@@ -304,12 +412,33 @@ def rename_files_cats_dogs(path):
         os.rename(os.path.join(path, file), os.path.join(path,  new_file_name))
 
 
+def _count_records_from_manifests(tfr_paths):
+    """ Count records using the manifests of TFR files
+        Returns: number of records in files with a valid manifest,
+                 list of files without a valid manifest
+    """
+    total = 0
+    paths_without_manifest = list()
+    for path in tfr_paths:
+        manifest = read_tfr_manifest(path)
+        if manifest is None:
+            paths_without_manifest.append(path)
+        else:
+            total += manifest['n_records']
+    return total, paths_without_manifest
+
+
 def n_records_in_tfr(tfr_path):
+    """ Count the number of records in tfr files (using the manifests
+        of the files if available)
+    """
     if not isinstance(tfr_path, list):
         tfr_path = [tfr_path]
-    total = 0
+    total, tfr_path = _count_records_from_manifests(tfr_path)
     for path in tfr_path:
-        total += sum(1 for _ in tf.python_io.tf_record_iterator(path))
+        options = get_tfr_options(detect_tfr_compression_type(path))
+        total += sum(1 for _ in tf.python_io.tf_record_iterator(
+            path, options=options))
     return total
 
 
@@ -317,6 +446,7 @@ def n_records_in_tfr_dataset(tfr_path,
                              n_parallel_file_reads=50,
                              batch_size=5000):
     """ Read the number of records in all tfr files using the Dataset API
+        (files with a valid manifest are not read)
         Input:
             tfr_path: list of tfr paths
             n_parallel_file_reads: int - number of files to read in parallel
@@ -327,6 +457,12 @@ def n_records_in_tfr_dataset(tfr_path,
     if not isinstance(tfr_path, list):
         tfr_path = [tfr_path]
 
+    n_records_manifests, tfr_path = _count_records_from_manifests(tfr_path)
+    if len(tfr_path) == 0:
+        logger.debug("Counted {} records from manifests".format(
+            n_records_manifests))
+        return n_records_manifests
+
     # Use max one process per file
     n_tfr_files = len(tfr_path)
     num_parallel_reads = min(n_parallel_file_reads, n_tfr_files)
@@ -334,11 +470,15 @@ def n_records_in_tfr_dataset(tfr_path,
     logger.debug("Reading total {} files in {} parallel threads".format(
         n_tfr_files, num_parallel_reads))
 
+    compression_types = [detect_tfr_compression_type(x) for x in tfr_path]
+
     # read files in parallel
-    dataset = tf.data.Dataset.from_tensor_slices(tfr_path)
+    dataset = tf.data.Dataset.from_tensor_slices(
+        (tfr_path, compression_types))
     dataset = dataset.apply(
         tf.data.experimental.parallel_interleave(
-            lambda filename: tf.data.TFRecordDataset(filename),
+            lambda filename, compression_type: tf.data.TFRecordDataset(
+                filename, compression_type=compression_type),
             cycle_length=num_parallel_reads))
     dataset = dataset.apply(tf.data.experimental.enumerate_dataset(start=0))
     dataset = dataset.apply(
@@ -365,26 +505,33 @@ def n_records_in_tfr_dataset(tfr_path,
                     counter[-1]))
                 logger.debug("Current speed: {:2.2f} s/batch".format(
                     t_now-t_start_batch))
-    logger.debug("Finished -- Counted {} records".format(counter[-1]))
-    return counter[-1]
+    # counter holds the (zero-based) index of the last record
+    n_records = counter[-1] + 1
+    logger.debug("Finished -- Counted {} records".format(n_records))
+    return n_records + n_records_manifests
 
 
 def n_records_in_tfr_parallel(tfr_path, n_processes=4):
-    """ Read the number of records in all tfr files in parallel """
+    """ Read the number of records in all tfr files in parallel
+        (files with a valid manifest are not read)
+    """
     if not isinstance(tfr_path, list):
         tfr_path = [tfr_path]
+    n_records_manifests, tfr_path = _count_records_from_manifests(tfr_path)
     if len(tfr_path) > 0:
         pool = Pool(processes=n_processes)
         counts = list(pool.imap_unordered(n_records_in_tfr, tfr_path))
         pool.close()
         pool.join()
-        return sum(counts)
+        return sum(counts) + n_records_manifests
     else:
-        return n_records_in_tfr(tfr_path)
+        return n_records_manifests
 
 
 def check_tfrecord_contents(path_to_tfr):
-    record_iterator = tf.python_io.tf_record_iterator(path_to_tfr)
+    options = get_tfr_options(detect_tfr_compression_type(path_to_tfr))
+    record_iterator = tf.python_io.tf_record_iterator(
+        path_to_tfr, options=options)
     for record in record_iterator:
         example = tf.train.Example()
         example.ParseFromString(record)
@@ -392,6 +539,135 @@ def check_tfrecord_contents(path_to_tfr):
     print(record)
 
 
+def get_tfr_manifest_path(tfr_path):
+    """ Path of the manifest of a TFR file """
+    return tfr_path + '.manifest.json'
+
+
+def read_tfr_manifest(tfr_path):
+    """ Read the manifest of a TFR file, returns None if the manifest
+        does not exist or does not match the TFR file
+    """
+    manifest_path = get_tfr_manifest_path(tfr_path)
+    if not (os.path.exists(manifest_path) and os.path.exists(tfr_path)):
+        return None
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except ValueError:
+        logger.warning("Failed to read manifest %s" % manifest_path)
+        return None
+    if manifest.get('file_size', None) != os.path.getsize(tfr_path):
+        logger.warning("Manifest %s does not match %s" %
+                       (manifest_path, tfr_path))
+        return None
+    return manifest
+
+
+def read_label_histogram_from_manifests(tfr_paths):
+    """ Sum the label histograms stored in the manifests of TFR files
+        Returns: {'species': {'0': 10, '1': 5}} or None if any file has no
+                 valid manifest with a label histogram
+    """
+    label_histogram = dict()
+    for path in tfr_paths:
+        manifest = read_tfr_manifest(path)
+        if manifest is None or 'label_histogram' not in manifest:
+            return None
+        for label_name, label_counts in manifest['label_histogram'].items():
+            total_counts = label_histogram.setdefault(label_name, dict())
+            for label_value, count in label_counts.items():
+                total_counts[label_value] = \
+                    total_counts.get(label_value, 0) + count
+    return label_histogram
+
+
+def detect_tfr_image_format(tfr_paths):
+    """ Format of the images stored in TFR files according to their
+        manifests ('jpeg' for files without manifest)
+    """
+    image_formats = set()
+    for path in tfr_paths:
+        manifest = read_tfr_manifest(path)
+        if manifest is None:
+            image_formats.add('jpeg')
+        else:
+            image_formats.add(manifest.get('image_format', 'jpeg'))
+    if len(image_formats) > 1:
+        raise ValueError("TFR files with different image formats: %s" %
+                         sorted(image_formats))
+    if len(image_formats) == 0:
+        return 'jpeg'
+    return image_formats.pop()
+
+
+def _make_crc32c_table():
+    """ Lookup table of the CRC-32C (Castagnoli) checksum """
+    table = list()
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _make_crc32c_table()
+
+
+def _masked_crc32c(data):
+    """ Masked CRC-32C checksum as used in the TFRecord framing """
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = _CRC32C_TABLE[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    crc ^= 0xFFFFFFFF
+    return (((crc >> 15) | (crc << 17)) + 0xa282ead8) & 0xFFFFFFFF
+
+
+def _is_uncompressed_tfr_header(header):
+    """ Check whether bytes start with the framing of a TFRecord:
+        uint64 length, uint32 masked crc32c of the length
+    """
+    if len(header) < 12:
+        return False
+    length_crc = int.from_bytes(header[8:12], 'little')
+    return _masked_crc32c(header[0:8]) == length_crc
+
+
+def detect_tfr_compression_type(tfr_path):
+    """ Detect the compression type of a TFR file ('', 'GZIP' or 'ZLIB')
+        from its manifest or else from its first bytes
+    """
+    manifest = read_tfr_manifest(tfr_path)
+    if manifest is not None and 'compression_type' in manifest:
+        return manifest['compression_type']
+    with open(tfr_path, 'rb') as f:
+        header = f.read(12)
+    if len(header) == 0 or _is_uncompressed_tfr_header(header):
+        return ''
+    if header[0:2] == b'\x1f\x8b':
+        return 'GZIP'
+    if len(header) >= 2 and (header[0] & 0x0F) == 8 and \
+            int.from_bytes(header[0:2], 'big') % 31 == 0:
+        return 'ZLIB'
+    logger.warning("Unknown compression of %s - assuming uncompressed" %
+                   tfr_path)
+    return ''
+
+
+def get_tfr_options(compression_type):
+    """ TFRecordOptions for a compression type ('', 'GZIP' or 'ZLIB') """
+    if compression_type in (None, ''):
+        return None
+    compression_types = {
+        'GZIP': tf.python_io.TFRecordCompressionType.GZIP,
+        'ZLIB': tf.python_io.TFRecordCompressionType.ZLIB}
+    if compression_type not in compression_types:
+        raise ValueError("Compression type %s is not supported" %
+                         compression_type)
+    return tf.python_io.TFRecordOptions(compression_types[compression_type])
+
+
 def find_tfr_files(path, prefix=''):
     """ Find all TFR files """
     files = os.listdir(path)
@@ -483,6 +759,34 @@ def id_to_zero_one(value):
     return num
 
 
+def _hash_ids_to_int(ids):
+    """ The first 6 hex characters of the md5 hashes of ids as integers
+        (identical to assign_hash_to_zero_one(hash_string(id)) * 0xFFFFFF)
+    """
+    return np.fromiter(
+        (int.from_bytes(md5(str(x).encode('ascii')).digest()[:3], 'big')
+         for x in ids), dtype=np.int64, count=len(ids))
+
+
+def ids_to_zero_one(ids, n_processes=1, chunk_size=100000):
+    """ Deterministically assign strings to values 0-1, identical to
+        id_to_zero_one but hashed in chunks in 'n_processes' processes
+        Returns: numpy array of values
+    """
+    ids = list(ids)
+    if n_processes > 1 and len(ids) > chunk_size:
+        chunks = [ids[i:i + chunk_size]
+                  for i in range(0, len(ids), chunk_size)]
+        pool = Pool(processes=n_processes)
+        hashed = pool.map(_hash_ids_to_int, chunks)
+        pool.close()
+        pool.join()
+        hashed = np.concatenate(hashed)
+    else:
+        hashed = _hash_ids_to_int(ids)
+    return hashed / 0xFFFFFF
+
+
 def calc_n_batches_per_epoch(n_total, batch_size, drop_remainder=True):
     """ Calculate n batches per epoch """
     n_batches_per_epoch = n_total // batch_size
@@ -534,15 +838,18 @@ def get_file_name_from_path(file_path):
     return file_path.split(os.path.sep)[-1]
 
 
-def list_pictures(directory, ext=('jpg', 'jpeg', 'bmp', 'png', 'ppm')):
+def list_pictures(directory, ext=('jpg', 'jpeg', 'bmp', 'png', 'ppm'),
+                  n_threads=8, cache_path=None):
     """Lists all pictures in a directory, including all subdirectories.
     # Arguments
         directory: string, absolute path to the directory
         ext: tuple of strings or single string, extensions of the pictures
+        n_threads: number of threads listing directories
+        cache_path: json file to cache the directory listings, only
+            changed directories are listed again (see DirectoryWalker)
     # Returns
-        a list of paths
+        a list of paths (sorted by directory and file name)
     """
     ext = tuple('.%s' % e for e in ((ext,) if isinstance(ext, str) else ext))
-    return [os.path.join(root, f)
-            for root, _, files in os.walk(directory) for f in files
-            if f.lower().endswith(ext)]
+    walker = DirectoryWalker(n_threads=n_threads, cache_path=cache_path)
+    return list(walker.iter_files(directory, ext=ext))
@@ -1,18 +1,36 @@
 """ Write Data Inventory to Disk as TFRecord files """
 import random
 import os
+import re
+import json
 import math
 import time
 import logging
 import textwrap
-from multiprocessing import Process, Manager
+import queue
+import shutil
+import tempfile
+from collections import Counter, OrderedDict
+from collections.abc import Mapping
+from hashlib import md5
+from multiprocessing import Process, Queue
+from multiprocessing.connection import wait
+from concurrent.futures import ThreadPoolExecutor
 
 import tensorflow as tf
 
-from camera_trap_classifier.data.image import (
-    read_image_from_disk_and_convert_to_jpeg)
+from camera_trap_classifier.data.image_codec import (
+    ImageCodec, read_image_size, smallest_size_at_least)
+from camera_trap_classifier.data.prefetch import ImagePrefetcher
+from camera_trap_classifier.data.writer_stats import WriterStats
+from camera_trap_classifier.data.distributed import (
+    check_worker_index, is_shard_owner, get_worker_suffix,
+    export_worker_manifest)
 from camera_trap_classifier.data.utils import (
-    slice_generator, estimate_remaining_time)
+    slice_generator, slice_generator_by_weights, limit_slice_length,
+    estimate_remaining_time,
+    export_dict_to_json, read_json, get_tfr_options,
+    get_tfr_manifest_path, read_tfr_manifest, get_full_image_path)
 
 tf.enable_eager_execution()
 
@@ -20,9 +38,22 @@ logger = logging.getLogger(__name__)
 
 
 class DatasetWriter(object):
+    # threads used to check images when calculating record hashes
+    n_threads_hashing = 16
+    # images used to estimate the size of the processed images
+    n_images_size_estimation = 20
+    # number of slowest images reported in the stats
+    n_slowest_images = 10
+    # interval to log the time spent per stage
+    log_stats_every_seconds = 60
+    # max size of processed images used by multiple records kept in memory
+    max_bytes_shared_images = 256 * 1024 ** 2
+
     def __init__(self, tfr_encoder):
         self.tfr_encoder = tfr_encoder
         self.files = dict()
+        self._shard_records = dict()
+        self.record_hashes = dict()
 
     def encode_to_tfr(
          self, tfrecord_dict,
@@ -37,15 +68,75 @@ class DatasetWriter(object):
          write_tfr_in_parallel=False,
          process_images_in_parallel=False,
          process_images_in_parallel_size=100,
-         processes_images_in_parallel_n_processes=4):
-        """ Export TFRecord Dict to a TFRecord file """
+         processes_images_in_parallel_n_processes=4,
+         incremental=False,
+         image_cache=None,
+         image_codec=None,
+         max_bytes_per_file=None,
+         max_parallel_writers=None,
+         prefetch_n_threads=0,
+         prefetch_max_bytes=256 * 1024 ** 2,
+         compression_type='',
+         worker_index=0,
+         num_workers=1):
+        """ Export TFRecord Dict to a TFRecord file
+
+            incremental: only encode records which are not yet stored in
+                an existing (valid) shard of 'file_prefix' according to the
+                shard manifests and append them as new shards
+            image_cache: ImageCache to re-use processed images from previous
+                runs
+            image_pre_processing_fun: function with the signature of
+                the ImageCodec read methods, it receives the image read from
+                disk as 'file_bytes' and the WriterStats as 'stats' argument
+            image_codec: ImageCodec to read images, and to process them if
+                no image_pre_processing_fun is specified (default tensorflow)
+            max_bytes_per_file: target size of the files, estimated from
+                the dimensions of the images, files are balanced by size
+                (and have at most max_records_per_file records)
+            max_parallel_writers: max number of files written at the same
+                time if write_tfr_in_parallel (default: number of cpus)
+            prefetch_n_threads: number of threads to read images ahead of
+                their processing (0 to disable)
+            prefetch_max_bytes: max size of prefetched images held in memory
+            compression_type: compression of the TFRecord files
+                ('', 'GZIP' or 'ZLIB'), stored in the shard manifests
+            worker_index, num_workers: write only the shards owned by
+                worker 'worker_index' of 'num_workers' workers which
+                create the same dataset (see data.distributed), the owned
+                shards are listed in a worker manifest
+
+            The time spent per stage and the slowest images are logged and
+            exported to '<file_prefix>_writer_stats.json' in output_dir
+        """
 
         self.tfrecord_dict = tfrecord_dict
+        self.record_hashes = dict()
+        self._shard_records = dict()
         self.image_pre_processing_fun = image_pre_processing_fun
         self.image_pre_processing_args = image_pre_processing_args
         self.random_shuffle_before_save = random_shuffle_before_save
         self.file_prefix = file_prefix
         self.image_root_path = image_root_path
+        self.image_cache = image_cache
+        self.compression_type = compression_type
+        # fail early on invalid compression types
+        get_tfr_options(compression_type)
+        check_worker_index(worker_index, num_workers)
+        if incremental and num_workers > 1:
+            raise ValueError("incremental exports with multiple workers \
+                              are not supported")
+        self.worker_index = worker_index
+        self.num_workers = num_workers
+        if image_codec is None:
+            image_codec = ImageCodec.create('tensorflow')
+        self.image_codec = image_codec
+        if prefetch_n_threads > 0:
+            self.image_prefetcher = ImagePrefetcher(
+                self._fetch_image, n_threads=prefetch_n_threads,
+                max_bytes=prefetch_max_bytes, sizeof=lambda x: len(x[0]))
+        else:
+            self.image_prefetcher = None
         self.files[file_prefix] = list()
         self.write_tfr_in_parallel = write_tfr_in_parallel
         self.process_images_in_parallel = process_images_in_parallel
@@ -54,10 +145,13 @@ class DatasetWriter(object):
             processes_images_in_parallel_n_processes
 
         logger.info("Starting to Encode Data to TFRecords")
+        start_time = time.time()
+        self.stats = WriterStats(n_slowest=self.n_slowest_images)
+        self._last_stats_log = start_time
 
-        if not isinstance(tfrecord_dict, dict):
-            logger.error("tfrecord_dict must be a dictionary")
-            raise ValueError("tfrecord_dict must be a dictionary")
+        if not isinstance(tfrecord_dict, Mapping):
+            logger.error("tfrecord_dict must be a dictionary / mapping")
+            raise ValueError("tfrecord_dict must be a dictionary / mapping")
 
         # Sort records to ensure the records are split into files
         # equally each time
@@ -68,105 +162,688 @@ class DatasetWriter(object):
         logger.info("Start Writing Records to TFRecord-File - Total %s" %
                     n_records)
 
+        run_id = 0
+        if incremental:
+            # content hashes are stored in the shard manifests to identify
+            # records which have to be re-encoded in incremental runs
+            self.record_hashes = self._calc_record_hashes(record_ids)
+            valid_shards, record_ids, run_id = \
+                self._find_records_to_write_incrementally(
+                    output_dir, file_prefix, record_ids)
+            self.files[file_prefix] += valid_shards
+            n_records = len(record_ids)
+            logger.info("Incremental export - %s records to write" %
+                        n_records)
+            if n_records == 0:
+                return
+
         # Generate output file names
         if max_records_per_file is None:
             n_files = 1
         else:
             n_files = math.ceil(n_records / max_records_per_file)
 
+        if max_bytes_per_file is not None:
+            # all workers need the same shards - reading the dimensions of
+            # all images of the split would defeat the distribution
+            record_bytes = self._estimate_record_bytes(
+                record_ids, read_image_sizes=(num_workers == 1))
+            n_files_bytes = math.ceil(sum(record_bytes) / max_bytes_per_file)
+            if n_records > 0:
+                n_files = min(max(n_files, n_files_bytes), n_records)
+            slices = slice_generator_by_weights(record_bytes, n_files)
+            # files balanced by size must not exceed max_records_per_file
+            if max_records_per_file is not None:
+                slices = limit_slice_length(slices, max_records_per_file)
+            slices = list(slices)
+            n_files = len(slices)
+            logger.info("Estimated size of all records: %s MB - %s files" %
+                        (sum(record_bytes) // 1024 ** 2, n_files))
+        else:
+            slices = slice_generator(n_records, n_files)
+
         output_paths = list()
         for i in range(0, n_files):
-            file_name = '%s_%03d-of-%03d.tfrecord' % (file_prefix, i+1, n_files)
+            if run_id == 0:
+                file_name = '%s_%03d-of-%03d.tfrecord' % \
+                    (file_prefix, i+1, n_files)
+            else:
+                file_name = '%s_r%03d_%03d-of-%03d.tfrecord' % \
+                    (file_prefix, run_id, i+1, n_files)
             output_paths.append(os.path.join(*[output_dir, file_name]))
 
+        # other workers write the shards they own
+        slices = [(f_id, x) for f_id, x in enumerate(slices)
+                  if is_shard_owner(f_id, worker_index, num_workers)]
+        owned_record_ids = [record_id for _, (start_i, end_i) in slices
+                            for record_id in record_ids[start_i:end_i]]
+
+        # images used by multiple records are processed only once
+        self._find_shared_images(owned_record_ids)
+
         # processes list if parallel processing is enabled
         if self.write_tfr_in_parallel:
             processes_list = list()
+            stats_queue = Queue()
+            if max_parallel_writers is None:
+                max_parallel_writers = os.cpu_count() or 1
 
-        slices = slice_generator(n_records, n_files)
+        # one long-lived pool of image processing workers for all files
+        self.serializer_pool = None
+        if self.process_images_in_parallel and not self.write_tfr_in_parallel:
+            self.serializer_pool = SerializerPool(
+                self,
+                n_processes=self.processes_images_in_parallel_n_processes,
+                max_in_flight=self.process_images_in_parallel_size)
 
-        # Write each file
-        for f_id, (start_i, end_i) in enumerate(slices):
-            output_file = output_paths[f_id]
-            # generate record slices for each file
-            file_record_ids = record_ids[start_i:end_i]
+        owned_paths = list()
+        n_records_owned = 0
 
-            # check if file already exists
-            file_exists = os.path.exists(output_file)
+        try:
+            # Write each file
+            for f_id, (start_i, end_i) in slices:
+                output_file = output_paths[f_id]
+                owned_paths.append(output_file)
+                # generate record slices for each file
+                file_record_ids = record_ids[start_i:end_i]
+                n_records_owned += len(file_record_ids)
 
-            if file_exists and not overwrite_existing_files:
-                logger.info("File: %s exists - not gonna overwrite" %
-                            output_file)
-                self.files[file_prefix].append(output_file)
-            else:
-                if self.write_tfr_in_parallel:
-                    pr = Process(target=self._write_to_file,
-                                 args=(output_file, file_record_ids))
-                    pr.start()
-                    processes_list.append(pr)
+                # check if file already exists
+                file_exists = os.path.exists(output_file)
+
+                if file_exists and not overwrite_existing_files \
+                        and not incremental:
+                    logger.info("File: %s exists - not gonna overwrite" %
+                                output_file)
+                    self.files[file_prefix].append(output_file)
                 else:
-                    if self.process_images_in_parallel:
-                        self._write_to_file_parallel(output_file,
-                                                     file_record_ids)
+                    if self.write_tfr_in_parallel:
+                        processes_list = self._wait_for_processes(
+                            processes_list, max_parallel_writers - 1,
+                            stats_queue)
+                        pr = Process(target=self._write_to_file,
+                                     args=(output_file, file_record_ids,
+                                           stats_queue))
+                        pr.start()
+                        processes_list.append(pr)
                     else:
-                        self._write_to_file(output_file, file_record_ids)
-            self.files[self.file_prefix].append(output_file)
+                        if self.process_images_in_parallel:
+                            self._write_to_file_parallel(output_file,
+                                                         file_record_ids)
+                        else:
+                            self._write_to_file(output_file, file_record_ids)
+                self.files[self.file_prefix].append(output_file)
+        finally:
+            if self.serializer_pool is not None:
+                self.serializer_pool.close()
+                self.serializer_pool = None
+
         # start all processes
         if self.write_tfr_in_parallel:
+            self._wait_for_processes(processes_list, 0, stats_queue)
             for p in processes_list:
                 p.join()
+            self._collect_stats(stats_queue)
+
+        self._export_stats(output_dir, file_prefix, n_records_owned,
+                           time.time() - start_time)
 
-    def _serialize_record_batch(self, record_batch, outlist):
-        """ Serialize a list of records """
-        for record_data in record_batch:
-            serialized_record = self._serialize_record(record_data)
-            if serialized_record is not None:
-                outlist.append(serialized_record)
+        if num_workers > 1:
+            export_worker_manifest(
+                output_dir, file_prefix, worker_index, num_workers,
+                record_ids, output_paths, owned_paths)
 
-    def _read_image_from_disk(self, image_path_full):
-        """ Read Image from Disk """
+    def _get_full_image_path(self, image_path):
+        """ Prepend image_root_path to an image path """
+        return get_full_image_path(image_path, self.image_root_path)
+
+    def _get_image_processing_settings(self):
+        """ Name and arguments of the image pre-processing function """
         if self.image_pre_processing_fun is not None:
-            self.image_pre_processing_args['path_to_image'] = \
-                image_path_full
-            image_raw = self.image_pre_processing_fun(
-                 **self.image_pre_processing_args)
+            fun_name = self.image_pre_processing_fun.__qualname__
+        else:
+            fun_name = ''
+        args = {k: v for k, v in
+                (self.image_pre_processing_args or dict()).items()
+                if k != 'path_to_image'}
+        return [fun_name, args]
+
+    def _get_image_format(self):
+        """ Format of the stored images as defined by the encoder
+            (tfr_encoder is usually a bound method of the encoder)
+        """
+        encoder = getattr(self.tfr_encoder, '__self__', self.tfr_encoder)
+        return getattr(encoder, 'image_format', 'jpeg')
+
+    def _calc_record_hash(self, record_data):
+        """ Hash the content of a record: labels, meta-data, image paths,
+            image pre-processing and the size / modification time of
+            each image
+        """
+        record_content = {k: v for k, v in record_data.items()
+                          if k != 'images'}
+        image_stats = list()
+        for image_path in record_data['image_paths']:
+            try:
+                stat = os.stat(self._get_full_image_path(image_path))
+                image_stats.append([stat.st_size, stat.st_mtime_ns])
+            except OSError:
+                image_stats.append(None)
+        to_hash = json.dumps(
+            [record_content, self._get_image_processing_settings(),
+             image_stats],
+            sort_keys=True, default=str)
+        return md5(to_hash.encode('utf-8')).hexdigest()
+
+    def _calc_record_hashes(self, record_ids):
+        """ Calculate content hashes of records
+            (in parallel threads since checking the images is I/O bound)
+        """
+        with ThreadPoolExecutor(max_workers=self.n_threads_hashing) as pool:
+            hashes = pool.map(
+                lambda x: self._calc_record_hash(self._get_record(x)),
+                record_ids)
+            return dict(zip(record_ids, hashes))
+
+    def _estimate_record_bytes(self, record_ids, read_image_sizes=True):
+        """ Estimate the stored size of each record from the number of
+            pixels of its images after resizing (the dimensions are read
+            from the image headers) and the bytes per pixel observed when
+            processing a sample of images - images with unknown dimensions
+            are estimated with the mean size of the processed sample images
+
+            read_image_sizes: if False only the sample images are read and
+                all images are estimated with the mean size
+        """
+        if len(record_ids) == 0:
+            return list()
+
+        image_paths = sorted({
+            x for record_id in record_ids
+            for x in self._get_image_paths(record_id)})
+        if read_image_sizes:
+            with ThreadPoolExecutor(
+                    max_workers=self.n_threads_hashing) as pool:
+                image_infos = dict(zip(image_paths, pool.map(
+                    self._inspect_image, image_paths)))
         else:
-            image_raw = \
-                read_image_from_disk_and_convert_to_jpeg(image_path_full)
+            image_infos = {x: (None, 0) for x in image_paths}
+
+        sample_rng = random.Random(123)
+        sample_ids = sample_rng.sample(
+            record_ids, min(self.n_images_size_estimation, len(record_ids)))
+
+        # process the sample in a separate process to keep tensorflow out of
+        # the main process which later forks the image processing workers
+        result_queue = Queue()
+        pr = Process(target=self._process_size_sample,
+                     args=(sample_ids, result_queue))
+        pr.start()
+        sample = self._get_size_sample(pr, result_queue)
+        pr.join()
+
+        if len(sample) > 0:
+            mean_image_bytes = sum(x[1] for x in sample) / len(sample)
+        else:
+            logger.warning("Failed to process the sample images - sizes \
+                            of images with unknown dimensions can not be \
+                            estimated")
+            mean_image_bytes = None
+        sample = [(image_infos.get(x[0], (None, 0))[0], x[1])
+                  for x in sample]
+        sample_pixels = sum(self._get_processed_pixels(x[0])
+                            for x in sample if x[0] is not None)
+        sample_pixel_bytes = sum(x[1] for x in sample if x[0] is not None)
+        if sample_pixels > 0 and sample_pixel_bytes > 0:
+            bytes_per_pixel = sample_pixel_bytes / sample_pixels
+        else:
+            bytes_per_pixel = None
+        logger.debug("Estimated bytes per pixel of processed images: %s, \
+                      mean size of processed images: %s" %
+                     (bytes_per_pixel, mean_image_bytes))
+
+        def _estimate_image_bytes(image_path):
+            image_size, file_size = image_infos[image_path]
+            if image_size is not None and bytes_per_pixel is not None:
+                return self._get_processed_pixels(image_size) * \
+                    bytes_per_pixel
+            if mean_image_bytes is not None:
+                return mean_image_bytes
+            return max(file_size, 1)
+
+        return [sum(_estimate_image_bytes(x)
+                    for x in self._get_image_paths(record_id))
+                for record_id in record_ids]
+
+    def _inspect_image(self, image_path):
+        """ Dimensions (height, width) or None and file size of an image """
+        image_path_full = self._get_full_image_path(image_path)
+        try:
+            file_size = os.path.getsize(image_path_full)
+        except OSError:
+            return None, 0
+        return read_image_size(image_path_full), file_size
+
+    def _get_processed_pixels(self, image_size):
+        """ Number of pixels of an image of image_size (height, width) after
+            the image pre-processing
+        """
+        args = self.image_pre_processing_args or dict()
+        height, width = image_size
+        if 'output_height' in args and 'output_width' in args:
+            return args['output_height'] * args['output_width']
+        if 'smallest_side' in args:
+            height, width = smallest_size_at_least(
+                height, width, args['smallest_side'])
+        return height * width
+
+    def _get_size_sample(self, pr, result_queue, poll_timeout=10):
+        """ Get the result of the size sample process - fail if it died """
+        while True:
+            try:
+                return result_queue.get(timeout=poll_timeout)
+            except queue.Empty:
+                if pr.is_alive():
+                    continue
+            # the result may have arrived just before the process exited
+            try:
+                return result_queue.get_nowait()
+            except queue.Empty:
+                raise RuntimeError(
+                    "Size estimation process died unexpectedly, \
+                     exitcode: %s" % pr.exitcode)
+
+    def _process_size_sample(self, record_ids, result_queue):
+        """ Process the first image of each record and return the image
+            path and the size of the processed image
+        """
+        # runs in a separate process before the shared images are known
+        self.shared_image_paths = set()
+        sample = list()
+        for record_id in record_ids:
+            image_path = self._get_image_paths(record_id)[0]
+            image_path_full = self._get_full_image_path(image_path)
+            try:
+                image_raw = self._read_image_from_disk(image_path_full)
+                sample.append((image_path, len(image_raw)))
+            except Exception as e:
+                logger.debug("Failed to read image: %s , error %s" %
+                             (image_path_full, str(e)))
+        result_queue.put(sample)
+
+    def _wait_for_processes(self, processes, max_running, stats_queue):
+        """ Wait until at most 'max_running' processes are running,
+            returns the running processes
+        """
+        running = [p for p in processes if p.is_alive()]
+        while len(running) > max_running:
+            wait([p.sentinel for p in running], timeout=1)
+            # drain the queue to not block finishing processes
+            self._collect_stats(stats_queue)
+            running = [p for p in running if p.is_alive()]
+        self._collect_stats(stats_queue)
+        return running
+
+    def _find_records_to_write_incrementally(
+            self, output_dir, file_prefix, record_ids):
+        """ Compare records with the manifests of existing shards and
+            determine which records have to be (re-)encoded
+
+            Shards containing records which were changed or which are not
+            in the current export anymore, as well as shards without a
+            valid manifest, are removed and their records are re-encoded.
+
+            Returns: list of valid shards, list of record ids to write
+                     and the id of the current run
+        """
+        shard_pattern = re.compile(
+            r'^%s_(?:r(\d+)_)?\d+-of-\d+\.tfrecord$' % re.escape(file_prefix))
+
+        valid_shards = list()
+        stored_ids = set()
+        run_id = 0
+
+        for file_name in sorted(os.listdir(output_dir)):
+            file_path = os.path.join(output_dir, file_name)
+            # remove leftovers of interrupted writes
+            if file_name.endswith('_temp') and \
+                    shard_pattern.match(file_name[:-len('_temp')]):
+                logger.info("Removing incomplete file %s" % file_path)
+                os.remove(file_path)
+                continue
+            match = shard_pattern.match(file_name)
+            if match is None:
+                continue
+            run_id = max(run_id, int(match.group(1) or 0))
+            manifest = read_tfr_manifest(file_path)
+            if manifest is None:
+                # the records of the shard are unknown, keeping it would
+                # duplicate the records which are written again
+                logger.warning(
+                    "Removing shard %s without valid manifest - its \
+                     records are re-encoded" % file_path)
+                os.remove(file_path)
+                manifest_path = get_tfr_manifest_path(file_path)
+                if os.path.exists(manifest_path):
+                    os.remove(manifest_path)
+                continue
+            shard_ids = [x['id'] for x in manifest['records']]
+            is_valid = all(
+                (self.record_hashes.get(r['id'], None) == r['hash']) and
+                (r['id'] not in stored_ids)
+                for r in manifest['records'])
+            if is_valid:
+                valid_shards.append(file_path)
+                stored_ids.update(shard_ids)
+            else:
+                logger.info("Removing outdated shard %s" % file_path)
+                os.remove(file_path)
+                os.remove(get_tfr_manifest_path(file_path))
+
+        logger.info("Found %s valid shards with %s records for %s" %
+                    (len(valid_shards), len(stored_ids), file_prefix))
+
+        to_write = [x for x in record_ids if x not in stored_ids]
+
+        return valid_shards, to_write, run_id + 1
+
+    def _write_manifest(self, output_file, output_temp, record_ids,
+                        record_sizes):
+        """ Write the manifest of a shard, containing the number of records,
+            a histogram of the numeric labels and for all records in the
+            order stored in the shard: id, content hash, numeric labels and
+            byte offset (in the uncompressed file)
+
+            The content hashes (see _calc_record_hash) of all records are
+            calculated before writing in incremental exports, to compare
+            them with the existing manifests, otherwise the records of each
+            shard are hashed when the shard is written
+        """
+        records = list()
+        label_histogram = dict()
+        offset = 0
+        for record_id, record_size in zip(record_ids, record_sizes):
+            record_data = self._get_record(record_id)
+            labels = {k[len('label_num/'):]: v
+                      for k, v in record_data.items()
+                      if k.startswith('label_num/')}
+            for label_name, label_values in labels.items():
+                label_counts = label_histogram.setdefault(label_name, dict())
+                for label_value in label_values:
+                    label_value = str(label_value)
+                    label_counts[label_value] = \
+                        label_counts.get(label_value, 0) + 1
+            records.append({'id': record_id,
+                            'hash': self.record_hashes[record_id],
+                            'labels': labels,
+                            'offset': offset})
+            # framing: length (8 bytes), crc of length (4), data, crc (4)
+            offset += record_size + 16
+        manifest = {
+            'file_name': os.path.basename(output_file),
+            'file_size': os.path.getsize(output_temp),
+            'n_records': len(record_ids),
+            'compression_type': self.compression_type,
+            'image_format': self._get_image_format(),
+            'label_histogram': label_histogram,
+            'records': records}
+        export_dict_to_json(manifest, get_tfr_manifest_path(output_file))
+
+    def _convert_shard_records(self, record_ids):
+        """ Get the records of the shard being written from tfrecord_dict,
+            which may convert records on each access (see
+            DatasetInventory.export_to_tfrecord), thus each record is
+            converted only once per shard - records not hashed before are
+            hashed for the manifest of the shard
+        """
+        self._shard_records = {x: self.tfrecord_dict[x] for x in record_ids}
+        self.record_hashes.update(self._calc_record_hashes(
+            [x for x in record_ids if x not in self.record_hashes]))
+
+    def _get_record(self, record_id):
+        """ Record of the shard being written or from tfrecord_dict """
+        record_data = self._shard_records.get(record_id, None)
+        if record_data is None:
+            record_data = self.tfrecord_dict[record_id]
+        return record_data
+
+    def _get_image_paths(self, record_id):
+        """ Image paths of a record - taken from tfrecord_dict without
+            converting the record if it provides get_image_paths
+        """
+        if record_id not in self._shard_records:
+            get_image_paths = getattr(
+                self.tfrecord_dict, 'get_image_paths', None)
+            if get_image_paths is not None:
+                return get_image_paths(record_id)
+        return self._get_record(record_id)['image_paths']
+
+    def _get_image_cache_key(self, image_path_full):
+        """ Key of an image in the image cache """
+        return self.image_cache.get_key(
+            image_path_full, self._get_image_processing_settings())
+
+    def _fetch_image(self, image_path_full):
+        """ Get a processed image from the image cache or read the raw
+            image from disk (used by the prefetch threads)
+            Returns: (image bytes, whether the image is processed,
+                      seconds to fetch the image)
+        """
+        start_time = time.perf_counter()
+        if self.image_cache is not None:
+            image_raw = self._get_image_from_cache(image_path_full)
+            if image_raw is not None:
+                return image_raw, True, time.perf_counter() - start_time
+        file_bytes = self.image_codec.read_image_from_disk(
+            image_path_full, stats=self.stats)
+        return file_bytes, False, time.perf_counter() - start_time
+
+    def _get_image_from_cache(self, image_path_full):
+        """ Get a processed image from the image cache (None if missing) """
+        with self.stats.time('cache_lookup') as measurement:
+            image_raw = self.image_cache.get(
+                self._get_image_cache_key(image_path_full))
+            if image_raw is not None:
+                measurement['bytes'] = len(image_raw)
         return image_raw
 
-    def _serialize_record(self, record_data):
+    def _read_image_from_disk(self, image_path_full, prefetched=None):
+        """ Read Image from Disk (or from the image cache) and process it
+            prefetched: result of _fetch_image (if prefetched)
+        """
+        if image_path_full in self.shared_image_paths:
+            image_raw = self._get_shared_image(image_path_full)
+            if image_raw is not None:
+                return image_raw
+        file_bytes = None
+        if prefetched is not None:
+            file_bytes, is_processed, _ = prefetched
+            if is_processed:
+                return file_bytes
+        elif self.image_cache is not None:
+            image_raw = self._get_image_from_cache(image_path_full)
+            if image_raw is not None:
+                return image_raw
+        if file_bytes is None:
+            file_bytes = self.image_codec.read_image_from_disk(
+                image_path_full, stats=self.stats)
+        # the codec times the decode, resize and encode stages
+        if self.image_pre_processing_fun is not None:
+            args = dict(self.image_pre_processing_args or dict(),
+                        path_to_image=image_path_full,
+                        file_bytes=file_bytes, stats=self.stats)
+            image_raw = self.image_pre_processing_fun(**args)
+        else:
+            image_raw = self.image_codec.read_and_convert_to_jpeg(
+                image_path_full, file_bytes=file_bytes, stats=self.stats)
+        if self.image_cache is not None:
+            self.image_cache.put(
+                self._get_image_cache_key(image_path_full), image_raw)
+        if image_path_full in self.shared_image_paths:
+            self._put_shared_image(image_path_full, image_raw)
+        return image_raw
+
+    def _find_shared_images(self, record_ids):
+        """ Find images used by more than one record (e.g. after
+            de-duplicating images with mode 'reference')
+        """
+        path_counts = Counter(
+            self._get_full_image_path(x) for record_id in record_ids
+            for x in self._get_image_paths(record_id))
+        self.shared_image_paths = {k for k, v in path_counts.items() if v > 1}
+        self._shared_images = OrderedDict()
+        self._shared_images_bytes = 0
+        if len(self.shared_image_paths) > 0:
+            logger.info("Found %s images used by multiple records" %
+                        len(self.shared_image_paths))
+
+    def _get_shared_image(self, image_path_full):
+        """ Get a processed image used by multiple records (None if not
+            processed yet or evicted)
+        """
+        image_raw = self._shared_images.get(image_path_full, None)
+        if image_raw is not None:
+            self._shared_images.move_to_end(image_path_full)
+            self.stats.add('shared_image_reuse', 0, n_bytes=len(image_raw))
+        return image_raw
+
+    def _put_shared_image(self, image_path_full, image_raw):
+        """ Keep a processed image used by multiple records in memory,
+            least recently used images are evicted if max_bytes_shared_images
+            is exceeded
+        """
+        self._shared_images[image_path_full] = image_raw
+        self._shared_images_bytes += len(image_raw)
+        while self._shared_images_bytes > self.max_bytes_shared_images:
+            _, evicted = self._shared_images.popitem(last=False)
+            self._shared_images_bytes -= len(evicted)
+
+    def _iter_records_prefetched(self, record_ids):
+        """ Iterate over (record_id, prefetched images), prefetched images
+            is None if prefetching is disabled
+        """
+        if self.image_prefetcher is None:
+            return ((record_id, None) for record_id in record_ids)
+        tasks = ((record_id,
+                  [self._get_full_image_path(x) for x in
+                   self._get_image_paths(record_id)])
+                 for record_id in record_ids)
+        return self.image_prefetcher.imap(tasks)
+
+    def _serialize_record(self, record_data, prefetched_images=None):
         """ Serialize a single record """
         # Process all images in a record
         raw_images = list()
-        for image_path in record_data['image_paths']:
+        for i, image_path in enumerate(record_data['image_paths']):
             # Create image path
-            if self.image_root_path is not None:
-                image_path_full = os.path.join(self.image_root_path,
-                                               image_path.lstrip(os.sep))
-            else:
-                image_path_full = image_path
+            image_path_full = self._get_full_image_path(image_path)
+            start_time = time.perf_counter()
             try:
-                image_raw = self._read_image_from_disk(image_path_full)
+                if prefetched_images is None:
+                    image_raw = self._read_image_from_disk(image_path_full)
+                    fetch_seconds = 0
+                else:
+                    # failed reads are returned as exceptions
+                    if isinstance(prefetched_images[i], Exception):
+                        raise prefetched_images[i]
+                    image_raw = self._read_image_from_disk(
+                        image_path_full, prefetched_images[i])
+                    fetch_seconds = prefetched_images[i][2]
             except Exception as e:
-                logger.debug("Failed to read image: %s , error %s" %
-                             (image_path_full, str(e)))
+                logger.warning("Failed to read image: %s , error %s" %
+                               (image_path_full, str(e)))
                 continue
 
+            seconds = time.perf_counter() - start_time + fetch_seconds
+            if self.stats.is_among_slowest(seconds):
+                self.stats.add_image(
+                    seconds, image_path_full,
+                    self._get_image_size(image_path_full))
+
             raw_images.append(image_raw)
 
         # check if at least one image is available
         if len(raw_images) == 0:
             return None
 
-        record_data['images'] = raw_images
+        record_data = dict(record_data, images=raw_images)
 
-        serialized_record = self.tfr_encoder(record_data)
+        with self.stats.time('serialize'):
+            serialized_record = self.tfr_encoder(record_data)
 
         return serialized_record
 
-    def _write_to_file(self, output_file, record_ids):
-        """ Write a TFR File """
+    def _get_image_size(self, image_path_full):
+        """ Size of an image on disk (None if not available) """
+        try:
+            return os.path.getsize(image_path_full)
+        except OSError:
+            return None
+
+    def _write_record(self, writer, serialized_record):
+        """ Write a serialized record to a TFRecord file """
+        with self.stats.time('write') as measurement:
+            writer.write(serialized_record)
+            measurement['bytes'] = len(serialized_record)
+
+    def _log_stats_periodically(self):
+        """ Log the time spent per stage every log_stats_every_seconds """
+        if (time.time() - self._last_stats_log) > \
+                self.log_stats_every_seconds:
+            logger.info("Time per stage - %s" % self.stats.get_summary())
+            self._last_stats_log = time.time()
+
+    def _collect_stats(self, stats_queue):
+        """ Merge the stats sent by the file writer processes """
+        while True:
+            try:
+                self.stats.merge(stats_queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _export_stats(self, output_dir, file_prefix, n_records, seconds):
+        """ Export the stats of all stages to a json file """
+        stats_dict = self.stats.to_dict()
+        stats_dict.update({
+            'n_records': n_records,
+            'n_records_written':
+                stats_dict['stages'].get('write', {}).get('count', 0),
+            'seconds': seconds,
+            'settings': {
+                'write_tfr_in_parallel': self.write_tfr_in_parallel,
+                'process_images_in_parallel':
+                    self.process_images_in_parallel,
+                'processes_images_in_parallel_n_processes':
+                    self.processes_images_in_parallel_n_processes,
+                'process_images_in_parallel_size':
+                    self.process_images_in_parallel_size,
+                'prefetch_n_threads':
+                    0 if self.image_prefetcher is None
+                    else self.image_prefetcher.n_threads,
+                'image_cache': self.image_cache is not None,
+                'compression_type': self.compression_type,
+                'image_format': self._get_image_format(),
+                'image_processing': self._get_image_processing_settings()
+                }})
+        if self.num_workers > 1:
+            stats_path = os.path.join(
+                output_dir, '%s_writer_stats_%s.json' % (
+                    file_prefix,
+                    get_worker_suffix(self.worker_index, self.num_workers)))
+        else:
+            stats_path = os.path.join(
+                output_dir, '%s_writer_stats.json' % file_prefix)
+        export_dict_to_json(stats_dict, stats_path)
+        logger.info("Time per stage - %s" % self.stats.get_summary())
+        self.stats.log_slowest_images()
+
+    def _write_to_file(self, output_file, record_ids, stats_queue=None):
+        """ Write a TFR File
+            stats_queue: queue to send the stats to (if in a sub-process)
+        """
+        if stats_queue is not None:
+            # do not report the stats inherited from the parent process
+            self.stats = WriterStats(n_slowest=self.n_slowest_images)
 
         # Create and Write Records to TFRecord file
         logger.info("Start Writing %s" % output_file)
@@ -180,13 +857,26 @@ class DatasetWriter(object):
             random.seed(123)
             random.shuffle(record_ids)
 
+        self._convert_shard_records(record_ids)
+
         # temporary filename for writing to avoid complications after
         # a write is incomplete
 
         output_temp = output_file + '_temp'
-        with tf.python_io.TFRecordWriter(output_temp) as writer:
+        written_ids = list()
+        written_sizes = list()
+        with tf.python_io.TFRecordWriter(
+                output_temp,
+                options=get_tfr_options(self.compression_type)) as writer:
 
-            for i, record_id in enumerate(record_ids):
+            records = self._iter_records_prefetched(record_ids)
+            if self.image_prefetcher is not None:
+                records = self.stats.time_iterator(
+                    records, 'wait_for_prefetch')
+
+            for i, (record_id, prefetched_images) in enumerate(records):
+
+                self._log_stats_periodically()
 
                 if i % 1000 == 0:
                     est_t = estimate_remaining_time(start_time, n_records, i)
@@ -194,9 +884,10 @@ class DatasetWriter(object):
                         "Wrote %s / %s records (estimated time remaining: %s)"
                         % (i, n_records, est_t))
 
-                record_data = self.tfrecord_dict[record_id]
+                record_data = self._get_record(record_id)
 
-                serialized_record = self._serialize_record(record_data)
+                serialized_record = self._serialize_record(
+                    record_data, prefetched_images)
 
                 if serialized_record is None:
                     logger.debug("Discarding record %s - no image avail" %
@@ -204,16 +895,25 @@ class DatasetWriter(object):
                     continue
 
                 # Write the serialized data to the TFRecords file.
-                writer.write(serialized_record)
+                self._write_record(writer, serialized_record)
+                written_ids.append(record_id)
+                written_sizes.append(len(serialized_record))
                 successfull_writes += 1
 
-        # Rename temporary file
+        # Write manifest and rename temporary file
+        self._write_manifest(output_file, output_temp, written_ids,
+                             written_sizes)
         os.replace(output_temp, output_file)
 
+        self._shard_records = dict()
+
         logger.info(
             "Finished Writing Records to %s - Wrote %s/%s" %
             (output_file, successfull_writes, n_records))
 
+        if stats_queue is not None:
+            stats_queue.put(self.stats.pop())
+
     def _write_to_file_parallel(self, output_file, record_ids):
         """ Write a TFR File with parallel image processing """
 
@@ -229,61 +929,287 @@ class DatasetWriter(object):
             random.seed(123)
             random.shuffle(record_ids)
 
-        # divide writes into batches
-        max_batch_size = min(self.process_images_in_parallel_size, n_records)
-        n_batches = (n_records // max_batch_size) \
-            + min(n_records % max_batch_size, 1)
-        slices = slice_generator(n_records, n_batches)
+        # log progress after roughly every queue-length of records
+        log_every = max(self.process_images_in_parallel_size, 1)
+
+        self._convert_shard_records(record_ids)
 
         # temporary filename for writing to avoid complications after
         # a write is incomplete
 
         output_temp = output_file + '_temp'
-        with tf.python_io.TFRecordWriter(output_temp) as writer:
-
-            for batch_i, (start_i, end_i) in enumerate(slices):
-
-                # Divide current batch to multiple processes
-                record_batch = [self.tfrecord_dict[x] for x in
-                                record_ids[start_i: end_i]]
-                n_records_in_batch = len(record_batch)
-
-                process_slices = slice_generator(
-                    n_records_in_batch,
-                    self.processes_images_in_parallel_n_processes)
+        written_ids = list()
+        written_sizes = list()
+        with tf.python_io.TFRecordWriter(
+                output_temp,
+                options=get_tfr_options(self.compression_type)) as writer:
 
-                manager = Manager()
-                serialized_records = manager.list()
+            # records are streamed back in the order they were submitted
+            serialized_stream = self.serializer_pool.imap(
+                self._iter_records_prefetched(record_ids))
+            serialized_stream = self.stats.time_iterator(
+                serialized_stream, 'wait_for_workers')
 
-                processes_list = list()
+            for i, (record_id, serialized_record) in \
+                    enumerate(serialized_stream):
 
-                for p_i, (batch_start_i, batch_end_i) in enumerate(process_slices):
+                self._log_stats_periodically()
 
-                    process_batch = record_batch[batch_start_i: batch_end_i]
-                    pr = Process(target=self._serialize_record_batch,
-                                 args=(process_batch, serialized_records))
-                    pr.start()
-                    processes_list.append(pr)
-
-                for p in processes_list:
-                    p.join()
-
-                # Write the serialized data to the TFRecords file.
-                for serialized_record in serialized_records:
-                    writer.write(serialized_record)
+                if serialized_record is None:
+                    logger.debug("Discarding record %s - no image avail" %
+                                 record_id)
+                else:
+                    # Write the serialized data to the TFRecords file.
+                    self._write_record(writer, serialized_record)
+                    written_ids.append(record_id)
+                    written_sizes.append(len(serialized_record))
                     successfull_writes += 1
-                est_t = estimate_remaining_time(start_time, n_records,
-                                                successfull_writes)
 
-                msg = "Wrote %s / %s records - \
-                       estimated time remaining: %s - file: %s" % \
-                      (successfull_writes, n_records, est_t, output_file)
+                if ((i + 1) % log_every) == 0:
+                    est_t = estimate_remaining_time(start_time, n_records,
+                                                    i + 1)
 
-                logger.debug(textwrap.shorten(msg, width=99))
+                    msg = "Wrote %s / %s records - \
+                           estimated time remaining: %s - file: %s" % \
+                          (successfull_writes, n_records, est_t, output_file)
 
-        # Rename temporary file
+                    logger.debug(textwrap.shorten(msg, width=99))
+
+        # Write manifest and rename temporary file
+        self._write_manifest(output_file, output_temp, written_ids,
+                             written_sizes)
         os.replace(output_temp, output_file)
 
+        self._shard_records = dict()
+
         logger.info(
             "Finished Writing Records to %s - Wrote %s/%s" %
             (output_file, successfull_writes, n_records))
+
+
+def _serialize_worker(dataset_writer, work_queue, result_queue):
+    """ Serialize records from 'work_queue' until a None is received
+        and put (index, serialized record, stats) onto 'result_queue'
+    """
+    while True:
+        task = work_queue.get()
+        if task is None:
+            break
+        index, record_id, record_data, prefetched_images = task
+        try:
+            serialized_record = dataset_writer._serialize_record(
+                record_data, prefetched_images)
+        except Exception as e:
+            logger.debug("Failed to serialize record: %s , error %s" %
+                         (record_id, str(e)))
+            serialized_record = None
+        result_queue.put(
+            (index, serialized_record, dataset_writer.stats.pop()))
+
+
+class SerializerPool(object):
+    """ Long-lived pool of processes serializing records in parallel
+
+        Workers are forked once and are fed records (and prefetched
+        images) through a bounded work queue. Serialized records are returned
+        through a bounded result queue and are re-ordered to the submission
+        order, thus at most
+        'max_in_flight' records are held in memory at any time.
+    """
+    # seconds to wait for a result before checking on the workers
+    poll_timeout = 10
+
+    def __init__(self, dataset_writer, n_processes=4, max_in_flight=100):
+        self.dataset_writer = dataset_writer
+        self.n_processes = max(n_processes, 1)
+        self.max_in_flight = max(max_in_flight, self.n_processes)
+        self.work_queue = Queue(maxsize=self.max_in_flight)
+        self.result_queue = Queue(maxsize=self.max_in_flight)
+        self.processes = list()
+        for _ in range(0, self.n_processes):
+            pr = Process(target=_serialize_worker,
+                         args=(dataset_writer,
+                               self.work_queue, self.result_queue))
+            pr.daemon = True
+            pr.start()
+            self.processes.append(pr)
+        logger.debug("Started %s image processing workers" % self.n_processes)
+
+    def imap(self, records):
+        """ Serialize 'records' (record_id, prefetched images or None) and
+            yield (record_id, serialized_record) in the order of 'records',
+            serialized_record is None if the record could not be serialized
+        """
+        records = iter(records)
+        submitted_ids = dict()
+        finished = dict()
+        next_submit = 0
+        next_yield = 0
+        all_submitted = False
+
+        while True:
+            # keep the workers busy up to the in-flight limit, this never
+            # blocks since both queues can hold 'max_in_flight' tasks
+            while not all_submitted and \
+                    (next_submit - next_yield) < self.max_in_flight:
+                try:
+                    record_id, prefetched_images = next(records)
+                except StopIteration:
+                    all_submitted = True
+                    break
+                submitted_ids[next_submit] = record_id
+                self.work_queue.put(
+                    (next_submit, record_id,
+                     self.dataset_writer._get_record(record_id),
+                     prefetched_images))
+                next_submit += 1
+
+            if next_yield == next_submit:
+                break
+
+            while next_yield not in finished:
+                index, serialized_record, stats = self._get_result()
+                finished[index] = serialized_record
+                self.dataset_writer.stats.merge(stats)
+
+            yield (submitted_ids.pop(next_yield), finished.pop(next_yield))
+            next_yield += 1
+
+    def _get_result(self):
+        """ Get the next result - fail if workers died """
+        while True:
+            try:
+                return self.result_queue.get(timeout=self.poll_timeout)
+            except queue.Empty:
+                if not all(p.is_alive() for p in self.processes):
+                    raise RuntimeError(
+                        "Image processing worker died unexpectedly")
+
+    def close(self):
+        """ Stop all workers """
+        for _ in self.processes:
+            try:
+                self.work_queue.put(None, timeout=self.poll_timeout)
+            except queue.Full:
+                break
+        for p in self.processes:
+            p.join(timeout=self.poll_timeout)
+            if p.is_alive():
+                p.terminate()
+
+
+class StreamingShardWriter(object):
+    """ Write the records of one split to TFRecord files while they
+        arrive (e.g. while the source is being read)
+
+        Records are buffered until 'max_records_per_file' records have
+        arrived and are then written as one shard with
+        DatasetWriter.encode_to_tfr (kwargs are passed on). The number of
+        shards is only known at the end, thus the shards are written to a
+        temporary directory in output_dir and moved to
+        '<file_prefix>_<i>-of-<n>.tfrecord' (with their manifests) on close.
+        The writer stats of all shards are merged to
+        '<file_prefix>_writer_stats.json'.
+
+        Records are sorted within but not across shards and incremental,
+        distributed and size-balanced exports are not supported.
+    """
+    def __init__(self, dataset_writer, output_dir, file_prefix,
+                 max_records_per_file=5000, overwrite_existing_files=True,
+                 **kwargs):
+        for arg in ('incremental', 'max_bytes_per_file'):
+            if kwargs.get(arg):
+                raise ValueError("%s is not supported when streaming" % arg)
+        if kwargs.get('num_workers', 1) > 1:
+            raise ValueError(
+                "multiple workers are not supported when streaming")
+        kwargs.pop('max_records_per_file', None)
+        if max_records_per_file is None or max_records_per_file < 1:
+            raise ValueError("max_records_per_file must be at least 1")
+        self.dataset_writer = dataset_writer
+        self.output_dir = output_dir
+        self.file_prefix = file_prefix
+        self.max_records_per_file = max_records_per_file
+        self.kwargs = kwargs
+        existing = self._find_existing_shards()
+        if len(existing) > 0 and not overwrite_existing_files:
+            raise ValueError(
+                "Files of %s exist in %s - not gonna overwrite: %s" %
+                (file_prefix, output_dir, existing))
+        self.temp_dir = tempfile.mkdtemp(
+            prefix='.streaming_%s_' % file_prefix, dir=output_dir)
+        self.buffer = dict()
+        self.shard_paths = list()
+        self.n_records = 0
+
+    def _find_existing_shards(self):
+        pattern = re.compile(
+            r'^%s_\d+-of-\d+\.tfrecord$' % re.escape(self.file_prefix))
+        return sorted(x for x in os.listdir(self.output_dir)
+                      if pattern.match(x) is not None)
+
+    def add(self, record_id, tfr_record):
+        """ Add a record (in the tfr format), writes a shard once
+            'max_records_per_file' records are buffered
+        """
+        self.buffer[record_id] = tfr_record
+        self.n_records += 1
+        if len(self.buffer) >= self.max_records_per_file:
+            self._write_buffer()
+
+    def _write_buffer(self):
+        shard_prefix = 'shard%05d' % (len(self.shard_paths) + 1)
+        self.dataset_writer.encode_to_tfr(
+            self.buffer, self.temp_dir, shard_prefix,
+            overwrite_existing_files=True, max_records_per_file=None,
+            **self.kwargs)
+        self.shard_paths += self.dataset_writer.files.pop(shard_prefix)
+        self.buffer = dict()
+
+    def close(self):
+        """ Write the remaining records, move the shards to output_dir
+            Returns: paths of the shards
+        """
+        try:
+            if len(self.buffer) > 0:
+                self._write_buffer()
+            return self._move_shards()
+        finally:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def abort(self):
+        """ Remove the shards written so far """
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _move_shards(self):
+        n_files = len(self.shard_paths)
+        stats = WriterStats()
+        merged = {'n_records': 0, 'n_records_written': 0, 'seconds': 0}
+        output_paths = list()
+        for i, shard_path in enumerate(self.shard_paths):
+            output_file = os.path.join(
+                self.output_dir, '%s_%03d-of-%03d.tfrecord' %
+                (self.file_prefix, i + 1, n_files))
+            manifest = read_tfr_manifest(shard_path)
+            if manifest is not None:
+                manifest['file_name'] = os.path.basename(output_file)
+                export_dict_to_json(
+                    manifest, get_tfr_manifest_path(output_file))
+            os.replace(shard_path, output_file)
+            output_paths.append(output_file)
+
+            shard_prefix = 'shard%05d' % (i + 1)
+            shard_stats = read_json(os.path.join(
+                self.temp_dir, '%s_writer_stats.json' % shard_prefix))
+            stats.merge(shard_stats)
+            merged['n_records'] += shard_stats['n_records']
+            merged['n_records_written'] += shard_stats['n_records_written']
+            merged['seconds'] += shard_stats['seconds']
+            merged['settings'] = shard_stats['settings']
+        merged.update(stats.to_dict())
+        export_dict_to_json(merged, os.path.join(
+            self.output_dir, '%s_writer_stats.json' % self.file_prefix))
+        self.dataset_writer.files[self.file_prefix] = output_paths
+        logger.info("Wrote %s records of %s to %s files" %
+                    (self.n_records, self.file_prefix, n_files))
+        return output_paths
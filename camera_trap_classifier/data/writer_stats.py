@@ -0,0 +1,132 @@
+""" Timers and Counters of the Stages of Writing TFRecord Files
+
+Stages (time summed over all threads / processes):
+- cache_lookup: get processed images from the image cache
+- read: read raw images from disk
+- decode, resize, encode: image processing stages (see ImageCodec)
+- serialize: create the serialized TFRecord example
+- write: write serialized records to the TFRecord file
+- wait_for_prefetch: waiting for images from the prefetch threads
+- wait_for_workers: waiting for records from the image processing workers
+- shared_image_reuse: images used by multiple records taken from memory
+"""
+import time
+import heapq
+import logging
+import threading
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriterStats(object):
+    """ Accumulates time, count and bytes per stage and keeps the
+        slowest images
+
+    Args:
+        n_slowest (int): number of slowest images to keep
+    """
+    def __init__(self, n_slowest=10):
+        self.n_slowest = n_slowest
+        self.stages = dict()
+        self.slowest_images = list()
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, n_bytes=0, count=1):
+        """ Add the measurement of a stage """
+        with self._lock:
+            if stage not in self.stages:
+                self.stages[stage] = {'seconds': 0.0, 'count': 0, 'bytes': 0}
+            stage_stats = self.stages[stage]
+            stage_stats['seconds'] += seconds
+            stage_stats['count'] += count
+            stage_stats['bytes'] += n_bytes
+
+    @contextmanager
+    def time(self, stage):
+        """ Measure the time of a stage, the yielded dict can be used to
+            set the number of processed bytes
+        """
+        measurement = {'bytes': 0}
+        start_time = time.perf_counter()
+        try:
+            yield measurement
+        finally:
+            self.add(stage, time.perf_counter() - start_time,
+                     n_bytes=measurement['bytes'])
+
+    def time_iterator(self, iterable, stage):
+        """ Measure the time spent waiting for the items of an iterable """
+        iterator = iter(iterable)
+        while True:
+            start_time = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(stage, time.perf_counter() - start_time)
+            yield item
+
+    def is_among_slowest(self, seconds):
+        """ Check whether an image is among the slowest images """
+        return len(self.slowest_images) < self.n_slowest or \
+            seconds > self.slowest_images[0][0]
+
+    def add_image(self, seconds, path, n_bytes):
+        """ Add the processing time of an image """
+        with self._lock:
+            entry = (seconds, path, n_bytes)
+            if len(self.slowest_images) < self.n_slowest:
+                heapq.heappush(self.slowest_images, entry)
+            elif seconds > self.slowest_images[0][0]:
+                heapq.heapreplace(self.slowest_images, entry)
+
+    def merge(self, stats_dict):
+        """ Merge stats of another WriterStats (created by to_dict) """
+        for stage, stage_stats in stats_dict['stages'].items():
+            self.add(stage, stage_stats['seconds'],
+                     n_bytes=stage_stats['bytes'],
+                     count=stage_stats['count'])
+        for image in stats_dict['slowest_images']:
+            self.add_image(image['seconds'], image['path'], image['bytes'])
+
+    def pop(self):
+        """ Get the stats as dict and reset them """
+        with self._lock:
+            stats_dict = self._to_dict()
+            self.stages = dict()
+            self.slowest_images = list()
+        return stats_dict
+
+    def to_dict(self):
+        """ Get the stats as dict """
+        with self._lock:
+            return self._to_dict()
+
+    def _to_dict(self):
+        stages = {k: dict(v) for k, v in self.stages.items()}
+        slowest_images = [
+            {'seconds': seconds, 'path': path, 'bytes': n_bytes}
+            for seconds, path, n_bytes in
+            sorted(self.slowest_images, reverse=True)]
+        return {'stages': stages, 'slowest_images': slowest_images}
+
+    def get_summary(self):
+        """ One-line summary of the time spent per stage """
+        with self._lock:
+            stages = sorted(self.stages.items(),
+                            key=lambda x: x[1]['seconds'], reverse=True)
+        total_seconds = sum(x[1]['seconds'] for x in stages)
+        summary = list()
+        for stage, stage_stats in stages:
+            share = stage_stats['seconds'] / max(total_seconds, 1e-9)
+            summary.append("%s: %.1fs (%.0f%%)" %
+                           (stage, stage_stats['seconds'], 100 * share))
+        return ' - '.join(summary)
+
+    def log_slowest_images(self):
+        """ Log the slowest images """
+        for image in self.to_dict()['slowest_images']:
+            logger.info("Slow image: %.2fs - %s bytes - %s" %
+                        (image['seconds'], image['bytes'], image['path']))
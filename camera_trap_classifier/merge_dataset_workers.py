@@ -0,0 +1,56 @@
+""" Merge the Outputs of Workers Creating a Dataset
+
+After all workers of a distributed dataset creation have finished
+(create_dataset.py with -num_workers and -worker_index), this checks that
+all workers agree on the splits and label mappings and that every file
+has been written. Writes:
+- label_mapping.json: the label mapping of all workers
+- <split>_writer_stats.json: the merged writer stats of all workers
+- dataset_manifest.json: files and label histograms of all splits
+
+Example Usage:
+--------------
+python merge_dataset_workers.py \
+-output_dir /my_data/tfr_files/ \
+-num_workers 8
+"""
+import argparse
+import logging
+
+from camera_trap_classifier.config.logging import setup_logging
+from camera_trap_classifier.data.distributed import merge_worker_outputs
+
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(prog='MERGE DATASET WORKERS')
+    parser.add_argument("-output_dir", type=str, required=True,
+                        help="output_dir of the workers")
+    parser.add_argument("-num_workers", type=int, required=True,
+                        help="number of workers used to create the dataset")
+    parser.add_argument(
+        "-log_outdir", type=str, required=False, default=None,
+        help="Directory to write logfiles to (defaults to output_dir)")
+
+    # Parse command line arguments
+    args = vars(parser.parse_args())
+
+    # Configure Logging
+    if args['log_outdir'] is None:
+        args['log_outdir'] = args['output_dir']
+
+    setup_logging(log_output_path=args['log_outdir'])
+
+    logger = logging.getLogger(__name__)
+
+    print("Using arguments:")
+    for k, v in args.items():
+        print("Arg: %s: %s" % (k, v))
+
+    merge_worker_outputs(args['output_dir'], args['num_workers'])
+
+    logger.info("Finished merging the outputs of all workers")
+
+
+if __name__ == '__main__':
+    main()
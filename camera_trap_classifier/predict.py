@@ -41,6 +41,10 @@ def main():
         help='path to root of image directory, can contain subdirectories \
               with images, the program will search for all images and \
               classify them.')
+    parser.add_argument(
+        "-image_dir_listing_cache", type=str, required=False, default=None,
+        help='path to a json file to cache the listing of image_dir, \
+              repeated runs only list directories which have changed')
     parser.add_argument(
         "-results_file", type=str, required=True,
         help='path to the file to which to store the predictions')
@@ -89,7 +93,8 @@ def main():
             image_dir=args['image_dir'],
             export_type=args['export_file_type'],
             output_file=args['results_file'],
-            batch_size=args['batch_size'])
+            batch_size=args['batch_size'],
+            listing_cache_path=args['image_dir_listing_cache'])
     else:
         pred.predict_from_csv(
             path_to_csv=args['csv_path'],
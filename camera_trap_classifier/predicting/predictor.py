@@ -88,15 +88,17 @@ class Predictor(object):
             self._predict_dataset(dataset, output_file, export_type)
 
     def predict_from_image_dir(self, image_dir, export_type, output_file,
-                               batch_size=128):
+                               batch_size=128, listing_cache_path=None):
         """  Predict from Image Directory
         Args:
         - image_dir: path to an image directory (with potentially sub-dirs)
         - export_type: csv or json
         - output_file: path to write export file to
         - batch_size: numer of images to process at the same time
+        - listing_cache_path: json file to cache the directory listings,
+            only changed directories are listed again
         """
-        image_paths = self._from_image_dir(image_dir)
+        image_paths = self._from_image_dir(image_dir, listing_cache_path)
         inventory = self._create_inventory_from_paths(image_paths)
         with self.session:
             self._predict_inventory(inventory, output_file,
@@ -132,11 +134,12 @@ class Predictor(object):
             else:
                 print("  Key: %s - Value: %s" % (k, v))
 
-    def _from_image_dir(self, path_to_image_dir):
+    def _from_image_dir(self, path_to_image_dir, listing_cache_path=None):
         """ Find all images in a directory """
         image_paths = list_pictures(
             path_to_image_dir,
-            ext=('jpg', 'jpeg', 'bmp', 'png'))
+            ext=('jpg', 'jpeg', 'bmp', 'png'),
+            cache_path=listing_cache_path)
         print("Found %s images in %s" %
               (len(image_paths), path_to_image_dir))
 
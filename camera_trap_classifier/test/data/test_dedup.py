@@ -0,0 +1,77 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from camera_trap_classifier.data.dedup import ImageDeduplicator
+from camera_trap_classifier.data.inventory import (
+    DatasetInventoryMaster, DatasetInventorySplit)
+
+
+class DeduplicationTests(unittest.TestCase):
+    """ Test finding and handling identical images """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cat = './test/test_images/Cats/cat0.jpg'
+        self.dog = './test/test_images/Dogs/dog3159.jpg'
+        self.cat_copy = os.path.join(self.tmp_dir, 'cat0_copy.jpg')
+        shutil.copyfile(self.cat, self.cat_copy)
+        self.dinv = DatasetInventoryMaster()
+        self.dinv.data_inventory = {
+            'a': {'images': [self.cat], 'labels': [{'class': 'cat'}]},
+            'b': {'images': [self.cat_copy, self.dog],
+                  'labels': [{'class': 'cat'}]},
+            'c': {'images': [self.cat_copy], 'labels': [{'class': 'cat'}]}}
+        self.deduplicator = ImageDeduplicator(n_threads=2)
+        self.deduplicator.hash_inventory(self.dinv)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testHashImages(self):
+        hashes = self.deduplicator.image_hashes
+        self.assertEqual(hashes[self.cat], hashes[self.cat_copy])
+        self.assertNotEqual(hashes[self.cat], hashes[self.dog])
+
+    def testImageRootPath(self):
+        image_path = os.sep + os.path.join('Cats', 'cat0.jpg')
+        deduplicator = ImageDeduplicator(
+            image_root_path='./test/test_images', n_threads=2)
+        deduplicator.hash_images([image_path])
+        self.assertEqual(deduplicator.image_hashes[image_path],
+                         self.deduplicator.image_hashes[self.cat])
+
+    def testDropDuplicates(self):
+        n_duplicates = self.dinv.deduplicate_images(
+            self.deduplicator.image_hashes, mode='drop')
+        self.assertEqual(n_duplicates, 2)
+        self.assertEqual(set(self.dinv.data_inventory.keys()), {'a', 'b'})
+        self.assertEqual(self.dinv.data_inventory['b']['images'], [self.dog])
+
+    def testReferenceDuplicates(self):
+        self.dinv.deduplicate_images(
+            self.deduplicator.image_hashes, mode='reference')
+        self.assertEqual(set(self.dinv.data_inventory.keys()),
+                         {'a', 'b', 'c'})
+        self.assertEqual(self.dinv.data_inventory['b']['images'],
+                         [self.cat, self.dog])
+        self.assertEqual(self.dinv.data_inventory['c']['images'],
+                         [self.cat])
+
+    def testCrossSplitDuplicates(self):
+        inventory = self.dinv.data_inventory
+        splits = {
+            'train': DatasetInventorySplit(
+                {'a': inventory['a']}, None, None),
+            'test': DatasetInventorySplit(
+                {'b': inventory['b'], 'c': inventory['c']}, None, None)}
+        duplicates = self.deduplicator.find_cross_split_duplicates(splits)
+        cat_hash = self.deduplicator.image_hashes[self.cat]
+        self.assertEqual(list(duplicates.keys()), [cat_hash])
+        self.assertEqual(duplicates[cat_hash],
+                         {'train': ['a'], 'test': ['b', 'c']})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from camera_trap_classifier.data.distributed import (
+    is_shard_owner, check_worker_index, export_worker_manifest,
+    get_worker_label_mapping_path, merge_worker_outputs)
+from camera_trap_classifier.data.utils import (
+    export_dict_to_json, get_tfr_manifest_path, read_json)
+
+
+class DistributedTests(unittest.TestCase):
+    """ Test creating a dataset with multiple workers """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.num_workers = 3
+        self.record_ids = [str(i) for i in range(0, 10)]
+        self.shard_paths = [
+            os.path.join(self.tmp_dir, 'train_%03d-of-005.tfrecord' % i)
+            for i in range(1, 6)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_worker(self, worker_index, label_mapping=None):
+        owned = list()
+        for i, path in enumerate(self.shard_paths):
+            if not is_shard_owner(i, worker_index, self.num_workers):
+                continue
+            with open(path, 'wb') as f:
+                f.write(b'records')
+            export_dict_to_json(
+                {'file_size': 7, 'n_records': 2,
+                 'label_histogram': {'species': {'0': 2}}},
+                get_tfr_manifest_path(path))
+            owned.append(path)
+        export_worker_manifest(
+            self.tmp_dir, 'train', worker_index, self.num_workers,
+            self.record_ids, self.shard_paths, owned)
+        export_dict_to_json(
+            label_mapping or {'species': {'cat': 0}},
+            get_worker_label_mapping_path(
+                self.tmp_dir, worker_index, self.num_workers))
+
+    def testShardOwnership(self):
+        owners = [[w for w in range(0, 4) if is_shard_owner(i, w, 4)]
+                  for i in range(0, 10)]
+        self.assertTrue(all(len(x) == 1 for x in owners))
+        self.assertRaises(ValueError, check_worker_index, 3, 3)
+        self.assertRaises(ValueError, check_worker_index, 0, 0)
+
+    def testMerge(self):
+        for worker_index in range(0, self.num_workers):
+            self._write_worker(worker_index)
+        dataset_manifest = merge_worker_outputs(
+            self.tmp_dir, self.num_workers)
+        train = dataset_manifest['splits']['train']
+        self.assertEqual(train['n_records_written'], 10)
+        self.assertEqual(train['label_histogram'], {'species': {'0': 10}})
+        self.assertEqual(
+            read_json(os.path.join(self.tmp_dir, 'label_mapping.json')),
+            {'species': {'cat': 0}})
+
+    def testMergeIncomplete(self):
+        for worker_index in range(0, self.num_workers - 1):
+            self._write_worker(worker_index)
+        self.assertRaises(FileNotFoundError, merge_worker_outputs,
+                          self.tmp_dir, self.num_workers)
+
+    def testMergeDifferentLabelMappings(self):
+        self._write_worker(0)
+        self._write_worker(1)
+        self._write_worker(2, label_mapping={'species': {'dog': 0}})
+        self.assertRaises(ValueError, merge_worker_outputs,
+                          self.tmp_dir, self.num_workers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from camera_trap_classifier.data.file_walker import DirectoryWalker
+
+
+class DirectoryWalkerTests(unittest.TestCase):
+    """ Test walking directory trees """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp_dir, 'images')
+        for i in range(0, 20):
+            path = os.path.join(
+                self.root, 'site%s' % (i % 3), 'camera%s' % (i % 5))
+            os.makedirs(path, exist_ok=True)
+            for name in ['img%s.jpg' % i, 'IMG%s.PNG' % i, 'notes.txt']:
+                open(os.path.join(path, name), 'w').close()
+        self.cache_path = os.path.join(self.tmp_dir, 'listing.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testIdenticalToOsWalk(self):
+        expected = sorted((root, sorted(dirs), sorted(files))
+                          for root, dirs, files in os.walk(self.root))
+        walked = list(DirectoryWalker(n_threads=4).walk(self.root))
+        self.assertEqual(sorted(walked), expected)
+        # deterministic order
+        self.assertEqual(walked,
+                         list(DirectoryWalker(n_threads=1).walk(self.root)))
+
+    def testIterFiles(self):
+        files = list(DirectoryWalker().iter_files(
+            self.root, ext=('.jpg', '.png')))
+        self.assertEqual(len(files), 40)
+        self.assertIn(
+            os.path.join(self.root, 'site0', 'camera0', 'IMG0.PNG'), files)
+        files = list(DirectoryWalker().iter_files(self.root, max_depth=1))
+        self.assertEqual(files, list())
+
+    def testCachedListing(self):
+        walker = DirectoryWalker(cache_path=self.cache_path)
+        walker.racy_seconds = -60
+        files = list(walker.iter_files(self.root))
+        walker = DirectoryWalker(cache_path=self.cache_path)
+        self.assertEqual(list(walker.iter_files(self.root)), files)
+        self.assertEqual(walker.n_listed, 0)
+        new_file = os.path.join(self.root, 'site0', 'camera0', 'new.jpg')
+        open(new_file, 'w').close()
+        os.utime(os.path.dirname(new_file), (0, 0))
+        walker = DirectoryWalker(cache_path=self.cache_path)
+        self.assertIn(new_file, list(walker.iter_files(self.root)))
+        self.assertEqual(walker.n_listed, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
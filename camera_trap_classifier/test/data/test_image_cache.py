@@ -0,0 +1,56 @@
+import unittest
+import os
+import time
+import shutil
+import tempfile
+
+from camera_trap_classifier.data.image_cache import ImageCache
+
+
+class ImageCacheTests(unittest.TestCase):
+    """ Test the on-disk image cache """
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.image_path = './test/test_images/Cats/cat0.jpg'
+        self.settings = ['resize', {'smallest_side': 500}]
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def testPutAndGet(self):
+        cache = ImageCache(self.cache_dir)
+        key = cache.get_key(self.image_path, self.settings)
+        self.assertIsNone(cache.get(key))
+        cache.put(key, b'processed')
+        self.assertEqual(cache.get(key), b'processed')
+
+    def testKeyDependsOnSettings(self):
+        cache = ImageCache(self.cache_dir)
+        key = cache.get_key(self.image_path, self.settings)
+        key_other = cache.get_key(
+            self.image_path, ['resize', {'smallest_side': 400}])
+        self.assertEqual(key, cache.get_key(self.image_path, self.settings))
+        self.assertNotEqual(key, key_other)
+
+    def testEvictLeastRecentlyUsed(self):
+        cache = ImageCache(self.cache_dir, max_size_bytes=25)
+        cache.put('aa1', b'0' * 10)
+        cache.put('bb2', b'0' * 10)
+        # mark first entry as older than the second one
+        old_time = time.time() - 100
+        os.utime(cache._get_entry_path('aa1'), (old_time, old_time))
+        cache.put('cc3', b'0' * 10)
+        self.assertIsNone(cache.get('aa1'))
+        self.assertIsNotNone(cache.get('bb2'))
+        self.assertIsNotNone(cache.get('cc3'))
+        self.assertEqual(cache._size.value, 20)
+
+    def testSizeOfExistingCache(self):
+        cache = ImageCache(self.cache_dir)
+        cache.put('aa1', b'0' * 10)
+        self.assertEqual(ImageCache(self.cache_dir)._size.value, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
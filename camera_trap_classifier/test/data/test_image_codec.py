@@ -0,0 +1,133 @@
+import unittest
+import os
+import struct
+import shutil
+import tempfile
+
+import tensorflow as tf
+
+from camera_trap_classifier.data import image_codec
+from camera_trap_classifier.data.image import (
+    _smallest_size_at_least, read_image_from_disk_and_convert_to_jpeg,
+    read_image_from_disk_resize_and_convert_to_jpeg)
+from camera_trap_classifier.data.image_codec import (
+    read_image_size, smallest_size_at_least, ImageCodec, TFImageCodec,
+    PillowImageCodec)
+from camera_trap_classifier.data.writer_stats import WriterStats
+
+tf.enable_eager_execution()
+
+
+class ImageSizeTests(unittest.TestCase):
+    """ Test reading image dimensions from image headers """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.jpeg_path = './test/test_images/Cats/cat0.jpg'
+        self.bmp_path = './test/test_images/Dogs/dog3203.bmp'
+        self.png_path = os.path.join(self.tmp_dir, 'image.png')
+        with open(self.png_path, 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' +
+                    struct.pack('>IIBBBBB', 640, 480, 8, 2, 0, 0, 0))
+        self.pil_image = image_codec.Image
+
+    def tearDown(self):
+        image_codec.Image = self.pil_image
+        shutil.rmtree(self.tmp_dir)
+
+    def testReadWithoutPillow(self):
+        image_codec.Image = None
+        self.assertEqual(read_image_size(self.jpeg_path), (374, 500))
+        self.assertEqual(read_image_size(self.png_path), (480, 640))
+        self.assertEqual(read_image_size(self.bmp_path), (310, 239))
+        self.assertIsNone(read_image_size(
+            './test/test_files/json_data_file.json'))
+        self.assertIsNone(read_image_size(
+            os.path.join(self.tmp_dir, 'missing.jpg')))
+
+    @unittest.skipIf(image_codec.Image is None, "requires Pillow")
+    def testReadWithPillow(self):
+        self.assertEqual(read_image_size(self.jpeg_path), (374, 500))
+        self.assertEqual(read_image_size(self.bmp_path), (310, 239))
+
+
+class ImageCodecTests(unittest.TestCase):
+    """ Test reading, resizing and converting images with the codecs """
+
+    def setUp(self):
+        self.jpeg_path = './test/test_images/Cats/cat0.jpg'
+        self.png_path = './test/test_images/Dogs/dog3200.png'
+        self.codecs = [ImageCodec.create('tensorflow')]
+        if image_codec.Image is not None:
+            self.codecs.append(ImageCodec.create('pillow'))
+
+    def _decode_jpeg(self, image_bytes):
+        self.assertEqual(image_bytes[:2], b'\xff\xd8')
+        return tf.image.decode_jpeg(image_bytes).numpy()
+
+    def testCreate(self):
+        self.assertIsInstance(ImageCodec.create('tensorflow'), TFImageCodec)
+        if image_codec.Image is not None:
+            self.assertIsInstance(
+                ImageCodec.create('pillow'), PillowImageCodec)
+        self.assertRaises(ValueError, ImageCodec.create, 'unknown')
+
+    def testSmallestSizeParity(self):
+        for height, width, smallest_side in [
+                (374, 500, 200), (500, 374, 200), (333, 333, 100),
+                (1080, 1920, 299), (7, 13, 5), (2448, 3264, 333)]:
+            expected = [x.numpy() for x in _smallest_size_at_least(
+                height, width, smallest_side)]
+            self.assertEqual(
+                list(smallest_size_at_least(height, width, smallest_side)),
+                expected)
+
+    def testConvertToJpeg(self):
+        for codec in self.codecs:
+            for path in [self.jpeg_path, self.png_path]:
+                expected = read_image_size(path)
+                image = self._decode_jpeg(codec.read_and_convert_to_jpeg(path))
+                self.assertEqual(image.shape[:2], expected)
+
+    def testResizeAndConvertToJpeg(self):
+        expected = smallest_size_at_least(374, 500, 100)
+        for codec in self.codecs:
+            with open(self.jpeg_path, 'rb') as f:
+                file_bytes = f.read()
+            image_bytes = codec.read_resize_and_convert_to_jpeg(
+                self.jpeg_path, 100, image_save_quality=90,
+                file_bytes=file_bytes)
+            image = self._decode_jpeg(image_bytes)
+            self.assertEqual(image.shape, expected + (3, ))
+
+    def testImageFunctions(self):
+        codec = TFImageCodec()
+        self.assertEqual(
+            read_image_from_disk_and_convert_to_jpeg(self.png_path, 90),
+            codec.read_and_convert_to_jpeg(self.png_path, 90))
+        self.assertEqual(
+            read_image_from_disk_resize_and_convert_to_jpeg(
+                self.jpeg_path, 100),
+            codec.read_resize_and_convert_to_jpeg(self.jpeg_path, 100))
+
+    def testResizeAndConvertToRaw(self):
+        for codec in self.codecs:
+            image_raw = codec.read_resize_and_convert_to_raw(
+                self.png_path, 10, 12)
+            self.assertEqual(len(image_raw), 10 * 12 * 3)
+
+    def testStageTimes(self):
+        for codec in self.codecs:
+            stats = WriterStats()
+            image_bytes = codec.read_resize_and_convert_to_jpeg(
+                self.jpeg_path, 100, stats=stats)
+            stages = stats.to_dict()['stages']
+            self.assertEqual(set(stages.keys()),
+                             {'read', 'decode', 'resize', 'encode'})
+            self.assertEqual(stages['encode']['bytes'], len(image_bytes))
+            self.assertEqual(stages['read']['bytes'],
+                             os.path.getsize(self.jpeg_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,8 @@
 import unittest
+import os
+import csv
+import shutil
+import tempfile
 from camera_trap_classifier.data.importer import DatasetImporter
 
 
@@ -125,6 +129,57 @@ class ImportFromCSVMultiImageTester(unittest.TestCase):
                           'images': ["/path/capture_ele1.jpg",
                                      "/path/capture_ele2.jpg"]})
 
+
+class ImportFromCSVParallelTester(unittest.TestCase):
+    """ Test Import from CSV in Chunks / Processes """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'dataset.csv')
+        # quoted fields with commas, line breaks and quotes, rows of the
+        # same capture in different chunks
+        with open(self.path, 'w') as f:
+            f.write('capture_id,image,species,count\n')
+            for i in range(0, 300):
+                species = ['Zebra', '"Lion, male"', '"Ele\n""phant"""'][i % 3]
+                f.write('c%s,/path/%s.jpg,%s,%s\n' % (i % 70, i, species, i))
+        self.params = {'path': self.path,
+                       'image_path_col_list': 'image',
+                       'capture_id_col': 'capture_id',
+                       'attributes_col_list': ['species', 'count']}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _read_with_csv_reader(self):
+        """ Records of the rows of the whole file read with csv.reader """
+        records = dict()
+        with open(self.path, newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            cols = {x: header.index(x) for x in header}
+            for row in reader:
+                record = records.setdefault(
+                    row[cols['capture_id']],
+                    {'images': [row[cols['image']]], 'labels': list()})
+                record['labels'].append(
+                    {'species': row[cols['species']],
+                     'count': row[cols['count']]})
+        return records
+
+    def testIdenticalToCSVReader(self):
+        expected = self._read_with_csv_reader()
+        self.assertEqual(len(expected), 70)
+        self.assertEqual(expected['c1']['labels'][0:3],
+                         [{'species': 'Lion, male', 'count': '1'},
+                          {'species': 'Ele\n"phant"', 'count': '71'},
+                          {'species': 'Zebra', 'count': '141'}])
+        for n_processes, chunk_size_mb in [(1, 64), (1, 0.0001), (2, 0.001)]:
+            data = DatasetImporter().create(
+                'csv', {**self.params, 'n_processes': n_processes,
+                        'chunk_size_mb': chunk_size_mb}).import_from_source()
+            self.assertEqual(list(data.items()), list(expected.items()))
+
 if __name__ == '__main__':
 
     unittest.main()
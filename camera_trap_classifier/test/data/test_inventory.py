@@ -1,6 +1,7 @@
 import unittest
 from camera_trap_classifier.data.inventory import (
     DatasetInventoryMaster)
+from camera_trap_classifier.data.inventory_store import InventoryView
 
 
 class DataInventoryTests(unittest.TestCase):
@@ -66,6 +67,130 @@ class DataInventoryTests(unittest.TestCase):
         self.assertNotIn("missing_counts_label",  self.inventory)
         self.assertIn("counts_is_12",  self.inventory)
 
+    def testRemoveRecordsWithLabelExactMatch(self):
+        self.assertIn("counts_is_12",  self.inventory)
+        self.dinv.remove_records_with_label(['counts'], ['1'])
+        self.assertNotIn("single_species_standard",  self.inventory)
+        self.assertIn("counts_is_12",  self.inventory)
+
+    def testLabelIndexUpdatedOnRemove(self):
+        ids = self.dinv.label_index.get_record_ids('class', 'elephant')
+        self.assertIn("is_elephant", ids)
+        self.dinv.remove_record("is_elephant")
+        self.assertNotIn(
+            "is_elephant",
+            self.dinv.label_index.get_record_ids('class', 'elephant'))
+        self.dinv.keep_only_records_with_label(['class'], ['elephant'])
+        self.assertEqual(self.dinv.get_number_of_records(), 0)
+
+    def testRemapLabels(self):
+        record_before = self.inventory['is_elephant']
+        stats = self.dinv.remap_labels(
+            {'class': {'elephant': 'mammal', 'cat': 'mammal', 'dog': 'dog'},
+             'counts': {'12': 'many'}})
+        self.assertEqual(self.inventory['is_elephant']['labels'][0]['class'],
+                         'mammal')
+        self.assertEqual(self.inventory['counts_is_12']['labels'][0],
+                         {'class': 'mammal', 'color_brown': '1',
+                          'color_white': '0', 'counts': 'many'})
+        # records are not changed in place
+        self.assertEqual(record_before['labels'][0]['class'], 'elephant')
+        self.assertEqual(stats['class']['elephant'],
+                         {'new_value': 'mammal', 'n_records': 1,
+                          'n_labels': 1})
+        self.assertEqual(stats['counts']['12']['n_labels'], 1)
+        self.assertNotIn('dog', stats['class'])
+        self.assertIn('multi_species_standard',
+                      self.dinv.label_index.get_record_ids('class', 'mammal'))
+        self.assertEqual(
+            len(self.dinv.label_index.get_record_ids('class', 'cat')), 0)
+
+    def testSplitViewsAndLazyExport(self):
+        splits = self.dinv.split_inventory_by_random_splits(
+            split_names=['train', 'test'], split_percent=[0.5, 0.5])
+        record_ids = list()
+        for split in splits.values():
+            self.assertIsInstance(split.data_inventory, InventoryView)
+            for record_id, record in split.data_inventory.items():
+                self.assertEqual(record, self.dinv.data_inventory[record_id])
+            record_ids += split.get_all_record_ids()
+        self.assertEqual(sorted(record_ids),
+                         sorted(self.dinv.get_all_record_ids()))
+        split = splits['train']
+        other_id = splits['test'].get_all_record_ids()[0]
+        self.assertNotIn(other_id, split.data_inventory)
+        self.assertRaises(KeyError, split.get_record_id_data, other_id)
+
+        class _Writer(object):
+            def encode_to_tfr(self, tfrecord_dict, tfr_path, **kwargs):
+                self.tfrecord_dict = tfrecord_dict
+        writer = _Writer()
+        split.export_to_tfrecord(writer, 'unused')
+        record_id = split.get_all_record_ids()[0]
+        self.assertEqual(
+            writer.tfrecord_dict[record_id],
+            split._convert_record_to_tfr_format(
+                record_id, self.dinv.data_inventory[record_id]))
+        self.assertEqual(len(writer.tfrecord_dict), len(split.data_inventory))
+
+    def _scan_label_stats(self, data_inventory):
+        label_stats = dict()
+        for record in data_inventory.values():
+            for label in record['labels']:
+                for label_name, label_value in label.items():
+                    counts = label_stats.setdefault(label_name, dict())
+                    counts[label_value] = counts.get(label_value, 0) + 1
+        return label_stats
+
+    def testLabelStatsUpdated(self):
+        self.assertEqual(self.dinv._calc_label_stats(),
+                         self._scan_label_stats(self.inventory))
+        self.dinv.remove_records_with_label(['class'], ['elephant'])
+        self.dinv.remap_labels({'class': {'cat': 'dog'}})
+        self.assertEqual(self.dinv._calc_label_stats(),
+                         self._scan_label_stats(self.dinv.data_inventory))
+        splits = self.dinv.split_inventory_by_random_splits(
+            split_names=['train', 'test'], split_percent=[0.5, 0.5])
+        for split in splits.values():
+            self.assertEqual(split._calc_label_stats(),
+                             self._scan_label_stats(split.data_inventory))
+
+    def testExtendExistingLabelMapping(self):
+        dinv = DatasetInventoryMaster(
+            labels_numeric_map={'class': {'elephant': 0, 'zebra': 1}})
+        dinv.create_from_source(
+            'json', {'path': './test/test_files/json_data_file.json'})
+        dinv._map_labels_to_numeric()
+        mapping = dinv.labels_numeric_map['class']
+        self.assertEqual(mapping['elephant'], 0)
+        self.assertEqual(mapping['zebra'], 1)
+        self.assertEqual(mapping['cat'], 2)
+        self.assertEqual(mapping['dog'], 3)
+
+
+class DataInventoryColumnarTests(DataInventoryTests):
+    """ Test the Dataset Inventory with the columnar backend """
+
+    def setUp(self):
+        path = './test/test_files/json_data_file.json'
+        self.dinv = DatasetInventoryMaster(backend='columnar')
+        self.dinv.create_from_source('json', {'path': path})
+        self.inventory = self.dinv.data_inventory
+
+    def testSplitAndExport(self):
+        dinv_dict = DatasetInventoryMaster()
+        dinv_dict.create_from_source(
+            'json', {'path': './test/test_files/json_data_file.json'})
+        splits = self.dinv.split_inventory_by_random_splits(
+            split_names=['train', 'test'], split_percent=[0.5, 0.5])
+        splits_dict = dinv_dict.split_inventory_by_random_splits(
+            split_names=['train', 'test'], split_percent=[0.5, 0.5])
+        for split_name, split in splits.items():
+            self.assertIsInstance(split.data_inventory, InventoryView)
+            self.assertEqual(
+                dict(split.data_inventory.items()),
+                splits_dict[split_name].data_inventory)
+
 #    def testTFRecordFormat(self):
 #         self.dinv._get_tfr_record_format('single_species_standard')
 #         self.dinv._get_tfr_record_format('single_species_multi_color')
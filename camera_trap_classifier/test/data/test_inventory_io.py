@@ -0,0 +1,67 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+
+from camera_trap_classifier.data.inventory_io import (
+    iter_json_object, iter_records_from_file, write_records_to_file)
+from camera_trap_classifier.data.inventory import DatasetInventoryMaster
+
+
+class InventoryIOTests(unittest.TestCase):
+    """ Test streaming inventories from and to json (lines) files """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = './test/test_files/json_data_file.json'
+        with open(self.path, 'r') as f:
+            self.records = json.load(f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testStreamJsonObject(self):
+        # small chunks to decode values across chunk boundaries
+        for chunk_size in [1, 7, 1024]:
+            records = list(iter_json_object(self.path, chunk_size=chunk_size))
+            self.assertEqual(records, list(self.records.items()))
+
+    def testStreamNumbersAndEmptyObject(self):
+        path = os.path.join(self.tmp_dir, 'numbers.json')
+        with open(path, 'w') as f:
+            f.write(' {"a": 12345, "b" : [1, 2.5]}\n')
+        self.assertEqual(list(iter_json_object(path, chunk_size=2)),
+                         [('a', 12345), ('b', [1, 2.5])])
+        with open(path, 'w') as f:
+            f.write('{ }')
+        self.assertEqual(list(iter_json_object(path)), [])
+
+    def testWriteJsonIdenticalToJsonDump(self):
+        path = os.path.join(self.tmp_dir, 'inventory.json')
+        write_records_to_file(self.records.items(), path)
+        with open(path, 'r') as f:
+            self.assertEqual(f.read(), json.dumps(self.records))
+
+    def testJsonLinesRoundTrip(self):
+        path = os.path.join(self.tmp_dir, 'inventory.jsonl')
+        write_records_to_file(self.records.items(), path)
+        with open(path, 'r') as f:
+            self.assertEqual(len(f.readlines()), len(self.records))
+        self.assertEqual(list(iter_records_from_file(path)),
+                         list(self.records.items()))
+
+    def testInventoryFromJsonLines(self):
+        dinv = DatasetInventoryMaster()
+        dinv.create_from_source('json', {'path': self.path})
+        path = os.path.join(self.tmp_dir, 'inventory.jsonl')
+        dinv.export_to_json(path)
+        for backend in ['dict', 'columnar']:
+            dinv_jsonl = DatasetInventoryMaster(backend=backend)
+            dinv_jsonl.create_from_source('json', {'path': path})
+            self.assertEqual(dict(dinv_jsonl.data_inventory.items()),
+                             dinv.data_inventory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from camera_trap_classifier.data.inventory_snapshot import (
+    save_snapshot, load_snapshot, is_inventory_snapshot,
+    InvalidSnapshotError)
+from camera_trap_classifier.data.inventory_store import ColumnarInventoryStore
+from camera_trap_classifier.data.inventory import DatasetInventoryMaster
+
+
+class InventorySnapshotTests(unittest.TestCase):
+    """ Test saving and loading binary inventory snapshots """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'inventory.snapshot')
+        self.records = {
+            'single_species': {
+                'labels': [{'species': 'Zebra', 'count': '1'}],
+                'meta_data': {'season': '1', 'camera': 'A'},
+                'images': ['\\images\\4715\\all\\cat\\10296725_0.jpeg',
+                           '\\images\\4715\\all\\cat\\10296726_0.jpeg']},
+            'multi_species': {
+                'labels': [{'species': 'Zebra', 'count': '1'},
+                           {'species': 'Lion'}],
+                'images': ['/images/éléphant.jpeg']},
+            'nested_meta': {
+                'labels': [],
+                'meta_data': {'tags': ['a', 'b']},
+                'images': [],
+                'score': 0.5}}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testRoundTrip(self):
+        store = ColumnarInventoryStore()
+        for record_id, record in self.records.items():
+            store[record_id] = record
+        # removed records are not saved
+        store['removed'] = self.records['single_species']
+        del store['removed']
+        save_snapshot(self.path, store, {'species': {'Lion': 0, 'Zebra': 1}},
+                      {'single_species': 'train', 'multi_species': 'test'})
+        self.assertTrue(is_inventory_snapshot(self.path))
+        loaded, labels_numeric_map, split_assignments = \
+            load_snapshot(self.path)
+        self.assertEqual(list(loaded.keys()), list(self.records.keys()))
+        self.assertEqual(dict(loaded.items()), self.records)
+        self.assertEqual(labels_numeric_map,
+                         {'species': {'Lion': 0, 'Zebra': 1}})
+        self.assertEqual(split_assignments,
+                         {'single_species': 'train', 'multi_species': 'test'})
+        # the loaded store can be modified
+        loaded['new'] = self.records['multi_species']
+        self.assertEqual(loaded['new'], self.records['multi_species'])
+
+    def testCorruptSnapshot(self):
+        store = ColumnarInventoryStore()
+        for record_id, record in self.records.items():
+            store[record_id] = record
+        save_snapshot(self.path, store)
+        with open(self.path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last_byte = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last_byte[0] ^ 0xFF]))
+        self.assertRaises(InvalidSnapshotError, load_snapshot, self.path)
+
+    def testNotASnapshot(self):
+        path = './test/test_files/json_data_file.json'
+        self.assertFalse(is_inventory_snapshot(path))
+        self.assertRaises(InvalidSnapshotError, load_snapshot, path)
+
+    def testInventoryMaster(self):
+        dinv = DatasetInventoryMaster()
+        dinv.create_from_source(
+            'json', {'path': './test/test_files/json_data_file.json'})
+        splitted = dinv.split_inventory_by_random_splits(
+            split_names=['train', 'test'], split_percent=[0.5, 0.5])
+        dinv.export_to_snapshot(self.path)
+        for backend in ['dict', 'columnar']:
+            dinv_snapshot = DatasetInventoryMaster(backend=backend)
+            dinv_snapshot.create_from_snapshot(self.path)
+            self.assertEqual(dict(dinv_snapshot.data_inventory.items()),
+                             dinv.data_inventory)
+            self.assertEqual(dinv_snapshot.labels_numeric_map,
+                             dinv.labels_numeric_map)
+            splitted_snapshot = dinv_snapshot.split_inventory_by_assignments(
+                dinv_snapshot.split_assignments)
+            self.assertEqual(
+                {k: set(v.get_all_record_ids())
+                 for k, v in splitted_snapshot.items()},
+                {k: set(v.get_all_record_ids())
+                 for k, v in splitted.items()})
+
+
+if __name__ == '__main__':
+    unittest.main()
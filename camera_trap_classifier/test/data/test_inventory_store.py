@@ -0,0 +1,76 @@
+import unittest
+import json
+
+from camera_trap_classifier.data.inventory_store import (
+    ColumnarInventoryStore)
+
+
+class ColumnarInventoryStoreTests(unittest.TestCase):
+    """ Test storing inventory records in columns """
+
+    def setUp(self):
+        with open('./test/test_files/json_data_file.json', 'r') as f:
+            self.records = json.load(f)
+        self.records['other_formats'] = {
+            'images': ['ä/ö.jpg'],
+            'labels': [{'counts': '2', 'class': 'cat'}],
+            'meta_data': 'meta data as string',
+            'other': [1, 2]}
+
+    def testRoundTrip(self):
+        store = ColumnarInventoryStore()
+        for record_id, record in self.records.items():
+            store[record_id] = record
+        self.assertEqual(list(store.keys()), list(self.records.keys()))
+        for record_id, record in self.records.items():
+            self.assertEqual(store[record_id], record)
+            self.assertEqual(list(store[record_id].keys()),
+                             list(record.keys()))
+
+    def testRemoveAndReplace(self):
+        store = ColumnarInventoryStore()
+        expected = dict()
+        for i in range(0, 3000):
+            record = {'labels': [{'class': str(i % 7)}],
+                      'images': ['image_%s.jpg' % i],
+                      'meta_data': {'site': str(i % 3)}}
+            store[str(i)] = record
+            expected[str(i)] = record
+        for i in range(0, 3000, 2):
+            del store[str(i)]
+            del expected[str(i)]
+        for i in range(1, 3000, 4):
+            record = store[str(i)]
+            record['images'].append('other.jpg')
+            store[str(i)] = record
+            expected[str(i)] = record
+        self.assertEqual(len(store), len(expected))
+        self.assertEqual(dict(store.items()), expected)
+        # removed rows are compacted
+        self.assertLess(store._n_rows, 3000)
+
+    def testFromRecords(self):
+        n_records = len(self.records)
+        store = ColumnarInventoryStore.from_records(self.records)
+        self.assertEqual(len(store), n_records)
+        self.assertEqual(len(self.records), 0)
+
+    def testRemapLabelValues(self):
+        store = ColumnarInventoryStore()
+        for i in range(0, 6):
+            store[str(i)] = {'labels': [{'class': 'cat'}, {'class': 'dog'}],
+                             'images': ['image_%s.jpg' % i]}
+        counts = store.remap_label_values(
+            'class', {'cat': 'mammal'}, record_ids=['1', '3'])
+        self.assertEqual(counts, {'cat': 2})
+        for i in range(0, 6):
+            first_label = 'mammal' if str(i) in ('1', '3') else 'cat'
+            self.assertEqual(store[str(i)]['labels'],
+                             [{'class': first_label}, {'class': 'dog'}])
+        counts = store.remap_label_values('class', {'cat': 'mammal'})
+        self.assertEqual(counts, {'cat': 4})
+        self.assertEqual(store.remap_label_values('other', {'a': 'b'}), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+import os
+import json
+import shutil
+import tempfile
+
+from camera_trap_classifier.data.inventory import DatasetInventoryMaster
+from camera_trap_classifier.data.inventory_stream import (
+    DatasetInventoryStream)
+from camera_trap_classifier.data.utils import (
+    export_dict_to_json, get_tfr_manifest_path, read_json)
+
+
+class _Writer(object):
+    """ Writes the record ids to a file instead of TFRecords """
+    def __init__(self):
+        self.files = dict()
+        self.records = dict()
+
+    def encode_to_tfr(self, tfrecord_dict, output_dir, file_prefix,
+                      **kwargs):
+        path = os.path.join(output_dir, '%s_001-of-001.tfrecord' % file_prefix)
+        with open(path, 'w') as f:
+            json.dump(sorted(tfrecord_dict.keys()), f)
+        n_records = len(tfrecord_dict)
+        export_dict_to_json(
+            {'file_name': os.path.basename(path),
+             'file_size': os.path.getsize(path),
+             'n_records': n_records},
+            get_tfr_manifest_path(path))
+        export_dict_to_json(
+            {'n_records': n_records, 'n_records_written': n_records,
+             'seconds': 1, 'settings': {}, 'stages': {},
+             'slowest_images': []},
+            os.path.join(output_dir, '%s_writer_stats.json' % file_prefix))
+        self.files[file_prefix] = [path]
+        self.records.update(tfrecord_dict)
+
+
+class DatasetInventoryStreamTests(unittest.TestCase):
+    """ Test streaming records from a source to TFRecord files """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.params = {'path': './test/test_files/json_data_file.json'}
+        self.split_names = ['train', 'test']
+        self.split_percent = [0.5, 0.5]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _read_shards(self, file_prefix):
+        shards = sorted(x for x in os.listdir(self.tmp_dir)
+                        if x.startswith(file_prefix + '_') and
+                        x.endswith('.tfrecord'))
+        record_ids = list()
+        for shard in shards:
+            with open(os.path.join(self.tmp_dir, shard), 'r') as f:
+                record_ids += json.load(f)
+        return shards, record_ids
+
+    def testIdenticalToMaster(self):
+        dinv = DatasetInventoryMaster()
+        dinv.create_from_source('json', self.params)
+        dinv.remove_multi_label_records()
+        dinv.remove_records_with_label(['class'], ['elephant'])
+        splitted = dinv.split_inventory_by_random_splits(
+            split_names=self.split_names, split_percent=self.split_percent)
+
+        dinv_stream = DatasetInventoryStream()
+        dinv_stream.create_from_source('json', self.params)
+        dinv_stream.remove_multi_label_records()
+        dinv_stream.remove_records_with_label(['class'], ['elephant'])
+        dinv_stream.split_by_random_splits(
+            split_names=self.split_names, split_percent=self.split_percent)
+        writer = _Writer()
+        n_records = dinv_stream.export_to_tfrecord(
+            writer, self.tmp_dir, max_records_per_file=2)
+
+        self.assertEqual(dinv_stream.labels_numeric_map,
+                         dinv.labels_numeric_map)
+        self.assertEqual(dinv_stream._calc_label_stats(),
+                         dinv._calc_label_stats())
+        for split_name, split_data in splitted.items():
+            shards, record_ids = self._read_shards(split_name)
+            self.assertEqual(sorted(record_ids),
+                             sorted(split_data.get_all_record_ids()))
+            self.assertEqual(n_records[split_name], len(record_ids))
+            for record_id in record_ids:
+                self.assertEqual(
+                    writer.records[record_id],
+                    split_data._convert_record_to_tfr_format(
+                        record_id, split_data.data_inventory[record_id]))
+
+    def testShardsAndManifests(self):
+        dinv_stream = DatasetInventoryStream()
+        dinv_stream.create_from_source('json', self.params)
+        dinv_stream.split_by_random_splits(
+            split_names=['train'], split_percent=[1])
+        writer = _Writer()
+        n_records = dinv_stream.export_to_tfrecord(
+            writer, self.tmp_dir, max_records_per_file=2)
+        shards, record_ids = self._read_shards('train')
+        n_files = (n_records['train'] + 1) // 2
+        self.assertEqual(shards, ['train_%03d-of-%03d.tfrecord' %
+                                  (i + 1, n_files)
+                                  for i in range(0, n_files)])
+        for shard in shards:
+            manifest = read_json(
+                get_tfr_manifest_path(os.path.join(self.tmp_dir, shard)))
+            self.assertEqual(manifest['file_name'], shard)
+        stats = read_json(
+            os.path.join(self.tmp_dir, 'train_writer_stats.json'))
+        self.assertEqual(stats['n_records'], n_records['train'])
+        # only the shards, their manifests and the stats remain
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 2 * n_files + 1)
+        # existing files are not overwritten
+        self.assertRaises(ValueError, dinv_stream.export_to_tfrecord,
+                          writer, self.tmp_dir, max_records_per_file=2,
+                          overwrite_existing_files=False)
+
+    def testReadOnceWithLabelMapping(self):
+        dinv_stream = DatasetInventoryStream(
+            labels_numeric_map={'class': {'zebra': 0, 'elephant': 1}})
+        dinv_stream.create_from_source('json', self.params)
+        dinv_stream.remove_multi_label_records()
+        dinv_stream.keep_only_records_with_label(
+            ['class', 'class'], ['elephant', 'cat'])
+        dinv_stream.split_by_random_splits(
+            split_names=['train'], split_percent=[1])
+        dinv_stream.export_to_tfrecord(_Writer(), self.tmp_dir)
+        self.assertEqual(dinv_stream.labels_numeric_map['class'],
+                         {'zebra': 0, 'elephant': 1, 'cat': 2})
+        self.assertEqual(set(dinv_stream._calc_label_stats()['class']),
+                         {'elephant', 'cat'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from camera_trap_classifier.data.label_index import LabelIndex
+
+
+class LabelIndexTests(unittest.TestCase):
+    """ Test the inverted label index """
+
+    def setUp(self):
+        self.records = {
+            'two_zebras': {'labels': [{'species': 'zebra'},
+                                      {'species': 'zebra'}]},
+            'zebra_elephant': {'labels': [{'species': 'zebra'},
+                                          {'species': 'elephant'}]}}
+        self.label_index = LabelIndex.from_inventory(self.records)
+
+    def testCountRepeatedLabels(self):
+        self.assertEqual(self.label_index.get_label_counts(),
+                         {'species': {'zebra': 3, 'elephant': 1}})
+        self.assertEqual(self.label_index.get_record_ids('species', 'zebra'),
+                         {'two_zebras', 'zebra_elephant'})
+
+    def testRemoveRecordWithRepeatedLabel(self):
+        self.label_index.remove_record(
+            'zebra_elephant', self.records['zebra_elephant'])
+        self.assertEqual(self.label_index.get_label_counts(),
+                         {'species': {'zebra': 2}})
+        # the last record with the repeated label
+        self.label_index.remove_record(
+            'two_zebras', self.records['two_zebras'])
+        self.assertEqual(self.label_index.get_label_counts(), {})
+        self.assertEqual(
+            self.label_index.get_record_ids('species', 'zebra'), set())
+        self.assertEqual(self.label_index.get_label_names(), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
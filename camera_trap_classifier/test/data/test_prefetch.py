@@ -0,0 +1,46 @@
+import unittest
+import time
+
+from camera_trap_classifier.data.prefetch import ImagePrefetcher
+
+
+class ImagePrefetcherTests(unittest.TestCase):
+    """ Test prefetching images with threads """
+
+    def setUp(self):
+        self.images = {'a': b'0' * 10, 'b': b'0' * 20, 'c': b'0' * 30}
+
+    def _fetch(self, path):
+        # simulate slower reads for earlier images
+        time.sleep(0.01 * (3 - len(self.images[path]) // 10))
+        return self.images[path]
+
+    def testOrderIsPreserved(self):
+        prefetcher = ImagePrefetcher(self._fetch, n_threads=3)
+        tasks = [('r1', ['a', 'b']), ('r2', ['c']), ('r3', ['b', 'a'])]
+        results = list(prefetcher.imap(tasks))
+        self.assertEqual(
+            results,
+            [('r1', [self.images['a'], self.images['b']]),
+             ('r2', [self.images['c']]),
+             ('r3', [self.images['b'], self.images['a']])])
+
+    def testErrorsAreReturned(self):
+        prefetcher = ImagePrefetcher(self._fetch, n_threads=2)
+        results = list(prefetcher.imap([('r1', ['a', 'missing'])]))
+        self.assertEqual(results[0][1][0], self.images['a'])
+        self.assertIsInstance(results[0][1][1], KeyError)
+
+    def testBufferIsReleased(self):
+        prefetcher = ImagePrefetcher(self._fetch, n_threads=2, max_bytes=15)
+        tasks = [(str(i), ['c']) for i in range(10)]
+        stream = prefetcher.imap(tasks)
+        next(stream)
+        stream.close()
+        self.assertEqual(prefetcher._buffered_bytes, 0)
+        self.assertEqual(len(list(prefetcher.imap(tasks))), 10)
+        self.assertEqual(prefetcher._buffered_bytes, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
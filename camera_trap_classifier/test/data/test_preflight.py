@@ -0,0 +1,90 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+from camera_trap_classifier.data.preflight import (
+    read_image_header, inspect_image, ImageValidator, InvalidImageError)
+from camera_trap_classifier.data.inventory import DatasetInventoryMaster
+
+
+class PreflightTests(unittest.TestCase):
+    """ Test the pre-flight validation of images """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.jpeg_path = './test/test_images/Cats/cat0.jpg'
+        self.png_path = './test/test_images/Dogs/dog3200.png'
+        self.bmp_path = './test/test_images/Dogs/dog3203.bmp'
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_tmp_file(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def testReadHeaders(self):
+        for path, image_format in [(self.jpeg_path, 'jpeg'),
+                                   (self.png_path, 'png'),
+                                   (self.bmp_path, 'bmp')]:
+            header = read_image_header(path)
+            self.assertEqual(header['format'], image_format)
+            self.assertGreater(header['width'], 0)
+            self.assertGreater(header['height'], 0)
+
+    def testTruncatedJpeg(self):
+        with open(self.jpeg_path, 'rb') as f:
+            content = f.read()
+        path = self._write_tmp_file('truncated.jpg', content[0:5000])
+        self.assertRaises(InvalidImageError, read_image_header, path)
+
+    def testInvalidImages(self):
+        empty_path = self._write_tmp_file('empty.jpg', b'')
+        text_path = self._write_tmp_file('text.jpg', b'not an image')
+        missing_path = os.path.join(self.tmp_dir, 'missing.jpg')
+        for path in [empty_path, text_path, missing_path]:
+            image_info, reason = inspect_image(path)
+            self.assertIsNone(image_info)
+            self.assertIsInstance(reason, str)
+
+    def testValidateAndPruneInventory(self):
+        text_path = self._write_tmp_file('text.jpg', b'not an image')
+        dinv = DatasetInventoryMaster()
+        dinv.data_inventory = {
+            'valid': {'images': [self.jpeg_path],
+                      'labels': [{'class': 'cat'}]},
+            'partially_valid': {'images': [self.png_path, text_path],
+                                'labels': [{'class': 'dog'}]},
+            'invalid': {'images': [text_path],
+                        'labels': [{'class': 'dog'}]}}
+        validator = ImageValidator(n_threads=2)
+        validator.validate_inventory(dinv)
+        self.assertEqual(set(validator.quarantine.keys()), {text_path})
+        self.assertEqual(set(validator.image_info.keys()),
+                         {self.jpeg_path, self.png_path})
+        self.assertEqual(
+            validator.image_info[self.jpeg_path]['file_size'],
+            os.path.getsize(self.jpeg_path))
+
+        dinv.remove_images(validator.quarantine.keys())
+        self.assertEqual(set(dinv.data_inventory.keys()),
+                         {'valid', 'partially_valid'})
+        self.assertEqual(dinv.data_inventory['partially_valid']['images'],
+                         [self.png_path])
+
+    def testImageRootPath(self):
+        # inventory paths are relative to the root, even with a leading sep
+        image_path = os.sep + os.path.join('Cats', 'cat0.jpg')
+        validator = ImageValidator(
+            image_root_path='./test/test_images', n_threads=2)
+        validator.validate_images([image_path])
+        self.assertEqual(validator.quarantine, {})
+        self.assertEqual(validator.image_info[image_path]['file_size'],
+                         os.path.getsize(self.jpeg_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
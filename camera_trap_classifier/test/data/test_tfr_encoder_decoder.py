@@ -70,3 +70,43 @@ class testTFREncoderDecoder(tf.test.TestCase):
             paths = actual['image_paths'].eval()
             self.assertEqual(paths[0].decode("utf-8"), record_data['image_paths'][0])
             self.assertEqual(paths[1].decode("utf-8"), record_data['image_paths'][1])
+
+
+class testTFREncoderDecoderRaw(tf.test.TestCase):
+
+    def setUp(self):
+        self.image_shape = (2, 3, 3)
+        self.coder_encoder = DefaultTFRecordEncoderDecoder(
+            image_format='raw', image_shape=self.image_shape)
+        self.image = numpy.arange(18, dtype=numpy.uint8).reshape(
+            self.image_shape)
+        self.default_record = {
+            'id': 'test_record', 'n_images': 1,
+            'n_labels': 1,
+            'image_paths': ['./test/test_images/Cats/cat0.jpg'],
+            'meta_data': 'record_meta_data',
+            'labelstext': 'class:cat',
+            'label/class': ['cat'],
+            'label_num/class': [0],
+            'images': [self.image.tobytes()]}
+
+    def testEncodingDecodingRaw(self):
+        record_data = copy.deepcopy(self.default_record)
+        serialized = self.coder_encoder.encode_record(record_data)
+
+        decoder = DefaultTFRecordEncoderDecoder(image_format='raw')
+        images, labels = decoder.decode_record(
+                serialized,
+                output_labels=['class'],
+                image_pre_processing_args={},
+                return_only_ml_data=False)
+
+        self.assertNotIn('image_height', labels)
+        with self.test_session():
+            self.assertAllEqual(images['images'].eval(), self.image)
+
+    def testEncodingInvalidRawSize(self):
+        record_data = copy.deepcopy(self.default_record)
+        record_data['images'] = [b'IMAGEBYTES_IMAGE1']
+        self.assertRaises(ValueError,
+                          self.coder_encoder.encode_record, record_data)
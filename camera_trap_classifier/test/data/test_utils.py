@@ -5,12 +5,30 @@ from camera_trap_classifier.data.utils import (
     assign_hash_to_zero_one,
     calc_n_batches_per_epoch,
     clean_input_path,
+    get_full_image_path,
+    map_images_in_threads,
     randomly_split_dataset,
+    id_to_zero_one,
+    ids_to_zero_one,
+    _assign_zero_one_to_split,
+    _balanced_sampling,
     generate_synthetic_data,
-    generate_synthetic_batch
+    generate_synthetic_batch,
+    slice_generator_by_weights,
+    limit_slice_length,
+    detect_tfr_compression_type,
+    get_tfr_options,
+    n_records_in_tfr,
+    n_records_in_tfr_parallel,
+    read_label_histogram_from_manifests,
+    detect_tfr_image_format,
+    get_tfr_manifest_path,
+    export_dict_to_json
 )
 import random
 import os
+import shutil
+import tempfile
 
 
 class RandomSplitterTest(unittest.TestCase):
@@ -53,6 +71,66 @@ class RandomSplitterTest(unittest.TestCase):
         self.assertEqual(n_val, 2)
 
 
+class BatchedSplitterTest(unittest.TestCase):
+    """ Test Batched Split Assignments are Identical to Single Ids """
+
+    def setUp(self):
+        self.ids = [str(i) for i in range(0, 1000)] + \
+            ['capture_%s' % random.getrandbits(64) for _ in range(0, 1000)]
+        self.split_names = ['train', 'test', 'val']
+        self.split_percent = [0.5, 0.3, 0.2]
+
+    def testIdenticalZeroOne(self):
+        for n_processes in [1, 2]:
+            values = ids_to_zero_one(
+                self.ids, n_processes=n_processes, chunk_size=300)
+            self.assertEqual(values.tolist(),
+                             [id_to_zero_one(x) for x in self.ids])
+
+    def testIdenticalSplits(self):
+        expected = {x: _assign_zero_one_to_split(
+                        id_to_zero_one(x), self.split_percent,
+                        self.split_names)
+                    for x in self.ids}
+        splits = randomly_split_dataset(
+            self.ids, self.split_names, self.split_percent, n_processes=2)
+        self.assertEqual(splits, expected)
+
+
+class BalancedSamplingTests(unittest.TestCase):
+    """ Test Balanced Sampling of Ids per Label """
+
+    def setUp(self):
+        labels = ['cat', 'dog', 'dog', 'zebra', 'zebra', 'zebra']
+        self.id_to_label = {
+            str(i): labels[i % len(labels)] for i in range(0, 600)}
+
+    def _count(self, ids):
+        counts = dict()
+        for record_id in ids:
+            label = self.id_to_label[record_id]
+            counts[label] = counts.get(label, 0) + 1
+        return counts
+
+    def testSampleToMinorityClass(self):
+        sampled = _balanced_sampling(self.id_to_label)
+        self.assertEqual(self._count(sampled),
+                         {'cat': 100, 'dog': 100, 'zebra': 100})
+        self.assertEqual(sampled, _balanced_sampling(self.id_to_label))
+        self.assertNotEqual(
+            sampled, _balanced_sampling(self.id_to_label, random_seed=1))
+
+    def testMaxPerClass(self):
+        sampled = _balanced_sampling(self.id_to_label, max_per_class=150)
+        self.assertEqual(self._count(sampled),
+                         {'cat': 100, 'dog': 150, 'zebra': 150})
+        sampled = _balanced_sampling(
+            self.id_to_label, max_per_class={'zebra': 50})
+        self.assertEqual(self._count(sampled),
+                         {'cat': 100, 'dog': 200, 'zebra': 50})
+        self.assertEqual(_balanced_sampling(dict()), set())
+
+
 class IdHasherTests(unittest.TestCase):
     """ Test Hash Function """
     def setUp(self):
@@ -150,6 +228,21 @@ class PathCleaningTests(unittest.TestCase):
         self.assertEqual(self.normal_path,
                          clean_input_path(self.no_path_sep_at_end))
 
+    def testFullImagePath(self):
+        image_path = os.path.join(self.os_sep + "cats", "cat0.jpg")
+        self.assertEqual(get_full_image_path(image_path, self.normal_path),
+                         os.path.join(self.normal_path, "cats", "cat0.jpg"))
+        self.assertEqual(get_full_image_path(image_path), image_path)
+
+    def testMapImagesInThreads(self):
+        image_paths = ["/b.jpg", "a.jpg", "c.jpg"]
+        results = map_images_in_threads(
+            lambda x: x.upper(), image_paths, self.normal_path, n_threads=2)
+        self.assertEqual(
+            list(results),
+            [(x, os.path.join(self.normal_path, x.lstrip(os.sep)).upper())
+             for x in image_paths])
+
 
 class GenerateSyntheticDataTests(tf.test.TestCase):
     """ Test Synthetic Data Generation """
@@ -186,3 +279,110 @@ class GenerateSyntheticDataTests(tf.test.TestCase):
         self.assertIsInstance(dataset, tf.data.Dataset)
         # self.assertEqual(dataset.output_shapes[0]['images'],
         # (None,) + self.image_shape)
+
+
+class SliceByWeightsTests(unittest.TestCase):
+    """ Test dividing weighted sequences into blocks """
+
+    def testEqualWeights(self):
+        slices = list(slice_generator_by_weights([1] * 10, 2))
+        self.assertEqual(slices, [(0, 5), (5, 10)])
+
+    def testBalancedByWeight(self):
+        weights = [10, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1]
+        slices = list(slice_generator_by_weights(weights, 2))
+        self.assertEqual(slices, [(0, 1), (1, 11)])
+
+    def testNoEmptyBlocks(self):
+        weights = [100, 1, 1]
+        slices = list(slice_generator_by_weights(weights, 3))
+        self.assertEqual(slices, [(0, 1), (1, 2), (2, 3)])
+
+    def testMoreBlocksThanElements(self):
+        slices = list(slice_generator_by_weights([5, 5], 5))
+        self.assertEqual(slices, [(0, 1), (1, 2)])
+        self.assertEqual(list(slice_generator_by_weights([], 3)), [(0, 0)])
+        self.assertEqual(list(slice_generator_by_weights([1], 0)), [])
+
+    def testLimitSliceLength(self):
+        slices = list(limit_slice_length([(0, 25), (25, 30)], 10))
+        self.assertEqual(slices, [(0, 8), (8, 17), (17, 25), (25, 30)])
+
+
+class TFRCompressionTests(unittest.TestCase):
+    """ Test detecting the compression of TFRecord files """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def testDetectCompressionType(self):
+        for compression_type in ['', 'GZIP', 'ZLIB']:
+            path = os.path.join(self.tmp_dir, 'test_%s.tfrecord' %
+                                compression_type)
+            with tf.python_io.TFRecordWriter(
+                    path, options=get_tfr_options(compression_type)) as w:
+                for i in range(0, 5):
+                    w.write(b'record' * i)
+            self.assertEqual(detect_tfr_compression_type(path),
+                             compression_type)
+            self.assertEqual(n_records_in_tfr(path), 5)
+
+    def testEmptyFileIsUncompressed(self):
+        path = os.path.join(self.tmp_dir, 'empty.tfrecord')
+        open(path, 'wb').close()
+        self.assertEqual(detect_tfr_compression_type(path), '')
+
+
+class ManifestTests(unittest.TestCase):
+    """ Test using the manifests of TFRecord files """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.tfr_paths = list()
+        for i in range(0, 2):
+            path = os.path.join(self.tmp_dir, 'test_%s.tfrecord' % i)
+            with tf.python_io.TFRecordWriter(path) as w:
+                for _ in range(0, 5):
+                    w.write(b'record')
+            self.tfr_paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_manifest(self, path, n_records, file_size=None):
+        manifest = {
+            'file_size': file_size or os.path.getsize(path),
+            'n_records': n_records,
+            'label_histogram': {'species': {'0': n_records}}}
+        export_dict_to_json(manifest, get_tfr_manifest_path(path))
+
+    def testCountFromManifest(self):
+        # deliberately wrong counts to check the manifest is used
+        self._write_manifest(self.tfr_paths[0], 3)
+        self.assertEqual(n_records_in_tfr(self.tfr_paths), 3 + 5)
+        self.assertEqual(n_records_in_tfr_parallel(self.tfr_paths), 3 + 5)
+
+    def testIgnoreInvalidManifest(self):
+        self._write_manifest(self.tfr_paths[0], 3, file_size=1)
+        self.assertEqual(n_records_in_tfr(self.tfr_paths), 10)
+
+    def testLabelHistogram(self):
+        self._write_manifest(self.tfr_paths[0], 3)
+        self.assertIsNone(read_label_histogram_from_manifests(self.tfr_paths))
+        self._write_manifest(self.tfr_paths[1], 2)
+        self.assertEqual(read_label_histogram_from_manifests(self.tfr_paths),
+                         {'species': {'0': 5}})
+
+    def testImageFormat(self):
+        self.assertEqual(detect_tfr_image_format(self.tfr_paths), 'jpeg')
+        for path in self.tfr_paths:
+            manifest = {'file_size': os.path.getsize(path), 'n_records': 5,
+                        'image_format': 'raw'}
+            export_dict_to_json(manifest, get_tfr_manifest_path(path))
+        self.assertEqual(detect_tfr_image_format(self.tfr_paths), 'raw')
+        self._write_manifest(self.tfr_paths[0], 5)
+        self.assertRaises(ValueError, detect_tfr_image_format,
+                          self.tfr_paths)
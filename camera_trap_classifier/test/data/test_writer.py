@@ -0,0 +1,203 @@
+import unittest
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+from camera_trap_classifier.data.writer import DatasetWriter, SerializerPool
+from camera_trap_classifier.data.writer_stats import WriterStats
+from camera_trap_classifier.data.utils import (
+    export_dict_to_json, get_tfr_manifest_path)
+
+
+class IncrementalExportTests(unittest.TestCase):
+    """ Test finding the records to write in incremental exports """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.writer = DatasetWriter(lambda x: x)
+        self.writer.record_hashes = {'a': 'ha', 'b': 'hb', 'c': 'hc',
+                                     'd': 'hd'}
+        self.record_ids = sorted(self.writer.record_hashes.keys())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_shard(self, file_name, records, with_manifest=True):
+        """ Write a shard with a manifest of records [(id, hash)] """
+        path = os.path.join(self.tmp_dir, file_name)
+        with open(path, 'wb') as f:
+            f.write(b'records')
+        if with_manifest:
+            export_dict_to_json(
+                {'file_name': file_name,
+                 'file_size': os.path.getsize(path),
+                 'n_records': len(records),
+                 'records': [{'id': x, 'hash': h} for x, h in records]},
+                get_tfr_manifest_path(path))
+        return path
+
+    def _find_records(self):
+        return self.writer._find_records_to_write_incrementally(
+            self.tmp_dir, 'train', self.record_ids)
+
+    def testUnchangedRecords(self):
+        shard_1 = self._write_shard(
+            'train_001-of-002.tfrecord', [('a', 'ha'), ('b', 'hb')])
+        shard_2 = self._write_shard(
+            'train_002-of-002.tfrecord', [('c', 'hc'), ('d', 'hd')])
+        valid_shards, to_write, run_id = self._find_records()
+        self.assertEqual(valid_shards, [shard_1, shard_2])
+        self.assertEqual(to_write, [])
+        self.assertEqual(run_id, 1)
+
+    def testChangedAndNewRecords(self):
+        shard_1 = self._write_shard(
+            'train_001-of-002.tfrecord', [('a', 'ha'), ('b', 'old')])
+        shard_2 = self._write_shard(
+            'train_r001_001-of-001.tfrecord', [('c', 'hc')])
+        valid_shards, to_write, run_id = self._find_records()
+        self.assertEqual(valid_shards, [shard_2])
+        self.assertEqual(to_write, ['a', 'b', 'd'])
+        self.assertEqual(run_id, 2)
+        self.assertFalse(os.path.exists(shard_1))
+        self.assertFalse(os.path.exists(get_tfr_manifest_path(shard_1)))
+
+    def testRemovedRecords(self):
+        del self.writer.record_hashes['b']
+        self.record_ids.remove('b')
+        shard_1 = self._write_shard(
+            'train_001-of-002.tfrecord', [('a', 'ha'), ('b', 'hb')])
+        shard_2 = self._write_shard(
+            'train_002-of-002.tfrecord', [('c', 'hc'), ('d', 'hd')])
+        valid_shards, to_write, _ = self._find_records()
+        self.assertEqual(valid_shards, [shard_2])
+        self.assertEqual(to_write, ['a'])
+        self.assertFalse(os.path.exists(shard_1))
+
+    def testShardsWithoutManifest(self):
+        shard_1 = self._write_shard(
+            'train_001-of-002.tfrecord', [('a', 'ha'), ('b', 'hb')],
+            with_manifest=False)
+        shard_2 = self._write_shard(
+            'train_002-of-002.tfrecord', [('c', 'hc'), ('d', 'hd')])
+        temp_file = self._write_shard(
+            'train_003-of-003.tfrecord_temp', [], with_manifest=False)
+        valid_shards, to_write, _ = self._find_records()
+        self.assertEqual(valid_shards, [shard_2])
+        self.assertEqual(to_write, ['a', 'b'])
+        self.assertFalse(os.path.exists(shard_1))
+        self.assertFalse(os.path.exists(temp_file))
+        # shards of other prefixes are not touched
+        other = self._write_shard('test_001-of-001.tfrecord', [],
+                                  with_manifest=False)
+        self._find_records()
+        self.assertTrue(os.path.exists(other))
+
+
+class _CountingRecords(dict):
+    """ Records counting how often they are converted """
+    def __init__(self, *args, **kwargs):
+        super(_CountingRecords, self).__init__(*args, **kwargs)
+        self.n_converted = 0
+
+    def __getitem__(self, key):
+        self.n_converted += 1
+        return super(_CountingRecords, self).__getitem__(key)
+
+    def get_image_paths(self, record_id):
+        return dict.__getitem__(self, record_id)['image_paths']
+
+
+class ShardRecordTests(unittest.TestCase):
+    """ Test converting the records of a shard only once """
+
+    def setUp(self):
+        self.writer = DatasetWriter(lambda x: x)
+        self.writer.image_root_path = None
+        self.writer.image_pre_processing_fun = None
+        self.writer.image_pre_processing_args = None
+        self.writer.tfrecord_dict = _CountingRecords(
+            {x: {'id': x, 'image_paths': [x + '.jpg']} for x in 'abc'})
+
+    def testImagePathsWithoutConversion(self):
+        self.assertEqual(self.writer._get_image_paths('a'), ['a.jpg'])
+        self.assertEqual(self.writer.tfrecord_dict.n_converted, 0)
+
+    def testConvertOncePerShard(self):
+        self.writer._convert_shard_records(['a', 'b'])
+        for _ in range(0, 3):
+            for record_id in ['a', 'b']:
+                self.assertEqual(
+                    self.writer._get_record(record_id)['id'], record_id)
+                self.writer._get_image_paths(record_id)
+        self.assertEqual(self.writer.tfrecord_dict.n_converted, 2)
+        # the records of the shard are hashed for its manifest
+        self.assertEqual(set(self.writer.record_hashes.keys()), {'a', 'b'})
+        self.assertEqual(self.writer._get_record('c')['id'], 'c')
+        self.assertEqual(self.writer.tfrecord_dict.n_converted, 3)
+
+
+class _Writer(DatasetWriter):
+    """ Serializes records to their id without reading images """
+    def _serialize_record(self, record_data, prefetched_images=None):
+        time.sleep(record_data.get('seconds', 0))
+        if record_data.get('kill', False):
+            os._exit(1)
+        if record_data.get('fail', False):
+            raise ValueError("failed to serialize")
+        return record_data['id'].encode('utf-8')
+
+
+class SerializerPoolTests(unittest.TestCase):
+    """ Test serializing records in worker processes """
+
+    def setUp(self):
+        self.writer = _Writer(lambda x: x)
+        self.writer.stats = WriterStats()
+        # later records finish first
+        self.writer.tfrecord_dict = {
+            str(i): {'id': str(i), 'seconds': 0.01 * (10 - i)}
+            for i in range(0, 10)}
+        self.pool = None
+
+    def tearDown(self):
+        if self.pool is not None:
+            self.pool.close()
+
+    def _start_pool(self):
+        # the workers are forked with the records
+        self.pool = SerializerPool(self.writer, n_processes=3,
+                                   max_in_flight=4)
+        self.pool.poll_timeout = 0.2
+
+    def testOrder(self):
+        self.writer.tfrecord_dict['5']['fail'] = True
+        record_ids = [str(i) for i in range(0, 10)]
+        self._start_pool()
+        results = list(self.pool.imap((x, None) for x in record_ids))
+        self.assertEqual([x[0] for x in results], record_ids)
+        self.assertEqual(
+            [x[1] for x in results],
+            [x.encode('utf-8') if x != '5' else None for x in record_ids])
+
+    def testWorkerDied(self):
+        self.writer.tfrecord_dict['3']['kill'] = True
+        self._start_pool()
+        with self.assertRaises(RuntimeError):
+            list(self.pool.imap((str(i), None) for i in range(0, 10)))
+
+    def testClose(self):
+        self._start_pool()
+        list(self.pool.imap((str(i), None) for i in range(0, 3)))
+        self.pool.close()
+        for p in self.pool.processes:
+            self.assertFalse(p.is_alive())
+        self.assertEqual(
+            set(multiprocessing.active_children()) &
+            set(self.pool.processes), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from camera_trap_classifier.data.writer_stats import WriterStats
+
+
+class WriterStatsTests(unittest.TestCase):
+    """ Test the stage timers of the dataset writer """
+
+    def testTimeStage(self):
+        stats = WriterStats()
+        with stats.time('read') as measurement:
+            measurement['bytes'] = 10
+        with stats.time('read'):
+            pass
+        stages = stats.to_dict()['stages']
+        self.assertEqual(stages['read']['count'], 2)
+        self.assertEqual(stages['read']['bytes'], 10)
+        self.assertGreaterEqual(stages['read']['seconds'], 0)
+
+    def testTimeIterator(self):
+        stats = WriterStats()
+        self.assertEqual(list(stats.time_iterator(range(3), 'wait')),
+                         [0, 1, 2])
+        self.assertEqual(stats.to_dict()['stages']['wait']['count'], 3)
+
+    def testSlowestImages(self):
+        stats = WriterStats(n_slowest=2)
+        for seconds, path in [(1, 'a'), (3, 'b'), (2, 'c'), (0.5, 'd')]:
+            if stats.is_among_slowest(seconds):
+                stats.add_image(seconds, path, 100)
+        self.assertEqual(
+            [x['path'] for x in stats.to_dict()['slowest_images']],
+            ['b', 'c'])
+
+    def testMergeAndPop(self):
+        stats = WriterStats(n_slowest=2)
+        other = WriterStats()
+        other.add('process', 1.0, n_bytes=5)
+        other.add_image(1.0, 'a', 10)
+        stats.add('process', 2.0, n_bytes=5)
+        stats.merge(other.pop())
+        self.assertEqual(other.to_dict(),
+                         {'stages': {}, 'slowest_images': []})
+        stats_dict = stats.to_dict()
+        self.assertEqual(stats_dict['stages']['process'],
+                         {'seconds': 3.0, 'count': 2, 'bytes': 10})
+        self.assertEqual(stats_dict['slowest_images'][0]['path'], 'a')
+
+
+if __name__ == '__main__':
+    unittest.main()
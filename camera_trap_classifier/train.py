@@ -46,6 +46,7 @@ from camera_trap_classifier.data.image import preprocess_image
 from camera_trap_classifier.data.utils import (
     calc_n_batches_per_epoch, export_dict_to_json, read_json,
     n_records_in_tfr_dataset, find_files_with_ending,
+    read_label_histogram_from_manifests, detect_tfr_image_format,
     get_most_recent_file_from_files, find_tfr_files_pattern_subdir)
 
 
@@ -366,7 +367,11 @@ def main():
 
     logger.info("Start Calculating Image Stats")
 
-    tfr_encoder_decoder = DefaultTFRecordEncoderDecoder()
+    image_format = detect_tfr_image_format(tfr_train + tfr_val)
+    logger.info("Image format of the TFR files: %s" % image_format)
+
+    tfr_encoder_decoder = DefaultTFRecordEncoderDecoder(
+        image_format=image_format)
     data_reader = DatasetReader(tfr_encoder_decoder.decode_record)
 
     # Calculate Dataset Image Means and Stdevs for a dummy batch
@@ -462,6 +467,11 @@ def main():
         n_records_val, args['batch_size'])
 
     logger.info("Found %s records in the training set" % n_records_train)
+    label_histogram_train = read_label_histogram_from_manifests(tfr_train)
+    if label_histogram_train is not None:
+        for label in output_labels:
+            logger.info("Numeric labels of %s in the training set: %s" %
+                        (label, label_histogram_train.get(label)))
     logger.debug("Using %s batches/epoch for the training set" %
                  n_batches_per_epoch_train)
     logger.info("Found %s records in the validation set" % n_records_val)
@@ -597,7 +607,8 @@ def main():
 
         tf.keras.backend.clear_session()
 
-        tfr_encoder_decoder = DefaultTFRecordEncoderDecoder()
+        tfr_encoder_decoder = DefaultTFRecordEncoderDecoder(
+            image_format=detect_tfr_image_format(tfr_test))
         logger.info("Create Dataset Reader")
         data_reader = DatasetReader(tfr_encoder_decoder.decode_record)
 
@@ -0,0 +1,92 @@
+""" Validate the Images of a Dataset Inventory
+
+Checks all images of a dataset inventory before creating the dataset
+(missing files, empty files, corrupt / truncated headers) and collects
+the format, dimensions and file size of each image. Writes:
+- quarantine.json: invalid images and the reason
+- image_info.json: format, width, height and file size of valid images
+Optionally exports the inventory without the invalid images.
+
+Example Usage:
+--------------
+python validate_dataset_inventory.py \
+-inventory /my_data/dataset_inventory.json \
+-output_dir /my_data/validation/ \
+-export_path /my_data/dataset_inventory_valid.json
+"""
+import os
+import argparse
+import logging
+
+from camera_trap_classifier.config.logging import setup_logging
+from camera_trap_classifier.data.inventory import DatasetInventoryMaster
+from camera_trap_classifier.data.preflight import ImageValidator
+
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(prog='VALIDATE DATASET INVENTORY')
+    parser.add_argument("-inventory", type=str, required=True,
+                        help="path to inventory json file")
+    parser.add_argument("-output_dir", type=str, required=True,
+                        help="Directory to write the quarantine list and \
+                              the image info to")
+    parser.add_argument("-export_path", type=str, default=None,
+                        required=False,
+                        help="the full path to a json file which will contain\
+                              the dataset inventory without invalid images \
+                              (records without any valid image are removed)")
+    parser.add_argument(
+        "-log_outdir", type=str, required=False, default=None,
+        help="Directory to write logfiles to (defaults to output_dir)")
+    parser.add_argument("-image_root_path", type=str, default=None,
+                        help="Root path of all images - will be appended to\
+                              the image paths stored in the dataset inventory",
+                        required=False)
+    parser.add_argument("-n_threads", type=int, default=32,
+                        required=False,
+                        help="number of threads to check the images \
+                              (default 32)")
+
+    # Parse command line arguments
+    args = vars(parser.parse_args())
+
+    # Configure Logging
+    if args['log_outdir'] is None:
+        args['log_outdir'] = args['output_dir']
+
+    if not os.path.exists(args['output_dir']):
+        os.makedirs(args['output_dir'])
+
+    setup_logging(log_output_path=args['log_outdir'])
+
+    logger = logging.getLogger(__name__)
+
+    print("Using arguments:")
+    for k, v in args.items():
+        print("Arg: %s: %s" % (k, v))
+
+    dinv = DatasetInventoryMaster()
+    dinv.create_from_source('json', {'path': args['inventory']})
+
+    validator = ImageValidator(
+        image_root_path=args['image_root_path'],
+        n_threads=args['n_threads'])
+    validator.validate_inventory(dinv)
+    validator.log_quarantine_stats()
+
+    validator.export_quarantine(
+        os.path.join(args['output_dir'], 'quarantine.json'))
+    validator.export_image_info(
+        os.path.join(args['output_dir'], 'image_info.json'))
+
+    if args['export_path'] is not None:
+        dinv.remove_images(validator.quarantine.keys())
+        dinv.log_stats()
+        dinv.export_to_json(json_path=args['export_path'])
+
+    logger.info("Finished validating images")
+
+
+if __name__ == '__main__':
+    main()
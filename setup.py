@@ -13,12 +13,15 @@ setup(
     ],
     extras_require={
         'tf': ['tensorflow==1.12'],
-        'tf-gpu': ['tensorflow-gpu==1.12']
+        'tf-gpu': ['tensorflow-gpu==1.12'],
+        'pillow': ['Pillow']
     },
     entry_points={
         'console_scripts': [
             'ctc.create_dataset_inventory = camera_trap_classifier.create_dataset_inventory:main',
+            'ctc.validate_dataset_inventory = camera_trap_classifier.validate_dataset_inventory:main',
             'ctc.create_dataset = camera_trap_classifier.create_dataset:main',
+            'ctc.merge_dataset_workers = camera_trap_classifier.merge_dataset_workers:main',
             'ctc.train = camera_trap_classifier.train:main',
             'ctc.predict = camera_trap_classifier.predict:main',
             'ctc.export = camera_trap_classifier.export:main'